@@ -0,0 +1,40 @@
+"""Micro-benchmark: WireGuard key generation in-process vs. wg subprocesses.
+
+Run on the VPN server from the project root:
+
+    python -m benchmarks.wg_keys -n 200
+"""
+import argparse
+import asyncio
+import shutil
+import time
+
+from services.vpn_manager import X25519PrivateKey, generate_wg_keys
+
+
+async def measure(native, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        await generate_wg_keys(native=native)
+    return time.perf_counter() - start
+
+
+async def main(count):
+    results = {}
+    if X25519PrivateKey is not None:
+        results["native (cryptography)"] = await measure(True, count)
+    else:
+        print("cryptography is not installed, skipping the native path")
+    if shutil.which("wg"):
+        results["subprocess (wg genkey/pubkey/genpsk)"] = await measure(False, count)
+    else:
+        print("wg binary not found, skipping the subprocess path")
+
+    for name, elapsed in results.items():
+        print(f"{name:40} {elapsed / count * 1000:8.3f} ms/peer  ({count} peers in {elapsed:.2f} s)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--count", type=int, default=200)
+    asyncio.run(main(parser.parse_args().count))
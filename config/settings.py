@@ -7,6 +7,17 @@ TOKEN = os.getenv("TOKEN")
 ADMIN_ID = os.getenv("ADMIN_ID")
 SUPPORT_ID = os.getenv("SUPPORT_ID")
 DATABASE_PATH = os.getenv("DATABASE_PATH", "users.db")
+DATABASE_READERS = int(os.getenv("DATABASE_READERS", "4"))
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", "60"))
+USER_CACHE_MAX_SIZE = int(os.getenv("USER_CACHE_MAX_SIZE", "10000"))
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "10"))
+BROADCAST_PAGE_SIZE = int(os.getenv("BROADCAST_PAGE_SIZE", "500"))
+RENEW_CONCURRENCY = int(os.getenv("RENEW_CONCURRENCY", "4"))
+RENEW_BATCH_SIZE = int(os.getenv("RENEW_BATCH_SIZE", "100"))
+EXPIRY_PRELOAD = int(os.getenv("EXPIRY_PRELOAD", "100"))
+EXPIRY_MAX_SLEEP = int(os.getenv("EXPIRY_MAX_SLEEP", "3600"))
+PROVISIONING_WORKERS = int(os.getenv("PROVISIONING_WORKERS", "2"))
 
 if not TOKEN:
     raise ValueError("TOKEN environment variable is not set or is empty.")
@@ -1,72 +1,20 @@
-import aiosqlite
 import logging
-from config.settings import DATABASE_PATH
+from config.settings import DATABASE_PATH, DATABASE_READERS
+from core.migrations import run_migrations
+from core.pool import ConnectionPool
 
 logger = logging.getLogger(__name__)
 
 
-async def init_conn_db() -> None:
-    """Создает таблицу пользователей в базе данных, если она не существует."""
-    try:
-        # Use async with for connection management
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            await db.execute(
-                """
-                CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY,
-                    username TEXT,
-                    status TEXT DEFAULT 'pending',
-                    access_granted_date TEXT,
-                    access_duration INTEGER,
-                    access_end_date TEXT,
-                    last_notification_id INTEGER,
-                    has_used_trial INTEGER DEFAULT 0
-                )
-                """
-            )
-            # Check if has_used_trial column exists and add it if not (for existing databases)
-            cursor = await db.execute("PRAGMA table_info(users)")
-            columns = [column[1] for column in await cursor.fetchall()]
-            if 'has_used_trial' not in columns:
-                await db.execute('ALTER TABLE users ADD COLUMN has_used_trial INTEGER DEFAULT 0')
-                logger.info("Added 'has_used_trial' column to 'users' table.")
-            await db.commit()
-        logger.info("Таблица успешно создана или уже существует.")
-    except aiosqlite.Error:
-        logger.error("Ошибка при создании таблицы:", exc_info=True)
+pool = ConnectionPool(DATABASE_PATH, readers=DATABASE_READERS)
+
 
-    try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            await db.execute(
-                """
-                CREATE TABLE IF NOT EXISTS promo_codes (
-                    code TEXT PRIMARY KEY,
-                    days_duration INTEGER NOT NULL,
-                    is_active INTEGER DEFAULT 1,
-                    usage_count INTEGER DEFAULT 1
-                )
-                """
-            )
-            await db.commit()
-        logger.info("Таблица promo_codes успешно создана или уже существует.")
-    except aiosqlite.Error:
-        logger.error("Ошибка при создании таблицы promo_codes:", exc_info=True)
+async def init_conn_db() -> None:
+    """Приводит схему БД к актуальной версии и открывает пул соединений."""
+    await run_migrations(DATABASE_PATH)
+    await pool.open()
 
-    try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            await db.execute(
-                """
-                CREATE TABLE IF NOT EXISTS user_promo_codes (
-                    user_id INTEGER NOT NULL,
-                    promo_code TEXT NOT NULL,
-                    PRIMARY KEY (user_id, promo_code),
-                    FOREIGN KEY (user_id) REFERENCES users(id),
-                    FOREIGN KEY (promo_code) REFERENCES promo_codes(code)
-                )
-                """
-            )
-            await db.commit()
-        logger.info("Таблица user_promo_codes успешно создана или уже существует.")
-    except aiosqlite.Error:
-        logger.error("Ошибка при создании таблицы user_promo_codes:", exc_info=True)
 
+async def close_conn_db() -> None:
+    """Корректно закрывает пул соединений с БД при остановке бота."""
+    await pool.close()
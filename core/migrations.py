@@ -0,0 +1,226 @@
+import logging
+
+import aiosqlite
+
+logger = logging.getLogger(__name__)
+
+
+# Каждая миграция идемпотентна: базы, созданные до появления версий
+# (user_version = 0), уже содержат часть таблиц и столбцов, поэтому миграции
+# проверяют текущее состояние схемы, а не полагаются только на номер версии.
+
+
+async def _get_columns(db: aiosqlite.Connection, table: str) -> dict:
+    """Возвращает столбцы таблицы и их объявленные типы."""
+    async with db.execute(f"PRAGMA table_info({table})") as cursor:
+        return {column[1]: column[2] for column in await cursor.fetchall()}
+
+
+async def _add_column(
+    db: aiosqlite.Connection, table: str, column: str, definition: str
+) -> None:
+    if column not in await _get_columns(db, table):
+        await db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        logger.info(f"Добавлен столбец '{column}' в таблицу '{table}'.")
+
+
+async def create_base_schema(db: aiosqlite.Connection) -> None:
+    """Базовая схема: пользователи и промокоды."""
+    await db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY,
+            username TEXT,
+            status TEXT DEFAULT 'pending',
+            access_granted_date TEXT,
+            access_duration INTEGER,
+            access_end_date TEXT,
+            last_notification_id INTEGER,
+            has_used_trial INTEGER DEFAULT 0
+        )
+        """
+    )
+    await _add_column(db, "users", "has_used_trial", "INTEGER DEFAULT 0")
+    await db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS promo_codes (
+            code TEXT PRIMARY KEY,
+            days_duration INTEGER NOT NULL,
+            is_active INTEGER DEFAULT 1,
+            usage_count INTEGER DEFAULT 1
+        )
+        """
+    )
+    await db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS user_promo_codes (
+            user_id INTEGER NOT NULL,
+            promo_code TEXT NOT NULL,
+            PRIMARY KEY (user_id, promo_code),
+            FOREIGN KEY (user_id) REFERENCES users(id),
+            FOREIGN KEY (promo_code) REFERENCES promo_codes(code)
+        )
+        """
+    )
+
+
+async def add_is_blocked(db: aiosqlite.Connection) -> None:
+    """Признак того, что пользователь заблокировал бота."""
+    await _add_column(db, "users", "is_blocked", "INTEGER DEFAULT 0")
+
+
+async def create_broadcast_tables(db: aiosqlite.Connection) -> None:
+    """Задания рассылок и результаты доставки."""
+    await db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS broadcast_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            text TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'running',
+            cursor_user_id INTEGER NOT NULL DEFAULT 0,
+            total INTEGER NOT NULL DEFAULT 0,
+            report_chat_id INTEGER,
+            progress_message_id INTEGER,
+            created_at TEXT,
+            finished_at TEXT
+        )
+        """
+    )
+    await db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+            job_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            state TEXT NOT NULL,
+            PRIMARY KEY (job_id, user_id),
+            FOREIGN KEY (job_id) REFERENCES broadcast_jobs(id)
+        )
+        """
+    )
+
+
+async def create_file_id_tables(db: aiosqlite.Connection) -> None:
+    """file_id Telegram для картинок из assets/ и файлов конфигураций."""
+    await db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS asset_file_ids (
+            path TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            signature TEXT NOT NULL,
+            file_id TEXT NOT NULL,
+            PRIMARY KEY (path, kind)
+        )
+        """
+    )
+    await db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS config_file_ids (
+            user_id INTEGER NOT NULL,
+            prefix TEXT NOT NULL,
+            content_hash TEXT NOT NULL,
+            file_id TEXT NOT NULL,
+            PRIMARY KEY (user_id, prefix)
+        )
+        """
+    )
+
+
+async def convert_access_end_date(db: aiosqlite.Connection) -> None:
+    """access_end_date в epoch-секундах и индекс (status, access_end_date).
+
+    SQLite не умеет менять тип столбца, поэтому таблица users пересоздается:
+    данные копируются в новую таблицу с переводом ISO-строк через
+    strftime('%s'), после чего старая таблица удаляется.
+    """
+    columns = await _get_columns(db, "users")
+    if columns.get("access_end_date") != "INTEGER":
+        await db.execute(
+            """
+            CREATE TABLE users_new (
+                id INTEGER PRIMARY KEY,
+                username TEXT,
+                status TEXT DEFAULT 'pending',
+                access_granted_date TEXT,
+                access_duration INTEGER,
+                access_end_date INTEGER,
+                last_notification_id INTEGER,
+                has_used_trial INTEGER DEFAULT 0,
+                is_blocked INTEGER DEFAULT 0
+            )
+            """
+        )
+        await db.execute(
+            """
+            INSERT INTO users_new (id, username, status, access_granted_date, access_duration,
+                                   access_end_date, last_notification_id, has_used_trial, is_blocked)
+            SELECT id, username, status, access_granted_date, access_duration,
+                   CASE WHEN typeof(access_end_date) = 'text'
+                        THEN CAST(strftime('%s', access_end_date) AS INTEGER)
+                        ELSE access_end_date END,
+                   last_notification_id, has_used_trial, is_blocked
+            FROM users
+            """
+        )
+        await db.execute("DROP TABLE users")
+        await db.execute("ALTER TABLE users_new RENAME TO users")
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_users_status_access_end_date ON users (status, access_end_date)"
+    )
+
+
+async def create_provisioning_jobs(db: aiosqlite.Connection) -> None:
+    """Очередь заданий на создание VPN-конфигураций (одно задание на пользователя)."""
+    await db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS provisioning_jobs (
+            user_id INTEGER PRIMARY KEY,
+            notice TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            version INTEGER NOT NULL DEFAULT 1,
+            updated_at TEXT,
+            error TEXT
+        )
+        """
+    )
+
+
+# Упорядоченный список миграций: версия схемы = номер последней примененной
+# (PRAGMA user_version). Новые миграции добавляются только в конец.
+MIGRATIONS = [
+    create_base_schema,
+    add_is_blocked,
+    create_broadcast_tables,
+    create_file_id_tables,
+    convert_access_end_date,
+    create_provisioning_jobs,
+]
+
+
+async def run_migrations(path: str) -> None:
+    """Применяет недостающие миграции одной транзакцией.
+
+    Если схема уже актуальна, стоимость запуска — одно чтение user_version.
+    """
+    async with aiosqlite.connect(path, isolation_level=None) as db:
+        async with db.execute("PRAGMA user_version") as cursor:
+            version = (await cursor.fetchone())[0]
+        if version >= len(MIGRATIONS):
+            logger.info(f"Схема БД актуальна (версия {version}).")
+            return
+
+        await db.execute("BEGIN IMMEDIATE")
+        try:
+            for number, migration in enumerate(
+                MIGRATIONS[version:], start=version + 1
+            ):
+                await migration(db)
+                logger.info(
+                    f"Применена миграция {number}: {migration.__doc__.splitlines()[0]}"
+                )
+            await db.execute(f"PRAGMA user_version = {len(MIGRATIONS)}")
+            await db.execute("COMMIT")
+        except BaseException:
+            await db.execute("ROLLBACK")
+            logger.error("Ошибка при миграции схемы БД, изменения отменены.")
+            raise
@@ -0,0 +1,104 @@
+import asyncio
+import aiosqlite
+import logging
+from contextlib import asynccontextmanager
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectionPool:
+    """Пул долгоживущих соединений aiosqlite: один писатель и несколько читателей.
+
+    Соединения открываются один раз при старте, по умолчанию переводят БД в
+    режим WAL (читатели не блокируются писателем) и переиспользуют кэш
+    подготовленных выражений sqlite3 между запросами. journal_mode=None
+    оставляет режим журнала как есть — для чужих БД, например xray.db.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        readers: int = 4,
+        cached_statements: int = 256,
+        journal_mode: Optional[str] = "WAL",
+    ):
+        self.path = path
+        self.journal_mode = journal_mode
+        self.readers_count = max(1, readers)
+        self.cached_statements = cached_statements
+        self._writer = None
+        self._write_lock = asyncio.Lock()
+        self._readers = None
+        self._all_readers = []
+
+    @property
+    def is_open(self) -> bool:
+        return self._writer is not None
+
+    async def _connect(self, read_only: bool = False) -> aiosqlite.Connection:
+        conn = await aiosqlite.connect(
+            self.path, cached_statements=self.cached_statements
+        )
+        if self.journal_mode:
+            await conn.execute(f"PRAGMA journal_mode={self.journal_mode}")
+            await conn.execute("PRAGMA synchronous=NORMAL")
+        await conn.execute("PRAGMA busy_timeout=5000")
+        if read_only:
+            await conn.execute("PRAGMA query_only=ON")
+        return conn
+
+    async def open(self) -> None:
+        """Открывает соединение писателя и пул соединений читателей."""
+        if self.is_open:
+            return
+        self._writer = await self._connect()
+        self._readers = asyncio.Queue()
+        for _ in range(self.readers_count):
+            conn = await self._connect(read_only=True)
+            self._all_readers.append(conn)
+            self._readers.put_nowait(conn)
+        logger.info(
+            f"Пул соединений к {self.path} открыт: 1 писатель, {self.readers_count} читателей."
+        )
+
+    async def close(self) -> None:
+        """Дожидается завершения текущей записи и закрывает все соединения."""
+        if not self.is_open:
+            return
+        async with self._write_lock:
+            for conn in self._all_readers:
+                await conn.close()
+            await self._writer.close()
+            self._all_readers = []
+            self._readers = None
+            self._writer = None
+        logger.info(f"Пул соединений к {self.path} закрыт.")
+
+    @asynccontextmanager
+    async def reader(self):
+        """Выдает соединение только для чтения из пула."""
+        if not self.is_open:
+            raise RuntimeError("Пул соединений с БД не инициализирован.")
+        conn = await self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put_nowait(conn)
+
+    @asynccontextmanager
+    async def writer(self):
+        """Выдает единственное соединение писателя в рамках одной транзакции.
+
+        При успешном выходе из блока транзакция фиксируется, при исключении
+        откатывается.
+        """
+        if not self.is_open:
+            raise RuntimeError("Пул соединений с БД не инициализирован.")
+        async with self._write_lock:
+            try:
+                yield self._writer
+                await self._writer.commit()
+            except BaseException:
+                await self._writer.rollback()
+                raise
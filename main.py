@@ -3,9 +3,16 @@ import locale
 import logging
 
 from core.bot import dp, bot
-from core.database import init_conn_db
+from core.database import init_conn_db, close_conn_db
 from services.scheduler import start_scheduler
-from services.vpn_manager import set_server_ip_async
+from services.broadcast import resume_broadcast_jobs
+from services.assets import AssetFileIdMiddleware, load_asset_file_ids
+from services.provisioning import start_provisioning_workers
+from services.vpn_manager import (
+    set_server_ip_async,
+    ensure_openvpn_initialized,
+    close_xray_db,
+)
 
 # Import handlers from modules
 # This will be updated as we move handlers to their new locations
@@ -15,6 +22,8 @@ from modules.vpn_management.handlers import vpn_management_router
 from modules.user_onboarding.handlers import user_onboarding_router
 from modules.common.handlers import common_router
 from modules.user_onboarding.entry import user_onboarding_entry_router
+from modules.user_onboarding.services import send_provisioning_result
+from modules.admin.services import resync_xray_clients
 
 # Устанавливаем локаль для форматирования времени
 locale.setlocale(locale.LC_TIME, "ru_RU.UTF8")
@@ -26,8 +35,16 @@ logger = logging.getLogger(__name__)
 async def main() -> None:
     """Главная асинхронная функция для инициализации бота"""
     await set_server_ip_async()  # Инициализация IP-адреса сервера
+    await ensure_openvpn_initialized()  # Однократная проверка/инициализация PKI OpenVPN
     await init_conn_db()  # Инициализация соединения с БД
+    await load_asset_file_ids()  # Загружаем file_id уже загруженных картинок
+    bot.session.middleware(AssetFileIdMiddleware())  # Отправляем assets/ по file_id
     await start_scheduler(bot)  # Запускаем планировщик задач
+    await resume_broadcast_jobs()  # Продолжаем прерванные перезапуском рассылки
+    await start_provisioning_workers(send_provisioning_result)  # Воркеры создания конфигураций
+    # Xray хранит добавленных через API пользователей только в памяти,
+    # поэтому после перезапуска регистрируем их заново (в фоне)
+    xray_resync = asyncio.create_task(resync_xray_clients())
     await bot.delete_webhook(
         drop_pending_updates=True
     )  # Удаляем вебхуки, если они есть
@@ -42,7 +59,9 @@ async def main() -> None:
     try:
         await dp.start_polling(bot)  # Запускаем бота
     finally:
-        pass
+        xray_resync.cancel()
+        await close_conn_db()  # Закрываем пул соединений с БД
+        await close_xray_db()  # и с xray.db
 
 
 if __name__ == "__main__":
@@ -18,15 +18,28 @@ from services.db_operations import (
     add_promo_code,
     delete_promo_code,
     get_all_promo_codes,
-    grant_access_and_create_config,
+    grant_access,
     get_pending_requests,
+    get_active_broadcast_jobs,
+    get_broadcast_delivery_counts,
 )
-from services.messages_manage import broadcast_message
+from services.broadcast import (
+    start_broadcast,
+    pause_broadcast,
+    resume_broadcast,
+    cancel_broadcast,
+)
+from services.provisioning import enqueue_provisioning
+from services import vpn_manager
+from services.user_cache import user_cache
 from services.forms import Form
-from modules.admin.services import get_day_word, update_user_configs
+from modules.admin.services import (
+    get_day_word,
+    update_user_configs,
+    renew_all_configs,
+    resync_xray_clients,
+)
 from modules.admin.filters import IsAdmin
-from modules.common.services import main_menu
-from modules.user_onboarding.services import enter_caption
 
 logger = logging.getLogger(__name__)
 
@@ -50,6 +63,9 @@ async def admin_menu(message: types.Message):
         types.InlineKeyboardButton(
             text="Рассылка сообщений", callback_data="broadcast"
         ),
+        types.InlineKeyboardButton(
+            text="Управление рассылками", callback_data="broadcast_jobs"
+        ),
         types.InlineKeyboardButton(
             text="Получить список пользователей", callback_data="get_users"
         ),
@@ -77,6 +93,9 @@ async def admin_menu_callback(call: types.CallbackQuery, state: FSMContext):
         types.InlineKeyboardButton(
             text="Рассылка сообщений", callback_data="broadcast"
         ),
+        types.InlineKeyboardButton(
+            text="Управление рассылками", callback_data="broadcast_jobs"
+        ),
         types.InlineKeyboardButton(
             text="Получить список пользователей", callback_data="get_users"
         ),
@@ -101,16 +120,15 @@ async def check_requests_callback(call: types.CallbackQuery):
         response_text = "<b>Ожидающие запросы:</b>"
 
         for user in pending_requests:
-            user_id, username, status, _, _, _, _, _ = user  # Unpack all fields
-            response_text += f"ID: <code>{user_id}</code>\n"
-            response_text += f"Username: @{username}\n"
-            response_text += f"Статус: {status}\n"
+            response_text += f"ID: <code>{user.id}</code>\n"
+            response_text += f"Username: @{user.username}\n"
+            response_text += f"Статус: {user.status}\n"
 
             markup = types.InlineKeyboardMarkup(
                 inline_keyboard=[
                     [
                         types.InlineKeyboardButton(
-                            text="✅ Принять", callback_data=f"accept_request_{user_id}"
+                            text="✅ Принять", callback_data=f"accept_request_{user.id}"
                         ),
                     ]
                 ]
@@ -153,21 +171,14 @@ async def accept_request_callback(call: types.CallbackQuery):
     trial_days = 30  # Example: 30 days access
 
     try:
-        await grant_access_and_create_config(user_id, trial_days)
+        await grant_access(user_id, trial_days)
+        # Конфигурации создаются в фоне; приветствие и меню отправит воркер
+        await enqueue_provisioning(user_id, "accepted")
 
         await call.message.edit_text(
-            f"✅ Запрос пользователя <code>{user_id}</code> принят. Доступ предоставлен на {trial_days} дней.",
+            f"✅ Запрос пользователя <code>{user_id}</code> принят. Доступ предоставлен на {trial_days} дней, конфигурации создаются.",
             parse_mode="HTML",
         )
-        await bot.send_animation(
-            chat_id=user_id,
-            animation=types.FSInputFile("assets/accepted.gif"),
-            caption=(
-                enter_caption + "\n\n" "💳 <b>Вам был выдан доступ к MatrixVPN</b>\n"
-            ),
-            parse_mode="HTML",
-        )
-        await main_menu(user_id=user_id)  # Send main menu to the user
     except Exception as e:
         await call.message.edit_text(
             f"❌ Ошибка при принятии запроса пользователя <code>{user_id}</code>: {e}",
@@ -251,7 +262,7 @@ async def list_promos_menu_callback(call: types.CallbackQuery):
     if promo_codes:
         response = "Список промокодов:\n\n"
         for promo in promo_codes:
-            response += f"Код: `{promo[0]}`, Дни: {promo[1]}, Активен: {'Да' if promo[2] == 1 else 'Нет'}, Использований осталось: {promo[3]}\n"
+            response += f"Код: `{promo.code}`, Дни: {promo.days_duration}, Активен: {'Да' if promo.is_active == 1 else 'Нет'}, Использований осталось: {promo.usage_count}\n"
     else:
         response = "Промокодов нет."
 
@@ -282,53 +293,13 @@ async def process_promo_code_to_delete(message: types.Message, state: FSMContext
 async def renew_configs_handler(message: types.Message):
     """Обработчик для обновления конфигураций."""
     users_data = await get_accepted_users()
-    failed_users = []
-    for user in users_data:
-        user_id, username, access_end_date = user
-        try:
-            access_end_date = datetime.fromisoformat(access_end_date).astimezone(
-                pytz.UTC
-            )
-            remaining_time = access_end_date - datetime.now(pytz.UTC)
-            days = int(remaining_time.days)
-
-            if await update_user_configs(user_id, days):
-                day_word = get_day_word(days)
-                markup = types.InlineKeyboardMarkup(
-                    inline_keyboard=[
-                        [
-                            types.InlineKeyboardButton(
-                                text="🏠 В Главное Меню", callback_data="main_menu"
-                            )
-                        ],
-                    ]
-                )
-
-                await bot.send_photo(
-                    chat_id=user_id,
-                    photo=types.FSInputFile("assets/warning.png"),
-                    caption=f"🚨 <b>Внимание! Произошло обновление конфигурации!</b>\n\n"
-                    "<b>Ваши конфигурационные файлы были обновлены!</b>\n\n"
-                    f"Доступ к <b>MatrixVPN</b> заканчивается через <b>{days} {day_word}</b>.\n\n"
-                    "<b>⚠️ ВАЖНО: Пожалуйста, замените предыдущие конфигурационные файлы, чтобы избежать проблем с подключением.</b>",
-                    parse_mode="HTML",
-                    reply_markup=markup,
-                )
-            else:
-                failed_users.append(f"@{username} (ID: {user_id})")
-
-        except TelegramAPIError as e:
-            logger.error(
-                f"Ошибка при обновлении конфигураций для пользователя {user_id} (@{username}): {e}",
-                exc_info=True,
-            )
-            failed_users.append(f"@{username} (ID: {user_id})")
+    stats = await renew_all_configs(users_data, message.chat.id)
 
-    if failed_users:
+    if stats.failed_users:
         await bot.send_message(
             ADMIN_ID,
             "⚠️ Конфигурации обновлены не для всех пользователей. Ошибки для:\n"
-            + "\n".join(failed_users),
+            + "\n".join(stats.failed_users),
         )
     else:
         await bot.send_message(
@@ -354,7 +325,9 @@ async def process_user_id(message: types.Message, state: FSMContext):
         if await delete_user(int(user_id)):
             await message.answer(f"Пользователь с ID {user_id} был удалён.")
         else:
-            await message.answer(f"Пользователь с ID {user_id} не найден.")
+            await message.answer(
+                f"Не удалось удалить пользователя с ID {user_id}. Подробности в логах."
+            )
     else:
         await message.answer("Пожалуйста, введите корректный ID пользователя.")
     await state.clear()
@@ -371,11 +344,82 @@ async def broadcast_callback(call: types.CallbackQuery, state: FSMContext):
 async def process_broadcast_message(message: types.Message, state: FSMContext):
     """Обработчик для рассылки сообщений."""
     text = message.text.strip()
-    await broadcast_message(text)
-    await message.answer("Сообщение разослано всем пользователям.")
+    job = await start_broadcast(text, message.chat.id)
+    await message.answer(
+        f"Рассылка #{job.id} запущена. Прогресс и итоговый отчет будут приходить в этот чат.\n"
+        "Приостановить или отменить ее можно в меню «Управление рассылками»."
+    )
     await state.clear()
 
 
+@admin_router.callback_query(lambda call: call.data == "broadcast_jobs", IsAdmin())
+async def broadcast_jobs_callback(call: types.CallbackQuery):
+    """Показывает незавершенные рассылки с кнопками паузы, продолжения и отмены."""
+    jobs = await get_active_broadcast_jobs()
+    if not jobs:
+        await call.message.answer("Активных рассылок нет.")
+        await call.answer()
+        return
+
+    for job in jobs:
+        counts = await get_broadcast_delivery_counts(job.id)
+        processed = sum(counts.values())
+        status_text = "идет" if job.status == "running" else "приостановлена"
+        preview = job.text if len(job.text) <= 100 else job.text[:100] + "…"
+        if job.status == "running":
+            toggle = types.InlineKeyboardButton(
+                text="⏸ Пауза", callback_data=f"broadcast_pause_{job.id}"
+            )
+        else:
+            toggle = types.InlineKeyboardButton(
+                text="▶️ Продолжить", callback_data=f"broadcast_resume_{job.id}"
+            )
+        markup = types.InlineKeyboardMarkup(
+            inline_keyboard=[
+                [
+                    toggle,
+                    types.InlineKeyboardButton(
+                        text="✖️ Отменить", callback_data=f"broadcast_cancel_{job.id}"
+                    ),
+                ]
+            ]
+        )
+        await call.message.answer(
+            f"Рассылка #{job.id} ({status_text})\n"
+            f"Обработано: {processed}/{max(job.total, processed)}\n\n"
+            f"{preview}",
+            reply_markup=markup,
+        )
+    await call.answer()
+
+
+@admin_router.callback_query(
+    lambda call: call.data.startswith(
+        ("broadcast_pause_", "broadcast_resume_", "broadcast_cancel_")
+    ),
+    IsAdmin(),
+)
+async def broadcast_control_callback(call: types.CallbackQuery):
+    """Приостанавливает, продолжает или отменяет рассылку."""
+    _, action, job_id = call.data.split("_")
+    job_id = int(job_id)
+    actions = {
+        "pause": (pause_broadcast, "приостановлена"),
+        "resume": (resume_broadcast, "продолжена"),
+        "cancel": (cancel_broadcast, "отменена"),
+    }
+    handler, done_text = actions[action]
+    if await handler(job_id):
+        await call.message.edit_text(f"Рассылка #{job_id} {done_text}.")
+    else:
+        await call.answer(
+            f"Рассылка #{job_id} уже завершена или находится в другом состоянии.",
+            show_alert=True,
+        )
+        return
+    await call.answer()
+
+
 @admin_router.callback_query(lambda call: call.data == "get_users", IsAdmin())
 async def get_users_callback(call: types.CallbackQuery):
     """Обработчик для получения списка пользователей."""
@@ -409,7 +453,7 @@ async def renew_access(message: types.Message):
             await message.reply(f"Пользователь с ID {user_id} не найден в базе данных.")
             return
 
-        current_end_date = datetime.fromisoformat(user[5]).astimezone(pytz.UTC)
+        current_end_date = user.access_end_date
 
         if days_str.startswith("+"):
             new_end_date = current_end_date + timedelta(days=days_to_add)
@@ -419,7 +463,7 @@ async def renew_access(message: types.Message):
         access_duration = (new_end_date - datetime.now(pytz.UTC)).days
 
         if await update_user_configs(user_id, access_duration + 1):
-            await update_user_access(user_id, new_end_date.isoformat())
+            await update_user_access(user_id, new_end_date)
             markup = types.InlineKeyboardMarkup(
                 inline_keyboard=[
                     [
@@ -482,13 +526,13 @@ async def update_access(message: types.Message):
             await message.reply(f"Пользователь с ID {user_id} не найден в базе данных.")
             return
 
-        current_end_date = datetime.fromisoformat(user[5]).astimezone(pytz.UTC)
+        current_end_date = user.access_end_date
 
         new_end_date = current_end_date + timedelta(days=days_to_add)
 
         access_duration = (new_end_date - datetime.now(pytz.UTC)).days
 
-        await update_user_access(user_id, new_end_date.isoformat())
+        await update_user_access(user_id, new_end_date)
         markup = types.InlineKeyboardMarkup(
             inline_keyboard=[
                 [
@@ -522,6 +566,58 @@ async def update_access(message: types.Message):
         )
 
 
+@admin_router.message(Command("cachestats"), IsAdmin())
+async def cache_stats_handler(message: types.Message):
+    """Обработчик для команды /cachestats."""
+    stats = user_cache.stats()
+    await message.reply(
+        "Кэш пользователей:\n"
+        f"Попаданий: {stats['hits']}\n"
+        f"Промахов (запросов к БД): {stats['misses']}\n"
+        f"Доля попаданий: {stats['hit_rate']:.1%}\n"
+        f"Записей в кэше: {stats['size']}"
+    )
+
+
+@admin_router.message(Command("reconcilexray"), IsAdmin())
+async def reconcile_xray_handler(message: types.Message):
+    """Обработчик для команды /reconcilexray: сверяет xray.db с пользователями Xray."""
+    try:
+        result = await vpn_manager.reconcile_xray()
+    except ConnectionError as e:
+        logger.error(f"Не удалось сверить пользователей Xray: {e}")
+        await message.reply(f"❌ Xray недоступен: {e}")
+        return
+    await message.reply(
+        "Сверка пользователей Xray завершена.\n"
+        f"В xray.db: {result['db']}\n"
+        f"В Xray до сверки: {result['xray']}\n"
+        f"Не хватало в Xray: {result['missing']}\n"
+        f"С другим UUID: {result['changed']}\n"
+        f"Лишних в Xray: {result['extra']}\n"
+        f"Добавлено: {result['added']}\n"
+        f"Удалено лишних: {result['removed']}"
+    )
+
+
+@admin_router.message(Command("resyncxray"), IsAdmin())
+async def resync_xray_handler(message: types.Message):
+    """Обработчик для команды /resyncxray: повторно добавляет всех пользователей в Xray."""
+    result = await resync_xray_clients()
+    if result is None:
+        await message.reply("❌ Xray недоступен, повторная регистрация не выполнена.")
+        return
+    elapsed = result["elapsed"]
+    rate = result["total"] / elapsed if elapsed else 0
+    await message.reply(
+        "Повторная регистрация пользователей в Xray завершена.\n"
+        f"Пользователей в xray.db: {result['total']}\n"
+        f"Зарегистрировано: {result['registered']}\n"
+        f"Ошибки: {result['failed']}\n"
+        f"Время: {elapsed:.2f} с ({rate:.0f} польз./с)"
+    )
+
+
 @admin_router.message(Command("refund"), IsAdmin())
 async def refund_stars_handler(message: types.Message):
     """Обработчик для команды /refund."""
@@ -1,6 +1,18 @@
+import asyncio
+import time
 import logging
+from datetime import datetime
 
+import pytz
+from aiogram import types
+from aiogram.exceptions import TelegramAPIError
+
+from core.bot import bot
+from config.settings import BROADCAST_CONCURRENCY, RENEW_CONCURRENCY, RENEW_BATCH_SIZE
 from services import vpn_manager
+from services.db_operations import delete_config_file_ids
+from services.broadcast import deliver_with_retry, report_progress, telegram_limiter
+from services.models import AccessRecord
 
 logger = logging.getLogger(__name__)
 
@@ -16,13 +28,182 @@ def get_day_word(days: int) -> str:
         return "дней"
 
 
-async def update_user_configs(user_id: int, days: int) -> bool:
+async def update_user_configs(user_id: int, days: int, wireguard: bool = True) -> bool:
     """Updates user VPN configurations."""
     try:
-        # Recreate configurations (vpn_manager.create_user handles existing ones)
-        await vpn_manager.create_user(user_id)
+        # Renewal always reissues the keys, even if valid ones exist
+        await vpn_manager.create_user(user_id, wireguard=wireguard, force=True)
+        await delete_config_file_ids([user_id])
         logger.info(f"Обновлены конфигурации для пользователя {user_id}.")
         return True
     except Exception as e:
         logger.error(f"Ошибка при обновлении конфигураций для пользователя {user_id}: {e}", exc_info=True)
         return False
+
+
+async def resync_xray_clients():
+    """Повторно регистрирует в Xray всех пользователей из xray.db (после перезапуска Xray).
+
+    Возвращает счетчики vpn_manager.resync_xray() или None, если Xray недоступен.
+    """
+    try:
+        result = await vpn_manager.resync_xray()
+    except ConnectionError as e:
+        logger.error(f"Xray недоступен, повторная регистрация пользователей пропущена: {e}")
+        return None
+    logger.info(
+        f"В Xray повторно зарегистрировано {result['registered']}/{result['total']} "
+        f"пользователей за {result['elapsed']:.2f} с, ошибок: {result['failed']}."
+    )
+    return result
+
+
+class RenewStats:
+    """Счетчики массового обновления конфигураций (/renewall)."""
+
+    def __init__(self, total: int):
+        self.total = total
+        self.regenerated = 0
+        self.failed = 0
+        self.notified = 0
+        self.not_notified = 0
+        self.failed_users = []
+        self.started_at = time.monotonic()
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    def format(self, finished: bool = False) -> str:
+        header = (
+            "✅ Обновление конфигураций завершено"
+            if finished
+            else "🔄 Идет обновление конфигураций"
+        )
+        return (
+            f"{header}\n\n"
+            f"Обновлено: {self.regenerated + self.failed}/{self.total}"
+            f" (ошибок: {self.failed})\n"
+            f"Уведомлено: {self.notified} (не доставлено: {self.not_notified})\n"
+            f"Время: {int(self.elapsed)} с"
+        )
+
+
+def renew_notification_caption(days: int) -> str:
+    return (
+        f"🚨 <b>Внимание! Произошло обновление конфигурации!</b>\n\n"
+        "<b>Ваши конфигурационные файлы были обновлены!</b>\n\n"
+        f"Доступ к <b>MatrixVPN</b> заканчивается через <b>{days} {get_day_word(days)}</b>.\n\n"
+        "<b>⚠️ ВАЖНО: Пожалуйста, замените предыдущие конфигурационные файлы, чтобы избежать проблем с подключением.</b>"
+    )
+
+
+async def notify_config_renewed(user_id: int, days: int) -> str:
+    """Уведомляет пользователя об обновлении конфигураций с учетом лимита Telegram."""
+    markup = types.InlineKeyboardMarkup(
+        inline_keyboard=[
+            [types.InlineKeyboardButton(text="🏠 В Главное Меню", callback_data="main_menu")],
+        ]
+    )
+    return await deliver_with_retry(
+        user_id,
+        lambda: bot.send_photo(
+            chat_id=user_id,
+            photo=types.FSInputFile("assets/warning.png"),
+            caption=renew_notification_caption(days),
+            parse_mode="HTML",
+            reply_markup=markup,
+        ),
+        telegram_limiter,
+    )
+
+
+async def renew_all_configs(
+    users: list[AccessRecord],
+    report_chat_id: int,
+    concurrency: int = RENEW_CONCURRENCY,
+    batch_size: int = RENEW_BATCH_SIZE,
+) -> RenewStats:
+    """Перевыпускает конфигурации пользователей конвейером с отчетом о прогрессе.
+
+    Пользователи обрабатываются пачками по batch_size: внутри пачки до
+    concurrency пользователей параллельно получают профили OpenVPN и VLESS,
+    затем пиры WireGuard всей пачки пересоздаются за одну запись и одну
+    синхронизацию на интерфейс, и только после этого пользователи пачки
+    передаются отдельной стадии уведомлений, которая работает параллельно
+    со следующей пачкой.
+    """
+    stats = RenewStats(len(users))
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    notify_queue = asyncio.Queue()
+
+    def mark_failed(user: AccessRecord):
+        stats.failed += 1
+        stats.failed_users.append(f"@{user.username} (ID: {user.id})")
+
+    def days_left(user: AccessRecord) -> int:
+        return int((user.access_end_date - datetime.now(pytz.UTC)).days)
+
+    async def regenerate(user: AccessRecord):
+        async with semaphore:
+            ok = await update_user_configs(user.id, days_left(user), wireguard=False)
+        if not ok:
+            mark_failed(user)
+        return ok
+
+    async def notifier():
+        while True:
+            item = await notify_queue.get()
+            if item is None:
+                return
+            user_id, days = item
+            if await notify_config_renewed(user_id, days) == "sent":
+                stats.notified += 1
+            else:
+                stats.not_notified += 1
+
+    progress_message = await bot.send_message(report_chat_id, stats.format())
+    reporter = asyncio.create_task(
+        report_progress(stats, report_chat_id, progress_message.message_id)
+    )
+    notifiers = [
+        asyncio.create_task(notifier()) for _ in range(max(1, BROADCAST_CONCURRENCY))
+    ]
+    try:
+        for start in range(0, len(users), batch_size):
+            batch = users[start : start + batch_size]
+            results = await asyncio.gather(*(regenerate(user) for user in batch))
+            renewed = [user for user, ok in zip(batch, results) if ok]
+            if not renewed:
+                continue
+            try:
+                await vpn_manager.create_wireguard_users([user.id for user in renewed])
+            except Exception as e:
+                logger.error(f"Ошибка при пересоздании пиров WireGuard: {e}", exc_info=True)
+                for user in renewed:
+                    mark_failed(user)
+                continue
+            stats.regenerated += len(renewed)
+            for user in renewed:
+                notify_queue.put_nowait((user.id, days_left(user)))
+        for _ in notifiers:
+            notify_queue.put_nowait(None)
+        await asyncio.gather(*notifiers)
+    finally:
+        for task in notifiers:
+            task.cancel()
+        reporter.cancel()
+
+    logger.info(
+        f"Обновление конфигураций завершено: {stats.regenerated} обновлено, "
+        f"{stats.failed} ошибок, {stats.notified} уведомлено за {stats.elapsed:.1f} с."
+    )
+    try:
+        await bot.edit_message_text(
+            stats.format(finished=True),
+            chat_id=report_chat_id,
+            message_id=progress_message.message_id,
+        )
+    except TelegramAPIError:
+        await bot.send_message(report_chat_id, stats.format(finished=True))
+    return stats
@@ -1,10 +1,8 @@
 from aiogram import types, Router, F
-from modules.user_onboarding.services import enter_caption
 from modules.admin.services import get_day_word
 from aiogram.fsm.context import FSMContext
 from aiogram.exceptions import TelegramAPIError
-from datetime import datetime, timedelta
-import pytz
+from datetime import timedelta
 import re
 
 from core.bot import bot
@@ -25,7 +23,7 @@ from modules.common.services import (
     main_menu,
 )
 from config.settings import ADMIN_ID, PUBLIC_CHANNEL_URL
-from services import vpn_manager
+from services.provisioning import enqueue_provisioning
 import logging
 
 logger = logging.getLogger(__name__)
@@ -71,7 +69,7 @@ async def settings_menu(
         await state.clear()
     user = await get_user_by_id(call.from_user.id if user_id is None else user_id)
 
-    if user and user[2] == "accepted":
+    if user and user.is_accepted:
         markup = types.InlineKeyboardMarkup(
             inline_keyboard=[
                 [
@@ -305,7 +303,7 @@ async def info_about_protos_callback(
     """Обработчик для предоставления информации о протоколах VPN."""
     user = await get_user_by_id(call.from_user.id)
 
-    if user and user[2] == "accepted":
+    if user and user.is_accepted:
         state_data = await state.get_data()
         previous_bot_message_id = state_data.get("previous_bot_message")
 
@@ -414,7 +412,7 @@ async def process_promo_code(message: types.Message, state: FSMContext):
 
     promo = await get_promo_code(promo_code_str)
 
-    if promo and promo[2] == 1:  # promo[2] is is_active
+    if promo and promo.is_active == 1:
         if await has_user_used_promo_code(user_id, promo_code_str):
             markup = types.InlineKeyboardMarkup(
                 inline_keyboard=[
@@ -435,8 +433,8 @@ async def process_promo_code(message: types.Message, state: FSMContext):
             await state.clear()
             return
 
-        days_to_add = promo[1]  # promo[1] is days_duration
-        current_usage_count = promo[3]  # promo[3] is usage_count
+        days_to_add = promo.days_duration
+        current_usage_count = promo.usage_count
 
         if current_usage_count <= 0:
             markup = types.InlineKeyboardMarkup(
@@ -460,12 +458,9 @@ async def process_promo_code(message: types.Message, state: FSMContext):
 
         user = await get_user_by_id(user_id)
         if user:
-            current_end_date = datetime.fromisoformat(user[5]).astimezone(
-                pytz.UTC
-            )  # user[5] is access_end_date
-            new_end_date = current_end_date + timedelta(days=days_to_add)
+            new_end_date = user.access_end_date + timedelta(days=days_to_add)
 
-            await update_user_access(user_id, new_end_date.isoformat())
+            await update_user_access(user_id, new_end_date)
             await update_promo_code_usage(promo_code_str, current_usage_count - 1)
             await record_promo_code_usage(user_id, promo_code_str)
 
@@ -702,25 +697,12 @@ async def successful_payment_handler(message: types.Message):
     if subscription_days > 0:
         user = await get_user_by_id(user_id)
         if user:
-            current_end_date = datetime.fromisoformat(user[5]).astimezone(
-                pytz.UTC
-            )  # user[5] is access_end_date
-            new_end_date = current_end_date + timedelta(days=subscription_days)
+            new_end_date = user.access_end_date + timedelta(days=subscription_days)
 
-            await update_user_access(user_id, new_end_date.isoformat())
-            await vpn_manager.create_user(user_id)  # Regenerate and send config
-
-            # Send the welcome GIF and message
-            await bot.send_animation(
-                chat_id=user_id,
-                animation=types.FSInputFile("assets/accepted.gif"),
-                caption=(
-                    enter_caption + "\n\n"
-                    "💳 <b>Подписка MatrixVPN успешно оплачена!</b>\n"
-                ),
-                parse_mode="HTML",
-            )
-            await main_menu(user_id=user_id)
+            await update_user_access(user_id, new_end_date)
+            # Конфигурации перевыпускаются в фоне; приветствие и меню отправит воркер
+            await enqueue_provisioning(user_id, "payment")
+            await message.answer("⏳ Оплата получена, обновляем ваши конфигурации...")
             logger.info(
                 f"User {user_id} successfully paid {total_amount} stars for {subscription_days} days."
             )
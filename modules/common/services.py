@@ -92,7 +92,7 @@ async def get_protos_menu_markup(
     # This function will generate the markup for protos_menu
     # It will be called from handlers and potentially other services
     user = await get_user_by_id(user_id)
-    if not (user and user[2] == "accepted"):
+    if not (user and user.is_accepted):
         return None
 
     inline_keyboard = [
@@ -158,13 +158,11 @@ async def main_menu(call: types.CallbackQuery = None, user_id: int = None):
     user_id = user_id or call.from_user.id
 
     user = await get_user_by_id(user_id)
-    if not (user and user[2] == "accepted"):
+    if not (user and user.is_accepted):
         await non_authorized(user_id, call.message.message_id if call else None)
         return
 
-    access_end_date = user[5]
-
-    access_end_date = datetime.fromisoformat(access_end_date)
+    access_end_date = user.access_end_date
     current_date = datetime.now(pytz.utc)
 
     remaining_time = access_end_date - current_date
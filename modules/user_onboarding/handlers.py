@@ -4,13 +4,12 @@ from aiogram.types import FSInputFile
 from services.db_operations import (
     get_user_by_id,
     update_user_access,
-    grant_access_and_create_config,
+    grant_access,
 )
+from services.provisioning import enqueue_provisioning
 from services.messages_manage import non_authorized
 from config.settings import TRIAL_CHANNEL_ID, PUBLIC_CHANNEL_URL
 from core.bot import bot
-from modules.common.services import main_menu
-from modules.user_onboarding.services import enter_caption
 
 import logging
 from datetime import datetime, timedelta
@@ -35,7 +34,7 @@ async def get_trial_callback(call: types.CallbackQuery) -> None:
         logger.error(f"User {user_id} not found in DB when trying to get trial.")
         return
 
-    if user[7] == 1:
+    if user.has_used_trial == 1:
         await call.message.answer("Вы уже использовали свой тестовый период.")
         return
 
@@ -48,21 +47,14 @@ async def get_trial_callback(call: types.CallbackQuery) -> None:
             trial_days = 3
             access_end_date = datetime.now(pytz.UTC) + timedelta(days=trial_days)
 
-            await grant_access_and_create_config(user_id, trial_days)
-            await update_user_access(
-                user_id, access_end_date.isoformat(), has_used_trial=1
-            )
+            await grant_access(user_id, trial_days)
+            await update_user_access(user_id, access_end_date, has_used_trial=1)
 
-            # Send the welcome GIF and message
-            await bot.send_animation(
-                chat_id=user_id,
-                animation=FSInputFile("assets/accepted.gif"),
-                caption=(
-                    enter_caption + "\n\n" "<b>🪤 Начат период пробной подписки</b>"
-                ),
-                parse_mode="HTML",
+            # Конфигурации создаются в фоне; приветствие и меню отправит воркер
+            await enqueue_provisioning(user_id, "trial")
+            await bot.send_message(
+                user_id, "⏳ Пробный период активирован, готовим ваши конфигурации..."
             )
-            await main_menu(user_id=user_id)
 
         else:
             # New attractive text with emojis and HTML markdown
@@ -180,7 +172,7 @@ async def instructions_callback(call: types.CallbackQuery, state: FSMContext) ->
     """Обработчик для предоставления инструкций по протоколам VPN"""
     user = await get_user_by_id(call.from_user.id)
 
-    if user and user[2] == "accepted":
+    if user and user.is_accepted:
         markup = types.InlineKeyboardMarkup(
             inline_keyboard=[
                 [
@@ -3,7 +3,8 @@ import os
 from aiogram import types
 from aiogram.types import FSInputFile
 from core.bot import bot
-from services.db_operations import get_user_by_id, add_user
+from config.settings import ADMIN_ID
+from services.db_operations import get_user_by_id, add_user, set_user_blocked
 from modules.common.services import main_menu
 
 logger = logging.getLogger(__name__)
@@ -22,6 +23,35 @@ common_caption = """
 # Подпись, отображаемая после запроса
 enter_caption = """<b>Добро пожаловать в реальный мир</b> 🐇"""
 
+# Подписи к приветствию после создания конфигураций, по типу задания
+provisioning_captions = {
+    "trial": "<b>🪤 Начат период пробной подписки</b>",
+    "accepted": "💳 <b>Вам был выдан доступ к MatrixVPN</b>\n",
+    "payment": "💳 <b>Подписка MatrixVPN успешно оплачена!</b>\n",
+}
+
+
+async def send_provisioning_result(user_id: int, notice: str, ok: bool) -> None:
+    """Отправляет пользователю приветствие и главное меню, когда конфигурации готовы."""
+    if not ok:
+        await bot.send_message(
+            user_id,
+            "Не удалось подготовить ваши конфигурационные файлы. Пожалуйста, свяжитесь с поддержкой.",
+        )
+        await bot.send_message(
+            ADMIN_ID,
+            f"❌ Не удалось создать конфигурации пользователя {user_id} ({notice}).",
+        )
+        return
+
+    await bot.send_animation(
+        chat_id=user_id,
+        animation=FSInputFile("assets/accepted.gif"),
+        caption=enter_caption + "\n\n" + provisioning_captions[notice],
+        parse_mode="HTML",
+    )
+    await main_menu(user_id=user_id)
+
 
 async def process_start_command(message: types.Message = None, user_id: int = None):
     """Processes the start command and displays the appropriate menu."""
@@ -31,8 +61,11 @@ async def process_start_command(message: types.Message = None, user_id: int = No
 
     if not user:
         user = await add_user(user_id, username)
+    elif user.is_blocked:
+        # Пользователь снова пишет боту — значит, больше не блокирует его
+        await set_user_blocked(user_id, False)
 
-    status = user[2]
+    status = user.status
 
     if status == "accepted":
         await main_menu(user_id=user_id)
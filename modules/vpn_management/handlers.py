@@ -1,7 +1,3 @@
-import os
-import asyncio
-import aiofiles
-
 from aiogram import types, Router
 from aiogram.types import FSInputFile
 from aiogram.fsm.context import FSMContext
@@ -13,11 +9,11 @@ from services.messages_manage import non_authorized, send_message_with_cleanup
 from modules.common.services import message_text_vpn_variants
 from modules.vpn_management.services import (
     send_vpn_config,
+    get_config_text,
     get_vpn_variants_menu_markup,
     config_texts,
 )
 from modules.common.services import get_protos_menu_markup
-from config.settings import VPN_CONFIG_PATH
 import logging
 
 logger = logging.getLogger(__name__)
@@ -31,7 +27,7 @@ async def send_configs_callback(call: types.CallbackQuery, state: FSMContext) ->
     user_id = call.from_user.id
     user = await get_user_by_id(user_id)
 
-    if user and user[2] == "accepted":
+    if user and user.is_accepted:
         await bot.delete_message(user_id, call.message.message_id)
         config_sent = await send_vpn_config(call)  # Call the service function
         if config_sent:
@@ -69,7 +65,7 @@ async def protos_menu_handler(call: types.CallbackQuery) -> None:
     proto = call.data[-2:]
     user = await get_user_by_id(user_id)
 
-    if user and user[2] == "accepted":
+    if user and user.is_accepted:
         markup = await get_protos_menu_markup(user_id, proto)
         caption = (
             "ⓘ Выберите VPN протокол:"  # This should come from config/messages.py later
@@ -101,7 +97,7 @@ async def vpn_variants_menu_handler(call: types.CallbackQuery) -> None:
     user_id = call.from_user.id
     user = await get_user_by_id(user_id)
 
-    if user and user[2] == "accepted":
+    if user and user.is_accepted:
         markup = await get_vpn_variants_menu_markup()
         caption = "ⓘ Выберите вариант MatrixVPN🛡️:"  # This should come from config/messages.py later
         try:
@@ -133,7 +129,7 @@ async def vpn_info_callback_handler(
     user_id = call.from_user.id
     user = await get_user_by_id(user_id)
 
-    if user and user[2] == "accepted":
+    if user and user.is_accepted:
         try:
             await bot.delete_message(user_id, call.message.message_id)
         except TelegramAPIError:
@@ -155,7 +151,7 @@ async def send_vless_text_config(call: types.CallbackQuery, state: FSMContext) -
     user_id = call.from_user.id
     user = await get_user_by_id(user_id)
 
-    if user and user[2] == "accepted":
+    if user and user.is_accepted:
         config_type = call.data.split("_")[0]  # "az" or "gb"
 
         if config_type == "az":
@@ -165,23 +161,9 @@ async def send_vless_text_config(call: types.CallbackQuery, state: FSMContext) -
             file_prefix = "GL-XR"
             file_type = "txt"
 
-        client_name = f"n{user_id}"
-        config_dir_path = os.path.join(VPN_CONFIG_PATH, client_name)
-
-        found_file_path = None
-        if await asyncio.to_thread(os.path.exists, config_dir_path):
-            files_in_dir = await asyncio.to_thread(os.listdir, config_dir_path)
-            for file_name in files_in_dir:
-                if file_name.startswith(file_prefix) and file_name.endswith(
-                    f".{file_type}"
-                ):
-                    found_file_path = os.path.join(config_dir_path, file_name)
-                    break
-
-        if found_file_path:
-            async with aiofiles.open(found_file_path, "r") as f:
-                config_content = await f.read()
+        config_content = await get_config_text(user_id, file_prefix, file_type)
 
+        if config_content:
             # Отправляем текстом отдельным сообщением
             await send_message_with_cleanup(
                 user_id, f"<pre><code>{config_content}</code></pre>", state
@@ -1,14 +1,22 @@
 import os
 import json
+import hashlib
 from aiogram import types
-from aiogram.types import FSInputFile
-from aiogram.exceptions import TelegramAPIError
+from aiogram.types import FSInputFile, BufferedInputFile
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest
 import asyncio  # Import asyncio for to_thread
+import aiofiles
 import logging  # Ensure logging is imported
 
 from core.bot import bot
 from config.settings import VPN_CONFIG_PATH
-from services.db_operations import get_user_by_id
+from services.db_operations import (
+    get_user_by_id,
+    get_config_file_id,
+    save_config_file_id,
+    delete_config_file_ids,
+)
+from services import vpn_manager
 
 logger = logging.getLogger(__name__)
 
@@ -17,10 +25,80 @@ with open("config/vpn_configs.json", "r", encoding="utf-8") as f:
     config_texts = json.load(f)
 
 
+async def find_config_file(user_id: int, file_prefix: str, file_type: str):
+    """Ищет файл конфигурации пользователя в VPN_CONFIG_PATH."""
+    config_dir_path = os.path.join(VPN_CONFIG_PATH, f"n{user_id}")
+    try:
+        # Use asyncio.to_thread for blocking os.listdir
+        files_in_dir = await asyncio.to_thread(os.listdir, config_dir_path)
+    except FileNotFoundError:
+        files_in_dir = []
+    for file_name in files_in_dir:
+        if file_name.startswith(file_prefix) and file_name.endswith(f".{file_type}"):
+            return os.path.join(config_dir_path, file_name)
+    return None
+
+
+async def get_config_document(user_id: int, file_prefix: str, file_type: str):
+    """Возвращает файл конфигурации для отправки и хэш его содержимого.
+
+    Основной путь — байты из кэша VPN-менеджера (профиль при необходимости
+    генерируется); поиск в VPN_CONFIG_PATH остается запасным вариантом, для
+    него хэш не считается. Если файл не найден, возвращает (None, None).
+    """
+    profile = await vpn_manager.get_profile(user_id, file_prefix)
+    if profile:
+        file_name, content = profile
+        content_hash = hashlib.sha256(content).hexdigest()
+        return BufferedInputFile(content, filename=file_name), content_hash
+    file_path = await find_config_file(user_id, file_prefix, file_type)
+    return (FSInputFile(file_path) if file_path else None), None
+
+
+async def send_config_document(
+    user_id: int, file_prefix: str, document, content_hash: str, **kwargs
+) -> types.Message:
+    """Отправляет файл конфигурации, по возможности по сохраненному file_id.
+
+    file_id запоминается после первой загрузки и используется, пока хэш
+    содержимого профиля не изменится (перевыпуск ключей дает новый хэш и
+    удаляет сохраненные file_id пользователя).
+    """
+    if content_hash:
+        file_id = await get_config_file_id(user_id, file_prefix, content_hash)
+        if file_id:
+            try:
+                return await bot.send_document(user_id, file_id, **kwargs)
+            except TelegramBadRequest as e:
+                logger.warning(
+                    f"file_id конфигурации {file_prefix} пользователя {user_id} отклонен ({e.message}), загружаем файл заново."
+                )
+                await delete_config_file_ids([user_id], file_prefix)
+
+    message = await bot.send_document(user_id, document, **kwargs)
+    if content_hash and message.document:
+        await save_config_file_id(
+            user_id, file_prefix, content_hash, message.document.file_id
+        )
+    return message
+
+
+async def get_config_text(user_id: int, file_prefix: str, file_type: str):
+    """Возвращает содержимое файла конфигурации в виде текста или None."""
+    profile = await vpn_manager.get_profile(user_id, file_prefix)
+    if profile:
+        return profile[1].decode("utf-8")
+    file_path = await find_config_file(user_id, file_prefix, file_type)
+    if not file_path:
+        return None
+    async with aiofiles.open(file_path, "r") as f:
+        return await f.read()
+
+
 async def send_vpn_config(call: types.CallbackQuery) -> bool:
     user_id = call.from_user.id
     user = await get_user_by_id(user_id)
-    if user and user[2] == "accepted":
+    if user and user.is_accepted:
         config = config_texts[call.data]
         if "WG" in config["prefix"] or "AM" in config["prefix"]:
             file_type = "conf"
@@ -32,93 +110,81 @@ async def send_vpn_config(call: types.CallbackQuery) -> bool:
             file_type = "ovpn"
         file_prefix = config["prefix"]
         try:
-            # Use asyncio.to_thread for blocking os.listdir
-            config_dir_path = os.path.join(VPN_CONFIG_PATH, f"n{user_id}")
-            files_in_dir = await asyncio.to_thread(os.listdir, config_dir_path)
-            for file_name in files_in_dir:
-                if file_name.startswith(file_prefix) and file_name.endswith(
-                    f".{file_type}"
-                ):
-                    full_file_path = os.path.join(config_dir_path, file_name)
-
-                    # Check if file exists before attempting to send
-                    if not await asyncio.to_thread(os.path.exists, full_file_path):
-                        logger.warning(
-                            f"Конфигурационный файл не найден: {full_file_path} для пользователя {user_id}"
-                        )
-                        continue  # Try next file or exit if no other files expected
-
-                    caption = config["text"]
-                    if file_type == "ovpn":
-                        app_url = "https://openvpn.net/client/"
-                    elif "WG" in config["prefix"]:
-                        app_url = "https://www.wireguard.com/install/"
-                    elif "AM" in config["prefix"]:
-                        app_url = (
-                            "https://docs.amnezia.org/ru/documentation/amnezia-wg/"
-                        )
-                    else:
-                        app_url = None
-
-                    markup_buttons = []
-                    if app_url:
-                        markup_buttons.append(
-                            types.InlineKeyboardButton(
-                                text="⬇️ Скачать приложение",
-                                web_app=types.WebAppInfo(url=app_url),
-                            )
-                        )
-
-                    # Add button for VLESS text config if it's a VLESS config
-                    if file_type in ("json", "txt") and "AZ-XR" in file_prefix:
-                        markup_buttons.append(
-                            types.InlineKeyboardButton(
-                                text="📄 Показать текст конфига",
-                                callback_data="az_vless_text",
-                            )
-                        )
-                    elif file_type in ("json", "txt") and "GL-XR" in file_prefix:
-                        markup_buttons.append(
-                            types.InlineKeyboardButton(
-                                text="📄 Показать текст конфига",
-                                callback_data="gb_vless_text",
-                            )
-                        )
-
-                    markup = (
-                        types.InlineKeyboardMarkup(inline_keyboard=[markup_buttons])
-                        if markup_buttons
-                        else None
+            document, content_hash = await get_config_document(
+                user_id, file_prefix, file_type
+            )
+            if not document:
+                logger.warning(
+                    f"Конфигурация {file_prefix} не найдена и не может быть сгенерирована для пользователя {user_id}"
+                )
+                await bot.send_message(
+                    user_id,
+                    "Не удалось найти ваши конфигурационные файлы. Пожалуйста, свяжитесь с администратором.",
+                )
+                return False
+
+            caption = config["text"]
+            if file_type == "ovpn":
+                app_url = "https://openvpn.net/client/"
+            elif "WG" in config["prefix"]:
+                app_url = "https://www.wireguard.com/install/"
+            elif "AM" in config["prefix"]:
+                app_url = "https://docs.amnezia.org/ru/documentation/amnezia-wg/"
+            else:
+                app_url = None
+
+            markup_buttons = []
+            if app_url:
+                markup_buttons.append(
+                    types.InlineKeyboardButton(
+                        text="⬇️ Скачать приложение",
+                        web_app=types.WebAppInfo(url=app_url),
                     )
+                )
 
-                    try:
-                        await bot.send_document(
-                            user_id,
-                            FSInputFile(full_file_path),
-                            caption=caption,
-                            parse_mode="HTML",
-                            reply_markup=markup,
-                        )
-                        return True  # Config sent successfully
-                    except TelegramAPIError as e:
-                        logger.error(
-                            f"Ошибка Telegram API при отправке конфигурации {full_file_path} пользователю {user_id}: {e}",
-                            exc_info=True,
-                        )
-                        await bot.send_message(
-                            user_id,
-                            "Произошла ошибка при отправке конфигурационного файла. Пожалуйста, попробуйте позже.",
-                        )
-                        return False  # Indicate failure to send config
-        except FileNotFoundError:
-            logger.warning(
-                f"Каталог конфигураций не найден для пользователя {user_id}: {config_dir_path}"
-            )
-            await bot.send_message(
-                user_id,
-                "Не удалось найти ваши конфигурационные файлы. Пожалуйста, свяжитесь с администратором.",
+            # Add button for VLESS text config if it's a VLESS config
+            if file_type in ("json", "txt") and "AZ-XR" in file_prefix:
+                markup_buttons.append(
+                    types.InlineKeyboardButton(
+                        text="📄 Показать текст конфига",
+                        callback_data="az_vless_text",
+                    )
+                )
+            elif file_type in ("json", "txt") and "GL-XR" in file_prefix:
+                markup_buttons.append(
+                    types.InlineKeyboardButton(
+                        text="📄 Показать текст конфига",
+                        callback_data="gb_vless_text",
+                    )
+                )
+
+            markup = (
+                types.InlineKeyboardMarkup(inline_keyboard=[markup_buttons])
+                if markup_buttons
+                else None
             )
-            return False
+
+            try:
+                await send_config_document(
+                    user_id,
+                    file_prefix,
+                    document,
+                    content_hash,
+                    caption=caption,
+                    parse_mode="HTML",
+                    reply_markup=markup,
+                )
+                return True  # Config sent successfully
+            except TelegramAPIError as e:
+                logger.error(
+                    f"Ошибка Telegram API при отправке конфигурации {file_prefix} пользователю {user_id}: {e}",
+                    exc_info=True,
+                )
+                await bot.send_message(
+                    user_id,
+                    "Произошла ошибка при отправке конфигурационного файла. Пожалуйста, попробуйте позже.",
+                )
+                return False  # Indicate failure to send config
         except Exception as e:
             logger.error(
                 f"Неожиданная ошибка при поиске или отправке конфигурации для пользователя {user_id}: {e}",
@@ -0,0 +1,160 @@
+import asyncio
+import logging
+import os
+from typing import Optional
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import (
+    FSInputFile,
+    InputMediaAnimation,
+    InputMediaDocument,
+    InputMediaPhoto,
+    InputMediaVideo,
+    Message,
+)
+
+from services.db_operations import (
+    get_asset_file_ids,
+    save_asset_file_id,
+    delete_asset_file_id,
+)
+
+logger = logging.getLogger(__name__)
+
+ASSETS_DIR = os.path.abspath("assets")
+
+# Поля методов send_* с вложением и тип вложения в ответном сообщении
+MEDIA_FIELDS = {
+    "photo": "photo",
+    "animation": "animation",
+    "document": "document",
+    "video": "video",
+}
+# Тип вложения для InputMedia* в edit_message_media
+INPUT_MEDIA_KINDS = {
+    InputMediaPhoto: "photo",
+    InputMediaAnimation: "animation",
+    InputMediaDocument: "document",
+    InputMediaVideo: "video",
+}
+
+# Фрагменты ответов Telegram (в нижнем регистре), означающих, что file_id
+# больше не действителен для этого запроса
+STALE_FILE_ID_ERRORS = (
+    "wrong file identifier",
+    "wrong remote file identifier",
+    "wrong file_id",
+    "file reference expired",
+    "file_reference_expired",
+    "can't use file of type",
+)
+
+# (путь относительно assets/, тип вложения) -> (сигнатура файла, file_id)
+_file_ids = {}
+
+
+async def load_asset_file_ids() -> None:
+    """Загружает сохраненные file_id статических файлов из БД в память."""
+    for path, kind, signature, file_id in await get_asset_file_ids():
+        _file_ids[(path, kind)] = (signature, file_id)
+    logger.info(f"Загружено {len(_file_ids)} file_id статических файлов.")
+
+
+def _asset_name(input_file) -> Optional[str]:
+    """Возвращает путь файла относительно assets/, если это статический файл бота."""
+    if not isinstance(input_file, FSInputFile):
+        return None
+    path = os.path.abspath(input_file.path)
+    if os.path.dirname(path) != ASSETS_DIR:
+        return None
+    return os.path.basename(path)
+
+
+def _file_signature(name: str) -> str:
+    stat = os.stat(os.path.join(ASSETS_DIR, name))
+    return f"{stat.st_mtime_ns}:{stat.st_size}"
+
+
+def _find_asset(method):
+    """Ищет в методе Bot API вложение из assets/.
+
+    Возвращает (имя файла, тип вложения, функция подстановки file_id) или None.
+    """
+    for field, kind in MEDIA_FIELDS.items():
+        name = _asset_name(getattr(method, field, None))
+        if name:
+            def with_file_id(file_id, field=field):
+                return method.model_copy(update={field: file_id})
+
+            return name, kind, with_file_id
+
+    media = getattr(method, "media", None)
+    kind = INPUT_MEDIA_KINDS.get(type(media))
+    if kind:
+        name = _asset_name(media.media)
+        if name:
+            def with_file_id(file_id):
+                return method.model_copy(
+                    update={"media": media.model_copy(update={"media": file_id})}
+                )
+
+            return name, kind, with_file_id
+    return None
+
+
+def _extract_file_id(result, kind: str) -> Optional[str]:
+    """Достает file_id вложения из отправленного сообщения."""
+    if not isinstance(result, Message):
+        return None
+    attachment = getattr(result, kind, None)
+    if kind == "photo":
+        # Берем самый большой размер фото
+        attachment = attachment[-1] if attachment else None
+    return attachment.file_id if attachment else None
+
+
+class AssetFileIdMiddleware(BaseRequestMiddleware):
+    """Подменяет загрузку файлов из assets/ на отправку по сохраненному file_id.
+
+    Каждый файл загружается в Telegram один раз; полученный file_id хранится
+    в памяти и в БД и переиспользуется во всех последующих запросах. Если файл
+    на диске изменился или Telegram отверг file_id, файл загружается заново.
+    """
+
+    async def __call__(self, make_request, bot, method):
+        asset = _find_asset(method)
+        if asset is None:
+            return await make_request(bot, method)
+
+        name, kind, with_file_id = asset
+        key = (name, kind)
+        try:
+            signature = await asyncio.to_thread(_file_signature, name)
+        except OSError:
+            return await make_request(bot, method)
+
+        cached = _file_ids.get(key)
+        if cached and cached[0] == signature:
+            try:
+                return await make_request(bot, with_file_id(cached[1]))
+            except TelegramBadRequest as e:
+                # "message is not modified" — правка на ту же картинку по тому же
+                # file_id; повторная загрузка сохраняет прежнее поведение
+                error = e.message.lower()
+                file_rejected = any(text in error for text in STALE_FILE_ID_ERRORS)
+                if not file_rejected and "not modified" not in e.message:
+                    raise
+                logger.warning(
+                    f"Запрос с file_id для {name} отклонен ({e.message}), загружаем файл заново."
+                )
+                if file_rejected:
+                    _file_ids.pop(key, None)
+                    await delete_asset_file_id(name, kind)
+
+        result = await make_request(bot, method)
+        file_id = _extract_file_id(result, kind)
+        if file_id:
+            _file_ids[key] = (signature, file_id)
+            await save_asset_file_id(name, kind, signature, file_id)
+        return result
@@ -0,0 +1,320 @@
+import asyncio
+import time
+import logging
+from datetime import datetime, timezone
+
+from aiogram.exceptions import (
+    TelegramAPIError,
+    TelegramForbiddenError,
+    TelegramRetryAfter,
+)
+
+from core.bot import bot
+from config.settings import (
+    ADMIN_ID,
+    BROADCAST_RATE,
+    BROADCAST_CONCURRENCY,
+    BROADCAST_PAGE_SIZE,
+)
+from services.db_operations import (
+    set_user_blocked,
+    create_broadcast_job,
+    get_broadcast_job,
+    get_active_broadcast_jobs,
+    update_broadcast_job,
+    get_broadcast_page,
+    record_broadcast_delivery,
+    get_broadcast_delivery_counts,
+)
+from services.models import BroadcastJob
+from services.rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Глобальный лимит Telegram — около 30 сообщений в секунду на бота
+telegram_limiter = TokenBucket(rate=BROADCAST_RATE)
+
+MAX_SEND_ATTEMPTS = 3
+PROGRESS_INTERVAL = 5  # секунд между обновлениями прогресса
+
+# Задачи идущих рассылок и их текущее состояние по ID задания.
+# Состояние дублирует broadcast_jobs.status, чтобы воркеры не ходили в БД
+# перед каждой отправкой.
+_job_tasks = {}
+_job_states = {}
+
+
+STATUS_HEADERS = {
+    "running": "📨 Идет рассылка",
+    "paused": "⏸ Рассылка приостановлена",
+    "cancelled": "✖️ Рассылка отменена",
+    "done": "✅ Рассылка завершена",
+}
+
+
+class BroadcastStats:
+    """Счетчики одной рассылки."""
+
+    def __init__(self, total: int, sent: int = 0, blocked: int = 0, failed: int = 0):
+        self.total = total
+        self.sent = sent
+        self.blocked = blocked
+        self.failed = failed
+        self.started_at = time.monotonic()
+
+    @property
+    def processed(self) -> int:
+        return self.sent + self.blocked + self.failed
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    def format(self, status: str = "running") -> str:
+        header = STATUS_HEADERS.get(status, STATUS_HEADERS["running"])
+        return (
+            f"{header}\n\n"
+            f"Обработано: {self.processed}/{max(self.total, self.processed)}\n"
+            f"Доставлено: {self.sent}\n"
+            f"Заблокировали бота: {self.blocked}\n"
+            f"Ошибки: {self.failed}\n"
+            f"Время: {int(self.elapsed)} с"
+        )
+
+
+async def deliver_with_retry(user_id: int, send, limiter: TokenBucket) -> str:
+    """Выполняет отправку send() пользователю с учетом лимита и TelegramRetryAfter.
+
+    send — функция без аргументов, возвращающая корутину отправки.
+    Возвращает "sent", "blocked" или "failed".
+    """
+    for attempt in range(1, MAX_SEND_ATTEMPTS + 1):
+        await limiter.acquire()
+        try:
+            await send()
+            return "sent"
+        except TelegramRetryAfter as e:
+            logger.warning(
+                f"Флуд-лимит Telegram, пауза {e.retry_after} с "
+                f"(попытка {attempt}/{MAX_SEND_ATTEMPTS})."
+            )
+            limiter.pause(e.retry_after)
+        except TelegramForbiddenError:
+            await set_user_blocked(user_id, True)
+            return "blocked"
+        except TelegramAPIError:
+            logger.error(
+                f"Не удалось отправить сообщение пользователю {user_id}:",
+                exc_info=True,
+            )
+            return "failed"
+    return "failed"
+
+
+async def send_with_retry(user_id: int, text: str, limiter: TokenBucket) -> str:
+    """Отправляет одно текстовое сообщение рассылки, см. deliver_with_retry."""
+    return await deliver_with_retry(
+        user_id,
+        lambda: bot.send_message(user_id, text=text, parse_mode="HTML"),
+        limiter,
+    )
+
+
+async def report_progress(stats, chat_id: int, message_id: int):
+    """Периодически обновляет сообщение с прогрессом (любой объект со stats.format())."""
+    last_text = None
+    while True:
+        await asyncio.sleep(PROGRESS_INTERVAL)
+        text = stats.format()
+        if text == last_text:
+            continue
+        try:
+            await bot.edit_message_text(text, chat_id=chat_id, message_id=message_id)
+            last_text = text
+        except TelegramAPIError:
+            logger.warning("Не удалось обновить сообщение с прогрессом.", exc_info=True)
+
+
+async def _ensure_progress_message(job: BroadcastJob, stats: BroadcastStats) -> int:
+    """Возвращает ID сообщения с прогрессом, при необходимости отправляя новое."""
+    if job.progress_message_id:
+        try:
+            await bot.edit_message_text(
+                stats.format(),
+                chat_id=job.report_chat_id,
+                message_id=job.progress_message_id,
+            )
+            return job.progress_message_id
+        except TelegramAPIError:
+            # Сообщение удалено или не изменилось — проще отправить новое
+            pass
+    message = await bot.send_message(job.report_chat_id, stats.format())
+    await update_broadcast_job(job.id, progress_message_id=message.message_id)
+    return message.message_id
+
+
+async def _send_page(
+    job: BroadcastJob, user_ids: list, stats: BroadcastStats, concurrency: int
+) -> bool:
+    """Отправляет рассылку одной странице получателей.
+
+    Возвращает True, если обработаны все получатели страницы, и False, если
+    рассылку приостановили или отменили посреди страницы.
+    """
+    queue = asyncio.Queue()
+    for user_id in user_ids:
+        queue.put_nowait(user_id)
+
+    async def worker():
+        while _job_states.get(job.id) == "running":
+            try:
+                user_id = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            result = await send_with_retry(user_id, job.text, telegram_limiter)
+            await record_broadcast_delivery(job.id, user_id, result)
+            setattr(stats, result, getattr(stats, result) + 1)
+
+    await asyncio.gather(
+        *(worker() for _ in range(max(1, min(concurrency, len(user_ids)))))
+    )
+    # Взятый из очереди получатель всегда обрабатывается до конца, поэтому
+    # пустая очередь означает, что вся страница доставлена
+    return queue.empty()
+
+
+async def run_broadcast_job(
+    job_id: int, concurrency: int = BROADCAST_CONCURRENCY
+) -> bool:
+    """Выполняет (или продолжает) рассылку, постранично проходя пользователей по ID.
+
+    Результат доставки каждому пользователю и курсор после каждой страницы
+    сохраняются в БД, поэтому после перезапуска бота рассылка продолжается с
+    того же места без повторных отправок. Возвращает True, если рассылка
+    завершена.
+    """
+    job = await get_broadcast_job(job_id)
+    counts = await get_broadcast_delivery_counts(job_id)
+    stats = BroadcastStats(
+        job.total,
+        sent=counts.get("sent", 0),
+        blocked=counts.get("blocked", 0),
+        failed=counts.get("failed", 0),
+    )
+    message_id = await _ensure_progress_message(job, stats)
+    reporter = asyncio.create_task(
+        report_progress(stats, job.report_chat_id, message_id)
+    )
+
+    cursor = job.cursor_user_id
+    finished = False
+    try:
+        while _job_states.get(job_id) == "running":
+            user_ids = await get_broadcast_page(job_id, cursor, BROADCAST_PAGE_SIZE)
+            if not user_ids:
+                finished = True
+                break
+            if await _send_page(job, user_ids, stats, concurrency):
+                cursor = user_ids[-1]
+                await update_broadcast_job(job_id, cursor_user_id=cursor)
+    finally:
+        reporter.cancel()
+
+    if finished:
+        _job_states[job_id] = "done"
+        await update_broadcast_job(
+            job_id,
+            status="done",
+            finished_at=datetime.now(timezone.utc).isoformat(),
+        )
+        logger.info(
+            f"Рассылка #{job_id} завершена: {stats.sent} доставлено, {stats.blocked} заблокировали, "
+            f"{stats.failed} ошибок за {stats.elapsed:.1f} с."
+        )
+    final_text = f"{stats.format(_job_states.get(job_id, 'running'))}\n\nРассылка #{job_id}"
+    try:
+        await bot.edit_message_text(
+            final_text, chat_id=job.report_chat_id, message_id=message_id
+        )
+    except TelegramAPIError:
+        await bot.send_message(job.report_chat_id, final_text)
+    return finished
+
+
+def _start_job_task(job_id: int) -> asyncio.Task:
+    task = asyncio.create_task(run_broadcast_job(job_id))
+    _job_tasks[job_id] = task
+    task.add_done_callback(lambda t: _on_broadcast_done(job_id, t))
+    return task
+
+
+def _on_broadcast_done(job_id: int, task: asyncio.Task) -> None:
+    if _job_tasks.get(job_id) is task:
+        del _job_tasks[job_id]
+    if task.cancelled():
+        return
+    if task.exception():
+        logger.error(
+            f"Ошибка при рассылке #{job_id}:", exc_info=task.exception()
+        )
+        return
+    # Рассылку могли возобновить, пока задача уже завершалась после паузы
+    if not task.result() and _job_states.get(job_id) == "running":
+        _start_job_task(job_id)
+
+
+async def start_broadcast(text: str, report_chat_id: int = ADMIN_ID) -> BroadcastJob:
+    """Создает задание рассылки и запускает его в фоне, не блокируя обработчик апдейта."""
+    job = await create_broadcast_job(text, report_chat_id)
+    _job_states[job.id] = "running"
+    _start_job_task(job.id)
+    return job
+
+
+async def pause_broadcast(job_id: int) -> bool:
+    """Приостанавливает рассылку после отправки уже взятых в работу сообщений."""
+    if _job_states.get(job_id) != "running":
+        return False
+    _job_states[job_id] = "paused"
+    await update_broadcast_job(job_id, status="paused")
+    return True
+
+
+async def resume_broadcast(job_id: int) -> bool:
+    """Продолжает приостановленную рассылку с сохраненного места."""
+    if _job_states.get(job_id) != "paused":
+        return False
+    _job_states[job_id] = "running"
+    await update_broadcast_job(job_id, status="running")
+    task = _job_tasks.get(job_id)
+    if task is None or task.done():
+        _start_job_task(job_id)
+    return True
+
+
+async def cancel_broadcast(job_id: int) -> bool:
+    """Отменяет идущую или приостановленную рассылку."""
+    if _job_states.get(job_id) not in ("running", "paused"):
+        return False
+    was_paused = _job_states[job_id] == "paused"
+    _job_states[job_id] = "cancelled"
+    await update_broadcast_job(
+        job_id,
+        status="cancelled",
+        finished_at=datetime.now(timezone.utc).isoformat(),
+    )
+    if was_paused:
+        job = await get_broadcast_job(job_id)
+        await bot.send_message(job.report_chat_id, f"✖️ Рассылка #{job_id} отменена.")
+    return True
+
+
+async def resume_broadcast_jobs() -> None:
+    """Загружает незавершенные рассылки при старте и продолжает идущие."""
+    for job in await get_active_broadcast_jobs():
+        _job_states[job.id] = job.status
+        if job.status == "running":
+            logger.info(
+                f"Продолжаем рассылку #{job.id} после перезапуска с пользователя {job.cursor_user_id}."
+            )
+            _start_job_task(job.id)
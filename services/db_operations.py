@@ -1,112 +1,138 @@
 import aiosqlite
 import logging
 from datetime import datetime, timedelta, timezone
-from config.settings import DATABASE_PATH
+from typing import Optional
 import aiofiles
+from core.database import pool
 from services import vpn_manager
+from services.user_cache import user_cache
+from services.expiry import expiry_timer
+from services.models import (
+    User,
+    PendingRequest,
+    AccessRecord,
+    PromoCode,
+    BroadcastJob,
+    to_timestamp,
+)
 
 logger = logging.getLogger(__name__)
 
+USER_COLUMNS = "id, username, status, access_granted_date, access_duration, access_end_date, last_notification_id, has_used_trial, is_blocked"
 
-async def get_user_by_id(user_id: int) -> tuple:
-    """Возвращает информацию о пользователе по его ID."""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        async with db.execute("SELECT * FROM users WHERE id = ?", (user_id,)) as cursor:
-            return await cursor.fetchone()
+
+async def get_user_by_id(user_id: int) -> User:
+    """Возвращает информацию о пользователе по его ID (через кэш пользователей)."""
+    found, user = user_cache.get(user_id)
+    if found:
+        return user
+    generation = user_cache.generation
+    async with pool.reader() as db:
+        async with db.execute(
+            f"SELECT {USER_COLUMNS} FROM users WHERE id = ?", (user_id,)
+        ) as cursor:
+            user = User.from_row(await cursor.fetchone())
+    user_cache.set(user_id, user, generation)
+    return user
 
 
-async def add_user(user_id: int, username: str) -> tuple:
+async def add_user(user_id: int, username: str) -> User:
     """Добавляет нового пользователя в базу данных или обновляет статус существующего пользователя."""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        try:
-            await db.execute("BEGIN")
-            user = await get_user_by_id(user_id)  # This still opens a new connection
-            current_date = datetime.now(timezone.utc).isoformat()
+    try:
+        async with pool.writer() as db:
+            async with db.execute(
+                "SELECT status FROM users WHERE id = ?", (user_id,)
+            ) as cursor:
+                user = await cursor.fetchone()
+            current_date = datetime.now(timezone.utc)
 
             if user is None:
                 await db.execute(
                     "INSERT INTO users (id, username, status, access_granted_date, access_duration, access_end_date, has_used_trial) VALUES (?, ?, 'pending', ?, 0, ?, 0)",
-                    (user_id, username, current_date, current_date),
+                    (user_id, username, current_date.isoformat(), to_timestamp(current_date)),
                 )
             else:
-                if user[2] in ("denied", "expired"):
+                if user[0] in ("denied", "expired"):
                     await db.execute(
                         "UPDATE users SET status = 'pending' WHERE id = ?",
                         (user_id,),
                     )
-            await db.commit()
-            # Fetch the user again to return the most current data
-            return await get_user_by_id(user_id)
-        except aiosqlite.Error as e:
-            await db.rollback()
-            logger.error(f"Transaction failed: {e}", exc_info=True)
-            return None
-
-
-async def grant_access_and_create_config(user_id: int, days: int) -> None:
-    """Выдает доступ пользователю и создает необходимые конфигурации."""
-    await vpn_manager.create_user(user_id)
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        try:
-            await db.execute("BEGIN")
+    except aiosqlite.Error as e:
+        logger.error(f"Transaction failed: {e}", exc_info=True)
+        return None
+    finally:
+        user_cache.invalidate(user_id)
+    # Fetch the user again to return the most current data
+    return await get_user_by_id(user_id)
+
+
+async def grant_access(user_id: int, days: int) -> None:
+    """Выдает доступ пользователю на days дней.
+
+    Конфигурации создаются отдельно — заданием в services.provisioning.
+    """
+    try:
+        async with pool.writer() as db:
             current_date = datetime.now(timezone.utc).isoformat()
-            end_date = (datetime.now(timezone.utc) + timedelta(days=days)).isoformat()
+            end_date = to_timestamp(datetime.now(timezone.utc) + timedelta(days=days))
             await db.execute(
                 """UPDATE users SET status = ?, access_granted_date = ?, access_duration = ?, access_end_date = ? WHERE id = ?""",
                 ("accepted", current_date, days, end_date, user_id),
             )
-            await db.commit()
-        except aiosqlite.Error as e:
-            await db.rollback()
-            logger.error(f"Transaction failed: {e}", exc_info=True)
-            raise
+        expiry_timer.arm(user_id, end_date)
+    except aiosqlite.Error as e:
+        logger.error(f"Transaction failed: {e}", exc_info=True)
+        raise
+    finally:
+        user_cache.invalidate(user_id)
 
 
 async def update_request_status(user_id: int, status: str) -> None:
     """Обновляет статус запроса пользователя."""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        try:
+    try:
+        async with pool.writer() as db:
             await db.execute(
                 "UPDATE users SET status = ? WHERE id = ?", (status, user_id)
             )
-            await db.commit()
-        except aiosqlite.Error:
-            logger.error("Ошибка при обновлении статуса запроса:", exc_info=True)
+    except aiosqlite.Error:
+        logger.error("Ошибка при обновлении статуса запроса:", exc_info=True)
+    finally:
+        user_cache.invalidate(user_id)
 
 
-async def get_pending_requests() -> list:
+async def get_pending_requests() -> list[PendingRequest]:
     """Возвращает список пользователей с ожидающим статусом."""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        try:
+    try:
+        async with pool.reader() as db:
             async with db.execute(
-                "SELECT * FROM users WHERE status = 'pending' OR status = 'expired' "
+                "SELECT id, username, status FROM users WHERE status = 'pending' OR status = 'expired' "
             ) as cursor:
-                return await cursor.fetchall()
-        except aiosqlite.Error:
-            logger.error("Ошибка при получении списка запросов:", exc_info=True)
-            return []
+                return [PendingRequest(*row) for row in await cursor.fetchall()]
+    except aiosqlite.Error:
+        logger.error("Ошибка при получении списка запросов:", exc_info=True)
+        return []
 
 
-async def get_accepted_users() -> list:
+async def get_accepted_users() -> list[AccessRecord]:
     """Возвращает список пользователей с принятым статусом."""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        try:
+    try:
+        async with pool.reader() as db:
             async with db.execute(
                 "SELECT id, username, access_end_date FROM users WHERE status = 'accepted'"
             ) as cursor:
-                return await cursor.fetchall()
-        except aiosqlite.Error:
-            logger.error("Ошибка при получении списка пользователей:", exc_info=True)
-            return []
+                return [AccessRecord.from_row(row) for row in await cursor.fetchall()]
+    except aiosqlite.Error:
+        logger.error("Ошибка при получении списка пользователей:", exc_info=True)
+        return []
 
 
 async def update_user_access(
-    user_id: int, access_end_date: str, has_used_trial: int = None
+    user_id: int, access_end_date: datetime, has_used_trial: int = None
 ) -> None:
     """Обновляет дату окончания доступа пользователя."""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        try:
-            await db.execute("BEGIN")
+    access_end_date = to_timestamp(access_end_date)
+    try:
+        async with pool.writer() as db:
             if has_used_trial is not None:
                 await db.execute(
                     "UPDATE users SET status = 'accepted', access_end_date = ?, has_used_trial = ? WHERE id = ?",
@@ -117,32 +143,49 @@ async def update_user_access(
                     "UPDATE users SET status = 'accepted', access_end_date = ? WHERE id = ?",
                     (access_end_date, user_id),
                 )
-            await db.commit()
-        except aiosqlite.Error:
-            await db.rollback()
-            logger.error("Ошибка при обновлении доступа пользователя:", exc_info=True)
+        expiry_timer.arm(user_id, access_end_date)
+    except aiosqlite.Error:
+        logger.error("Ошибка при обновлении доступа пользователя:", exc_info=True)
+    finally:
+        user_cache.invalidate(user_id)
 
 
 async def delete_user(user_id: int) -> bool:
-    """Удаляет пользователя из базы данных по его ID и удаляет его конфигурации."""
-    await vpn_manager.delete_user(user_id)
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        try:
+    """Удаляет пользователя из базы данных по его ID и удаляет его конфигурации.
+
+    Если отозвать доступ не удалось, пользователь остается в БД и
+    возвращается False.
+    """
+    try:
+        await vpn_manager.delete_user(user_id)
+    except Exception:
+        logger.error(
+            f"Не удалось отозвать доступ пользователя {user_id}:", exc_info=True
+        )
+        return False
+    try:
+        async with pool.writer() as db:
+            await db.execute("DELETE FROM config_file_ids WHERE user_id = ?", (user_id,))
+            await db.execute("DELETE FROM provisioning_jobs WHERE user_id = ?", (user_id,))
             await db.execute("DELETE FROM users WHERE id = ?", (user_id,))
-            await db.commit()
-            return True
-        except aiosqlite.Error:
-            logger.error("Ошибка при удалении пользователя:", exc_info=True)
-            return False
+        return True
+    except aiosqlite.Error:
+        logger.error("Ошибка при удалении пользователя:", exc_info=True)
+        return False
+    finally:
+        user_cache.invalidate(user_id)
 
 
 async def get_users_list() -> str:
     """Получает список всех пользователей и записывает его в CSV файл."""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        try:
-            async with db.execute(
-                "SELECT id, username, status, access_granted_date, access_duration, access_end_date, last_notification_id, has_used_trial FROM users"
-            ) as cursor:
+    try:
+        async with pool.reader() as db:
+            # В выгрузке дата окончания доступа — читаемая строка, а не epoch-секунды
+            columns = USER_COLUMNS.replace(
+                "access_end_date",
+                "datetime(access_end_date, 'unixepoch') AS access_end_date",
+            )
+            async with db.execute(f"SELECT {columns} FROM users") as cursor:
                 # Dynamically fetch column names from cursor.description
                 column_names = [description[0] for description in cursor.description]
 
@@ -170,78 +213,76 @@ async def get_users_list() -> str:
                         await file.write(
                             "Нет пользователей в базе данных.\n"
                         )  # This line might need adjustment for CSV
-            return file_name
-        except (aiosqlite.Error, IOError, OSError):
-            logger.error("Ошибка при получении списка пользователей:", exc_info=True)
-            return None
+        return file_name
+    except (aiosqlite.Error, IOError, OSError):
+        logger.error("Ошибка при получении списка пользователей:", exc_info=True)
+        return None
 
 
 async def add_promo_code(code: str, days_duration: int, usage_count: int) -> bool:
     """Добавляет новый промокод в базу данных."""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        try:
+    try:
+        async with pool.writer() as db:
             await db.execute(
                 "INSERT INTO promo_codes (code, days_duration, is_active, usage_count) VALUES (?, ?, 1, ?)",
                 (code, days_duration, usage_count),
             )
-            await db.commit()
-            logger.info(f"Промокод {code} добавлен.")
-            return True
-        except aiosqlite.IntegrityError:
-            logger.warning(f"Промокод {code} уже существует.")
-            return False
-        except aiosqlite.Error as e:
-            logger.error(f"Ошибка при добавлении промокода {code}: {e}", exc_info=True)
-            return False
-
-
-async def get_promo_code(code: str) -> tuple:
+        logger.info(f"Промокод {code} добавлен.")
+        return True
+    except aiosqlite.IntegrityError:
+        logger.warning(f"Промокод {code} уже существует.")
+        return False
+    except aiosqlite.Error as e:
+        logger.error(f"Ошибка при добавлении промокода {code}: {e}", exc_info=True)
+        return False
+
+
+async def get_promo_code(code: str) -> PromoCode:
     """Возвращает информацию о промокоде по его коду."""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    async with pool.reader() as db:
         async with db.execute(
-            "SELECT * FROM promo_codes WHERE code = ?", (code,)
+            "SELECT code, days_duration, is_active, usage_count FROM promo_codes WHERE code = ?",
+            (code,),
         ) as cursor:
-            return await cursor.fetchone()
+            return PromoCode.from_row(await cursor.fetchone())
 
 
 async def delete_promo_code(code: str) -> bool:
     """Удаляет промокод из базы данных."""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        try:
+    try:
+        async with pool.writer() as db:
             # Удаляем записи об использовании промокода из user_promo_codes
             await db.execute("DELETE FROM user_promo_codes WHERE promo_code = ?", (code,))
             # Удаляем сам промокод из promo_codes
             await db.execute("DELETE FROM promo_codes WHERE code = ?", (code,))
-            await db.commit()
-            logger.info(f"Промокод {code} и все его использования удалены.")
-            return True
-        except aiosqlite.Error as e:
-            logger.error(f"Ошибка при удалении промокода {code}: {e}", exc_info=True)
-            return False
+        logger.info(f"Промокод {code} и все его использования удалены.")
+        return True
+    except aiosqlite.Error as e:
+        logger.error(f"Ошибка при удалении промокода {code}: {e}", exc_info=True)
+        return False
 
 
 async def record_promo_code_usage(user_id: int, promo_code: str) -> None:
     """Записывает использование промокода пользователем."""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        try:
+    try:
+        async with pool.writer() as db:
             await db.execute(
                 "INSERT INTO user_promo_codes (user_id, promo_code) VALUES (?, ?)",
                 (user_id, promo_code),
             )
-            await db.commit()
-            logger.info(f"Пользователь {user_id} использовал промокод {promo_code}.")
-        except aiosqlite.IntegrityError:
-            logger.warning(f"Пользователь {user_id} уже использовал промокод {promo_code}.")
-        except aiosqlite.Error as e:
-            logger.error(
-                f"Ошибка при записи использования промокода {promo_code} пользователем {user_id}: {e}",
-                exc_info=True,
-            )
+        logger.info(f"Пользователь {user_id} использовал промокод {promo_code}.")
+    except aiosqlite.IntegrityError:
+        logger.warning(f"Пользователь {user_id} уже использовал промокод {promo_code}.")
+    except aiosqlite.Error as e:
+        logger.error(
+            f"Ошибка при записи использования промокода {promo_code} пользователем {user_id}: {e}",
+            exc_info=True,
+        )
 
 
 async def has_user_used_promo_code(user_id: int, promo_code: str) -> bool:
     """Проверяет, использовал ли пользователь уже данный промокод."""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    async with pool.reader() as db:
         async with db.execute(
             "SELECT 1 FROM user_promo_codes WHERE user_id = ? AND promo_code = ?",
             (user_id, promo_code),
@@ -249,74 +290,348 @@ async def has_user_used_promo_code(user_id: int, promo_code: str) -> bool:
             return await cursor.fetchone() is not None
 
 
-async def get_all_promo_codes() -> list:
+async def get_all_promo_codes() -> list[PromoCode]:
     """Возвращает список всех промокодов."""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        try:
-            async with db.execute("SELECT * FROM promo_codes") as cursor:
-                return await cursor.fetchall()
-        except aiosqlite.Error as e:
-            logger.error(f"Ошибка при получении списка промокодов: {e}", exc_info=True)
-            return []
+    try:
+        async with pool.reader() as db:
+            async with db.execute(
+                "SELECT code, days_duration, is_active, usage_count FROM promo_codes"
+            ) as cursor:
+                return [PromoCode.from_row(row) for row in await cursor.fetchall()]
+    except aiosqlite.Error as e:
+        logger.error(f"Ошибка при получении списка промокодов: {e}", exc_info=True)
+        return []
 
 
 async def update_promo_code_usage(code: str, new_usage_count: int) -> bool:
     """Обновляет количество использований промокода и деактивирует его, если usage_count становится 0."""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        try:
-            is_active = 1 if new_usage_count > 0 else 0
+    try:
+        is_active = 1 if new_usage_count > 0 else 0
+        async with pool.writer() as db:
             await db.execute(
                 "UPDATE promo_codes SET usage_count = ?, is_active = ? WHERE code = ?",
                 (new_usage_count, is_active, code),
             )
-            await db.commit()
-            logger.info(f"Использование промокода {code} обновлено до {new_usage_count}. Активен: {bool(is_active)}.")
-            return True
-        except aiosqlite.Error as e:
-            logger.error(
-                f"Ошибка при обновлении использования промокода {code}: {e}",
-                exc_info=True,
-            )
-            return False
+        logger.info(f"Использование промокода {code} обновлено до {new_usage_count}. Активен: {bool(is_active)}.")
+        return True
+    except aiosqlite.Error as e:
+        logger.error(
+            f"Ошибка при обновлении использования промокода {code}: {e}",
+            exc_info=True,
+        )
+        return False
+
+
+async def get_last_notification_id(user_id: int) -> int:
+    """Возвращает ID последнего отправленного уведомления для пользователя."""
+    async with pool.reader() as db:
+        async with db.execute(
+            "SELECT last_notification_id FROM users WHERE id = ?", (user_id,)
+        ) as cursor:
+            row = await cursor.fetchone()
+            return row[0] if row else None
 
 
 async def update_last_notification_id(user_id: int, message_id: int) -> None:
     """Обновляет ID последнего отправленного уведомления для пользователя."""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        try:
+    try:
+        async with pool.writer() as db:
             await db.execute(
                 "UPDATE users SET last_notification_id = ? WHERE id = ?",
                 (message_id, user_id),
             )
-            await db.commit()
-        except aiosqlite.Error:
-            logger.error(
-                "Ошибка при обновлении ID последнего уведомления:", exc_info=True
-            )
+    except aiosqlite.Error:
+        logger.error(
+            "Ошибка при обновлении ID последнего уведомления:", exc_info=True
+        )
+    finally:
+        user_cache.invalidate(user_id)
 
 
 async def get_users_with_notifications() -> list:
     """Возвращает список пользователей, которым нужно отправить уведомление."""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        try:
+    try:
+        async with pool.reader() as db:
             async with db.execute(
                 "SELECT id, access_end_date, last_notification_id FROM users WHERE status = 'accepted'"
             ) as cursor:
                 return await cursor.fetchall()
-        except aiosqlite.Error:
-            logger.error(
-                "Ошибка при получении списка пользователей для уведомлений:",
-                exc_info=True,
+    except aiosqlite.Error:
+        logger.error(
+            "Ошибка при получении списка пользователей для уведомлений:",
+            exc_info=True,
+        )
+        return []
+
+
+async def set_user_blocked(user_id: int, is_blocked: bool) -> None:
+    """Отмечает, что пользователь заблокировал бота (или снова стал доступен)."""
+    try:
+        async with pool.writer() as db:
+            await db.execute(
+                "UPDATE users SET is_blocked = ? WHERE id = ?",
+                (int(is_blocked), user_id),
+            )
+    except aiosqlite.Error:
+        logger.error(
+            "Ошибка при обновлении признака блокировки бота:", exc_info=True
+        )
+    finally:
+        user_cache.invalidate(user_id)
+
+
+BROADCAST_JOB_COLUMNS = "id, text, status, cursor_user_id, total, report_chat_id, progress_message_id, created_at"
+
+
+async def create_broadcast_job(text: str, report_chat_id: int) -> BroadcastJob:
+    """Создает задание рассылки и фиксирует число получателей на момент старта."""
+    async with pool.writer() as db:
+        async with db.execute(
+            "SELECT COUNT(*) FROM users WHERE is_blocked = 0"
+        ) as cursor:
+            total = (await cursor.fetchone())[0]
+        cursor = await db.execute(
+            "INSERT INTO broadcast_jobs (text, status, cursor_user_id, total, report_chat_id, created_at) VALUES (?, 'running', 0, ?, ?, ?)",
+            (text, total, report_chat_id, datetime.now(timezone.utc).isoformat()),
+        )
+        job_id = cursor.lastrowid
+    return await get_broadcast_job(job_id)
+
+
+async def get_broadcast_job(job_id: int) -> BroadcastJob:
+    """Возвращает задание рассылки по его ID."""
+    async with pool.reader() as db:
+        async with db.execute(
+            f"SELECT {BROADCAST_JOB_COLUMNS} FROM broadcast_jobs WHERE id = ?",
+            (job_id,),
+        ) as cursor:
+            return BroadcastJob.from_row(await cursor.fetchone())
+
+
+async def get_active_broadcast_jobs() -> list[BroadcastJob]:
+    """Возвращает незавершенные (идущие и приостановленные) рассылки."""
+    try:
+        async with pool.reader() as db:
+            async with db.execute(
+                f"SELECT {BROADCAST_JOB_COLUMNS} FROM broadcast_jobs WHERE status IN ('running', 'paused') ORDER BY id"
+            ) as cursor:
+                return [BroadcastJob.from_row(row) for row in await cursor.fetchall()]
+    except aiosqlite.Error:
+        logger.error("Ошибка при получении списка рассылок:", exc_info=True)
+        return []
+
+
+async def update_broadcast_job(job_id: int, **fields) -> None:
+    """Обновляет поля задания рассылки (status, cursor_user_id, progress_message_id, finished_at)."""
+    allowed = {"status", "cursor_user_id", "progress_message_id", "finished_at"}
+    if not fields or not set(fields) <= allowed:
+        raise ValueError(f"Недопустимые поля задания рассылки: {set(fields) - allowed}")
+    assignments = ", ".join(f"{name} = ?" for name in fields)
+    async with pool.writer() as db:
+        await db.execute(
+            f"UPDATE broadcast_jobs SET {assignments} WHERE id = ?",
+            (*fields.values(), job_id),
+        )
+
+
+async def get_broadcast_page(job_id: int, after_user_id: int, limit: int) -> list:
+    """Возвращает следующую страницу получателей по возрастанию ID, пропуская уже обработанных."""
+    async with pool.reader() as db:
+        async with db.execute(
+            """
+            SELECT u.id FROM users u
+            LEFT JOIN broadcast_deliveries d ON d.job_id = ? AND d.user_id = u.id
+            WHERE u.id > ? AND u.is_blocked = 0 AND d.user_id IS NULL
+            ORDER BY u.id LIMIT ?
+            """,
+            (job_id, after_user_id, limit),
+        ) as cursor:
+            return [row[0] for row in await cursor.fetchall()]
+
+
+async def record_broadcast_delivery(job_id: int, user_id: int, state: str) -> None:
+    """Сохраняет результат доставки рассылки конкретному пользователю."""
+    async with pool.writer() as db:
+        await db.execute(
+            "INSERT OR REPLACE INTO broadcast_deliveries (job_id, user_id, state) VALUES (?, ?, ?)",
+            (job_id, user_id, state),
+        )
+
+
+async def get_broadcast_delivery_counts(job_id: int) -> dict:
+    """Возвращает количество доставок рассылки по состояниям (sent, blocked, failed)."""
+    async with pool.reader() as db:
+        async with db.execute(
+            "SELECT state, COUNT(*) FROM broadcast_deliveries WHERE job_id = ? GROUP BY state",
+            (job_id,),
+        ) as cursor:
+            return {state: count for state, count in await cursor.fetchall()}
+
+
+async def get_asset_file_ids() -> list:
+    """Возвращает сохраненные file_id статических файлов: (path, kind, signature, file_id)."""
+    try:
+        async with pool.reader() as db:
+            async with db.execute(
+                "SELECT path, kind, signature, file_id FROM asset_file_ids"
+            ) as cursor:
+                return await cursor.fetchall()
+    except aiosqlite.Error:
+        logger.error("Ошибка при получении file_id статических файлов:", exc_info=True)
+        return []
+
+
+async def save_asset_file_id(
+    path: str, kind: str, signature: str, file_id: str
+) -> None:
+    """Сохраняет file_id, выданный Telegram после загрузки статического файла."""
+    try:
+        async with pool.writer() as db:
+            await db.execute(
+                "INSERT OR REPLACE INTO asset_file_ids (path, kind, signature, file_id) VALUES (?, ?, ?, ?)",
+                (path, kind, signature, file_id),
+            )
+    except aiosqlite.Error:
+        logger.error("Ошибка при сохранении file_id статического файла:", exc_info=True)
+
+
+async def delete_asset_file_id(path: str, kind: str) -> None:
+    """Удаляет недействительный file_id статического файла."""
+    try:
+        async with pool.writer() as db:
+            await db.execute(
+                "DELETE FROM asset_file_ids WHERE path = ? AND kind = ?",
+                (path, kind),
             )
-            return []
+    except aiosqlite.Error:
+        logger.error("Ошибка при удалении file_id статического файла:", exc_info=True)
+
+
+async def get_config_file_id(
+    user_id: int, prefix: str, content_hash: str
+) -> Optional[str]:
+    """Возвращает file_id отправленного ранее файла конфигурации с тем же содержимым."""
+    try:
+        async with pool.reader() as db:
+            async with db.execute(
+                "SELECT file_id FROM config_file_ids WHERE user_id = ? AND prefix = ? AND content_hash = ?",
+                (user_id, prefix, content_hash),
+            ) as cursor:
+                row = await cursor.fetchone()
+                return row[0] if row else None
+    except aiosqlite.Error:
+        logger.error("Ошибка при получении file_id конфигурации:", exc_info=True)
+        return None
+
+
+async def save_config_file_id(
+    user_id: int, prefix: str, content_hash: str, file_id: str
+) -> None:
+    """Сохраняет file_id загруженного файла конфигурации вместе с хэшем его содержимого."""
+    try:
+        async with pool.writer() as db:
+            await db.execute(
+                "INSERT OR REPLACE INTO config_file_ids (user_id, prefix, content_hash, file_id) VALUES (?, ?, ?, ?)",
+                (user_id, prefix, content_hash, file_id),
+            )
+    except aiosqlite.Error:
+        logger.error("Ошибка при сохранении file_id конфигурации:", exc_info=True)
+
+
+async def delete_config_file_ids(user_ids: list, prefix: str = None) -> None:
+    """Забывает file_id конфигураций пользователей (например, после перевыпуска ключей)."""
+    try:
+        async with pool.writer() as db:
+            if prefix is None:
+                await db.executemany(
+                    "DELETE FROM config_file_ids WHERE user_id = ?",
+                    [(user_id,) for user_id in user_ids],
+                )
+            else:
+                await db.executemany(
+                    "DELETE FROM config_file_ids WHERE user_id = ? AND prefix = ?",
+                    [(user_id, prefix) for user_id in user_ids],
+                )
+    except aiosqlite.Error:
+        logger.error("Ошибка при удалении file_id конфигураций:", exc_info=True)
+
+
+async def enqueue_provisioning_job(user_id: int, notice: str) -> None:
+    """Ставит (или перезапускает) задание на создание конфигураций пользователя.
+
+    Ключ задания — ID пользователя, поэтому повторные запросы не плодят
+    задания; увеличение version позволяет воркеру понять, что задание
+    перезапустили, пока он его выполнял.
+    """
+    async with pool.writer() as db:
+        await db.execute(
+            """
+            INSERT INTO provisioning_jobs (user_id, notice, status, attempts, version, updated_at)
+            VALUES (?, ?, 'pending', 0, 1, ?)
+            ON CONFLICT(user_id) DO UPDATE SET
+                notice = excluded.notice,
+                status = 'pending',
+                attempts = 0,
+                version = provisioning_jobs.version + 1,
+                updated_at = excluded.updated_at,
+                error = NULL
+            """,
+            (user_id, notice, datetime.now(timezone.utc).isoformat()),
+        )
+
+
+async def claim_provisioning_job(user_id: int):
+    """Переводит ожидающее задание в статус running.
+
+    Возвращает (notice, version, attempts) или None, если задания нет.
+    """
+    async with pool.writer() as db:
+        async with db.execute(
+            "SELECT notice, version, attempts + 1 FROM provisioning_jobs WHERE user_id = ? AND status = 'pending'",
+            (user_id,),
+        ) as cursor:
+            job = await cursor.fetchone()
+        if job:
+            await db.execute(
+                "UPDATE provisioning_jobs SET status = 'running', attempts = attempts + 1, updated_at = ? WHERE user_id = ?",
+                (datetime.now(timezone.utc).isoformat(), user_id),
+            )
+        return job
+
+
+async def finish_provisioning_job(
+    user_id: int, version: int, status: str, error: str = None
+) -> bool:
+    """Сохраняет результат задания, если его не перезапустили за время выполнения."""
+    async with pool.writer() as db:
+        cursor = await db.execute(
+            "UPDATE provisioning_jobs SET status = ?, error = ?, updated_at = ? WHERE user_id = ? AND version = ?",
+            (status, error, datetime.now(timezone.utc).isoformat(), user_id, version),
+        )
+        return cursor.rowcount > 0
+
+
+async def get_pending_provisioning_jobs() -> list:
+    """Возвращает ID пользователей с незавершенными заданиями.
+
+    Задания, прерванные остановкой бота (running), снова становятся ожидающими.
+    """
+    async with pool.writer() as db:
+        await db.execute(
+            "UPDATE provisioning_jobs SET status = 'pending' WHERE status = 'running'"
+        )
+        async with db.execute(
+            "SELECT user_id FROM provisioning_jobs WHERE status = 'pending' ORDER BY updated_at"
+        ) as cursor:
+            return [row[0] for row in await cursor.fetchall()]
 
 
 async def get_all_users() -> list:
     """Возвращает список всех пользователей."""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        try:
+    try:
+        async with pool.reader() as db:
             async with db.execute("SELECT id FROM users") as cursor:
                 return [row[0] for row in await cursor.fetchall()]
-        except aiosqlite.Error:
-            logger.error("Ошибка при получении списка всех пользователей:", exc_info=True)
-            return []
+    except aiosqlite.Error:
+        logger.error("Ошибка при получении списка всех пользователей:", exc_info=True)
+        return []
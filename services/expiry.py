@@ -0,0 +1,78 @@
+import asyncio
+import heapq
+import time
+
+from config.settings import EXPIRY_PRELOAD, EXPIRY_MAX_SLEEP
+
+
+class ExpiryTimer:
+    """Очередь ближайших окончаний доступа (min-heap по epoch-секундам).
+
+    В памяти держатся ближайшие limit сроков, загруженные из БД через load(),
+    и сроки, добавленные arm() после изменения даты окончания доступа. Если из
+    БД загружены не все сроки, более поздние, чем последний загруженный
+    (горизонт), не принимаются — их подхватит следующая загрузка. Устаревшие
+    записи (доступ продлили) безвредны: при срабатывании статус пользователя
+    все равно проверяется запросом к БД.
+    """
+
+    def __init__(self, limit: int = 100, max_sleep: float = 3600):
+        self.limit = limit
+        self.max_sleep = max_sleep
+        self._heap = []
+        self._entries = set()
+        self._horizon = None
+        self._wakeup = asyncio.Event()
+
+    @property
+    def is_empty(self) -> bool:
+        return not self._heap
+
+    def _push(self, end_timestamp: int, user_id: int) -> None:
+        entry = (end_timestamp, user_id)
+        if entry not in self._entries:
+            self._entries.add(entry)
+            heapq.heappush(self._heap, entry)
+
+    def load(self, deadlines: list) -> None:
+        """Добавляет сроки из БД [(user_id, end_timestamp), ...], отсортированные по времени."""
+        for user_id, end_timestamp in deadlines:
+            self._push(end_timestamp, user_id)
+        self._horizon = deadlines[-1][1] if len(deadlines) >= self.limit else None
+
+    def arm(self, user_id: int, end_timestamp: int) -> None:
+        """Добавляет новый срок окончания доступа и будит ожидание, если он ближайший."""
+        if self._horizon is not None and end_timestamp > self._horizon:
+            return
+        self._push(end_timestamp, user_id)
+        if self._heap[0] == (end_timestamp, user_id):
+            self._wakeup.set()
+
+    def pop_due(self, now: float = None) -> list:
+        """Удаляет из очереди и возвращает ID пользователей с наступившим сроком."""
+        now = time.time() if now is None else now
+        due = []
+        # Как и в запросе access_end_date < now, сравнение идет с точностью до секунды
+        while self._heap and self._heap[0][0] + 1 <= now:
+            entry = heapq.heappop(self._heap)
+            self._entries.discard(entry)
+            due.append(entry[1])
+        return due
+
+    async def wait(self) -> bool:
+        """Спит до ближайшего срока, но не дольше max_sleep.
+
+        Возвращает True, если ожидание прервал arm() с более ранним сроком.
+        """
+        self._wakeup.clear()
+        timeout = self.max_sleep
+        if self._heap:
+            timeout = min(timeout, max(0.0, self._heap[0][0] + 1 - time.time()))
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+expiry_timer = ExpiryTimer(limit=EXPIRY_PRELOAD, max_sleep=EXPIRY_MAX_SLEEP)
@@ -1,7 +1,5 @@
 from aiogram.fsm.context import FSMContext
-import aiosqlite
 from core.bot import bot
-from config.settings import DATABASE_PATH
 import logging
 from aiogram.exceptions import TelegramAPIError
 
@@ -48,22 +46,3 @@ async def send_message_with_cleanup(
     await state.update_data(previous_bot_message=bot_message.message_id)
 
     return bot_message
-
-
-async def broadcast_message(text: str) -> None:
-    """Рассылка сообщения всем пользователям."""
-    try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            async with db.execute("SELECT id FROM users") as cursor:
-                users = await cursor.fetchall()
-
-        for user in users:
-            try:
-                await bot.send_message(user[0], text=text, parse_mode="HTML")
-            except TelegramAPIError:
-                logger.error(
-                    f"Не удалось отправить сообщение пользователю {user[0]}:",
-                    exc_info=True,
-                )
-    except aiosqlite.Error:
-        logger.error("Ошибка при рассылке сообщений:", exc_info=True)
@@ -0,0 +1,112 @@
+from datetime import datetime, timezone
+from typing import NamedTuple, Optional
+
+
+def parse_datetime(value) -> Optional[datetime]:
+    """Разбирает дату из БД (epoch-секунды или ISO-строка) в datetime с часовым поясом UTC."""
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value, timezone.utc)
+    if isinstance(value, datetime):
+        parsed = value
+    else:
+        parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+def to_timestamp(value: datetime) -> int:
+    """Переводит datetime в epoch-секунды для хранения в БД (наивное время считается UTC)."""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp())
+
+
+class User(NamedTuple):
+    """Пользователь из таблицы users с уже разобранными датами."""
+
+    id: int
+    username: Optional[str]
+    status: str
+    access_granted_date: Optional[datetime]
+    access_duration: Optional[int]
+    access_end_date: Optional[datetime]
+    last_notification_id: Optional[int]
+    has_used_trial: int
+    is_blocked: int
+
+    @classmethod
+    def from_row(cls, row) -> Optional["User"]:
+        if row is None:
+            return None
+        return cls(
+            row[0],
+            row[1],
+            row[2],
+            parse_datetime(row[3]),
+            row[4],
+            parse_datetime(row[5]),
+            row[6],
+            row[7],
+            row[8],
+        )
+
+    @property
+    def is_accepted(self) -> bool:
+        return self.status == "accepted"
+
+
+class PendingRequest(NamedTuple):
+    """Запрос на доступ для списка ожидающих (id, username, status)."""
+
+    id: int
+    username: Optional[str]
+    status: str
+
+
+class AccessRecord(NamedTuple):
+    """Краткая запись о доступе пользователя (id, username, access_end_date)."""
+
+    id: int
+    username: Optional[str]
+    access_end_date: Optional[datetime]
+
+    @classmethod
+    def from_row(cls, row) -> "AccessRecord":
+        return cls(row[0], row[1], parse_datetime(row[2]))
+
+
+class PromoCode(NamedTuple):
+    """Промокод из таблицы promo_codes."""
+
+    code: str
+    days_duration: int
+    is_active: int
+    usage_count: int
+
+    @classmethod
+    def from_row(cls, row) -> Optional["PromoCode"]:
+        if row is None:
+            return None
+        return cls(*row)
+
+
+class BroadcastJob(NamedTuple):
+    """Сохраненная в БД рассылка и позиция, до которой она дошла."""
+
+    id: int
+    text: str
+    status: str
+    cursor_user_id: int
+    total: int
+    report_chat_id: Optional[int]
+    progress_message_id: Optional[int]
+    created_at: Optional[datetime]
+
+    @classmethod
+    def from_row(cls, row) -> Optional["BroadcastJob"]:
+        if row is None:
+            return None
+        return cls(*row[:7], parse_datetime(row[7]))
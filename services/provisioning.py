@@ -0,0 +1,128 @@
+import asyncio
+import logging
+
+from config.settings import PROVISIONING_WORKERS
+from services import vpn_manager
+from services.db_operations import (
+    get_user_by_id,
+    enqueue_provisioning_job,
+    claim_provisioning_job,
+    finish_provisioning_job,
+    get_pending_provisioning_jobs,
+    delete_config_file_ids,
+)
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 3
+RETRY_DELAY = 30  # секунд между повторными попытками
+
+# Очередь ID пользователей для воркеров; сами задания хранятся в БД
+# (provisioning_jobs), поэтому переживают перезапуск бота.
+_queue = asyncio.Queue()
+_queued = set()
+_workers = []
+_result_handler = None
+
+
+def _schedule(user_id: int) -> None:
+    if user_id not in _queued:
+        _queued.add(user_id)
+        _queue.put_nowait(user_id)
+
+
+async def enqueue_provisioning(user_id: int, notice: str) -> None:
+    """Ставит создание конфигураций пользователя в очередь и сразу возвращает управление.
+
+    notice определяет сообщение, которое воркер отправит пользователю по
+    готовности ("trial", "accepted", "payment"). Повторный вызов для того же
+    пользователя не создает второе задание, а перезапускает существующее.
+    """
+    await enqueue_provisioning_job(user_id, notice)
+    _schedule(user_id)
+
+
+async def _process(user_id: int) -> None:
+    job = await claim_provisioning_job(user_id)
+    if job is None:
+        return
+    notice, version, attempts = job
+
+    # Пользователя могли удалить или его доступ мог истечь, пока задание
+    # ждало в очереди или повтора: выпускать ему ключи уже нельзя
+    user = await get_user_by_id(user_id)
+    if user is None or not user.is_accepted:
+        await finish_provisioning_job(user_id, version, "cancelled", "доступ отозван")
+        logger.info(
+            f"Задание на создание конфигураций пользователя {user_id} отменено: доступ отозван."
+        )
+        return
+
+    try:
+        # Если ключи не перевыпускались, сохраненные file_id конфигураций
+        # остаются действительными
+        if await vpn_manager.create_user(user_id):
+            await delete_config_file_ids([user_id])
+    except Exception as e:
+        logger.error(
+            f"Ошибка при создании конфигураций пользователя {user_id} "
+            f"(попытка {attempts}/{MAX_ATTEMPTS}):",
+            exc_info=True,
+        )
+        if attempts < MAX_ATTEMPTS:
+            if await finish_provisioning_job(user_id, version, "pending", str(e)):
+                asyncio.get_running_loop().call_later(
+                    RETRY_DELAY, _schedule, user_id
+                )
+            return
+        if await finish_provisioning_job(user_id, version, "failed", str(e)):
+            await _notify(user_id, notice, False)
+        return
+
+    # Если задание перезапустили во время выполнения, о результате сообщит
+    # следующий запуск
+    if await finish_provisioning_job(user_id, version, "done"):
+        logger.info(f"Конфигурации пользователя {user_id} созданы ({notice}).")
+        await _notify(user_id, notice, True)
+
+
+async def _notify(user_id: int, notice: str, ok: bool) -> None:
+    if _result_handler is None:
+        return
+    try:
+        await _result_handler(user_id, notice, ok)
+    except Exception:
+        logger.error(
+            f"Не удалось отправить результат создания конфигураций пользователю {user_id}:",
+            exc_info=True,
+        )
+
+
+async def _worker() -> None:
+    while True:
+        user_id = await _queue.get()
+        _queued.discard(user_id)
+        try:
+            await _process(user_id)
+        except Exception:
+            logger.error(
+                f"Ошибка в обработчике задания пользователя {user_id}:", exc_info=True
+            )
+
+
+async def start_provisioning_workers(
+    result_handler, workers: int = PROVISIONING_WORKERS
+) -> None:
+    """Запускает воркеры и возвращает в очередь задания, не завершенные до перезапуска.
+
+    result_handler(user_id, notice, ok) — корутина, сообщающая пользователю
+    о готовности (или ошибке) конфигураций.
+    """
+    global _result_handler
+    _result_handler = result_handler
+    for user_id in await get_pending_provisioning_jobs():
+        _schedule(user_id)
+    if _queued:
+        logger.info(f"В очередь возвращено {len(_queued)} заданий на создание конфигураций.")
+    for _ in range(max(1, workers)):
+        _workers.append(asyncio.create_task(_worker()))
@@ -0,0 +1,48 @@
+import asyncio
+import time
+
+
+class TokenBucket:
+    """Асинхронный ограничитель скорости по алгоритму token bucket.
+
+    Каждый вызов acquire() забирает один токен; токены восполняются со
+    скоростью rate в секунду, но не больше capacity. pause() полностью
+    останавливает выдачу токенов, например после TelegramRetryAfter.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float) -> None:
+        if now > self._updated:
+            self._tokens = min(
+                self.capacity, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+
+    async def acquire(self) -> None:
+        """Ждет, пока не освободится токен, и забирает его."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._blocked_until:
+                    await asyncio.sleep(self._blocked_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float) -> None:
+        """Блокирует выдачу токенов на seconds секунд и обнуляет запас."""
+        blocked_until = time.monotonic() + seconds
+        if blocked_until > self._blocked_until:
+            self._blocked_until = blocked_until
+        self._tokens = 0
+        self._updated = self._blocked_until
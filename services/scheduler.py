@@ -1,3 +1,4 @@
+import asyncio
 import aiosqlite
 from pytils import numeral
 from aiogram import Bot, types
@@ -7,17 +8,31 @@ from babel.dates import format_datetime
 import pytz
 import logging
 import os
+import time
 
-from config.settings import ADMIN_ID, TIMEZONE, DATABASE_PATH
+from config.settings import ADMIN_ID, TIMEZONE
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from core.database import pool
 from services import vpn_manager
+from services.user_cache import user_cache
+from services.models import AccessRecord, to_timestamp
+from services.expiry import expiry_timer
+from services.broadcast import deliver_with_retry, telegram_limiter
+from services.db_operations import (
+    get_last_notification_id,
+    update_last_notification_id,
+)
 
 logger = logging.getLogger(__name__)
 
+_expiry_task = None
+# Сроки раньше этой отметки уже обработаны последней check_users_if_expired();
+# тех, чей доступ отозвать не удалось, повторит следующая полная проверка
+_checked_until = 0
+
 
 async def safe_send_message(
     bot: Bot,
-    db,
     user_id: int,
     message: str,
     parse_mode: str = "HTML",
@@ -25,29 +40,17 @@ async def safe_send_message(
 ) -> bool:
     """Отправляет сообщение пользователю и обрабатывает исключения."""
     try:
-        async with db.execute(
-            """
-            SELECT last_notification_id FROM users WHERE id = ?
-            """,
-            (user_id,),
-        ) as cursor:
-            row = await cursor.fetchone()
-            if row and row[0]:
-                try:
-                    await bot.delete_message(user_id, row[0])
-                except types.TelegramAPIError:
-                    pass
+        last_notification_id = await get_last_notification_id(user_id)
+        if last_notification_id:
+            try:
+                await bot.delete_message(user_id, last_notification_id)
+            except types.TelegramAPIError:
+                pass
 
         sent_message = await bot.send_message(
             user_id, message, parse_mode=parse_mode, reply_markup=reply_markup
         )
-        await db.execute(
-            """
-            UPDATE users SET last_notification_id = ? WHERE id = ?
-            """,
-            (sent_message.message_id, user_id),
-        )
-        await db.commit()
+        await update_last_notification_id(user_id, sent_message.message_id)
         return True
     except types.TelegramForbiddenError:
         logger.warning(f"Пользователь {user_id} заблокировал бота.")
@@ -62,7 +65,6 @@ async def safe_send_message(
 
 async def safe_send_animation(
     bot: Bot,
-    db,
     user_id: int,
     animation: FSInputFile,
     caption: str,
@@ -71,18 +73,12 @@ async def safe_send_animation(
 ) -> bool:
     """Отправляет анимацию пользователю и обрабатывает исключения."""
     try:
-        async with db.execute(
-            """
-            SELECT last_notification_id FROM users WHERE id = ?
-            """,
-            (user_id,),
-        ) as cursor:
-            row = await cursor.fetchone()
-            if row and row[0]:
-                try:
-                    await bot.delete_message(user_id, row[0])
-                except types.TelegramAPIError:
-                    pass
+        last_notification_id = await get_last_notification_id(user_id)
+        if last_notification_id:
+            try:
+                await bot.delete_message(user_id, last_notification_id)
+            except types.TelegramAPIError:
+                pass
 
         sent_message = await bot.send_animation(
             user_id,
@@ -91,13 +87,7 @@ async def safe_send_animation(
             parse_mode=parse_mode,
             reply_markup=reply_markup,
         )
-        await db.execute(
-            """
-            UPDATE users SET last_notification_id = ? WHERE id = ?
-            """,
-            (sent_message.message_id, user_id),
-        )
-        await db.commit()
+        await update_last_notification_id(user_id, sent_message.message_id)
         return True
     except types.TelegramForbiddenError:
         logger.warning(f"Пользователь {user_id} заблокировал бота.")
@@ -112,175 +102,255 @@ async def safe_send_animation(
 
 async def notify_pay_days(bot: Bot) -> None:
     """Уведомляет пользователей о приближающемся истечении доступа к MatrixVPN за несколько дней."""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        try:
-            current_date = datetime.now(timezone.utc)
-            days_thresholds = [3, 1]
-
-            for days in days_thresholds:
-                notification_date = current_date + timedelta(days=days)
+    try:
+        current_date = datetime.now(timezone.utc)
+        days_thresholds = [3, 1]
+
+        for days in days_thresholds:
+            notification_date = current_date + timedelta(days=days)
+            # Границы календарных суток (UTC) — диапазон по индексу (status, access_end_date)
+            day_start = notification_date.replace(
+                hour=0, minute=0, second=0, microsecond=0
+            )
+            async with pool.reader() as db:
                 async with db.execute(
                     """
                     SELECT id, username, access_end_date FROM users
-                    WHERE status = 'accepted' AND date(access_end_date) = date(?)
+                    WHERE status = 'accepted' AND access_end_date >= ? AND access_end_date < ?
                     """,
-                    (notification_date.isoformat(),),
+                    (
+                        to_timestamp(day_start),
+                        to_timestamp(day_start + timedelta(days=1)),
+                    ),
                 ) as cursor:
                     users = await cursor.fetchall()
 
-                for user in users:
-                    user_id, username, access_end_date_str = user
-                    access_end_date = datetime.fromisoformat(access_end_date_str)
-                    end_date_formatted = format_datetime(
-                        access_end_date.replace(tzinfo=pytz.utc).astimezone(
-                            pytz.timezone(TIMEZONE)
-                        ),
-                        "d MMMM yyyy 'в' HH:mm",
-                        locale="ru",
-                    )
-
-                    message = (
-                        f"<b>⏰ Время идет!</b>\n\n"
-                        f"Ваш доступ к <b>MatrixVPN</b> истекает через <b>{numeral.get_plural(days, 'день, дня, дней')}</b>.\n\n"
-                        f"Точная дата и время окончания доступа: <b>{end_date_formatted}</b>\n\n"
-                        f"Пожалуйста, <b>произведите оплату</b>, чтобы избежать возвращения в <b>«матрицу»</b>.\n\n"
-                    )
-                    await safe_send_message(bot, db, user_id, message)
-        except (aiosqlite.Error, types.TelegramAPIError):
-            logger.error("Ошибка при уведомлении пользователей о днях:", exc_info=True)
+            for user in users:
+                user_id, username, access_end_date = AccessRecord.from_row(user)
+                end_date_formatted = format_datetime(
+                    access_end_date.replace(tzinfo=pytz.utc).astimezone(
+                        pytz.timezone(TIMEZONE)
+                    ),
+                    "d MMMM yyyy 'в' HH:mm",
+                    locale="ru",
+                )
+
+                message = (
+                    f"<b>⏰ Время идет!</b>\n\n"
+                    f"Ваш доступ к <b>MatrixVPN</b> истекает через <b>{numeral.get_plural(days, 'день, дня, дней')}</b>.\n\n"
+                    f"Точная дата и время окончания доступа: <b>{end_date_formatted}</b>\n\n"
+                    f"Пожалуйста, <b>произведите оплату</b>, чтобы избежать возвращения в <b>«матрицу»</b>.\n\n"
+                )
+                await safe_send_message(bot, user_id, message)
+    except (aiosqlite.Error, types.TelegramAPIError):
+        logger.error("Ошибка при уведомлении пользователей о днях:", exc_info=True)
 
 
 async def notify_pay_hour(bot: Bot) -> None:
     """Уведомляет пользователей о приближающемся истечении доступа к MatrixVPN за несколько часов."""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        try:
-            current_date = datetime.now(timezone.utc)
-            hours_thresholds = [12, 1]
+    try:
+        current_date = datetime.now(timezone.utc)
+        hours_thresholds = [12, 1]
 
-            for hours in hours_thresholds:
-                notification_date = current_date + timedelta(hours=hours)
+        for hours in hours_thresholds:
+            notification_date = current_date + timedelta(hours=hours)
+            async with pool.reader() as db:
                 async with db.execute(
                     """
                     SELECT id, username, access_end_date FROM users
-                    WHERE status = 'accepted' AND datetime(access_end_date) <= datetime(?, '+1 hour') AND datetime(access_end_date) > datetime(?) 
+                    WHERE status = 'accepted' AND access_end_date > ? AND access_end_date <= ?
                     """,
-                    (notification_date.isoformat(), notification_date.isoformat()),
+                    (
+                        to_timestamp(notification_date),
+                        to_timestamp(notification_date + timedelta(hours=1)),
+                    ),
                 ) as cursor:
                     users = await cursor.fetchall()
 
-                for user in users:
-                    user_id, username, access_end_date_str = user
-                    access_end_date = datetime.fromisoformat(access_end_date_str)
-                    end_date_formatted = format_datetime(
-                        access_end_date.replace(tzinfo=pytz.utc).astimezone(
-                            pytz.timezone(TIMEZONE)
-                        ),
-                        "d MMMM yyyy 'в' HH:mm",
-                        locale="ru",
-                    )
-
-                    message = (
-                        f"<b>📢 Внимание!</b>\n\n"
-                        f"Ваш доступ к <b>MatrixVPN</b> истекает через <b>{numeral.get_plural(hours, 'час, часа, часов')}</b> ⏳\n\n"
-                        f"Точная дата и время окончания доступа: <b>{end_date_formatted}</b>\n\n"
-                        f"Пожалуйста, <b>произведите оплату</b>, чтобы избежать возвращения в <b>«матрицу»</b>.\n\n"
-                    )
-                    await safe_send_message(bot, db, user_id, message)
-        except (aiosqlite.Error, types.TelegramAPIError):
-            logger.error("Ошибка при уведомлении пользователей о часах:", exc_info=True)
+            for user in users:
+                user_id, username, access_end_date = AccessRecord.from_row(user)
+                end_date_formatted = format_datetime(
+                    access_end_date.replace(tzinfo=pytz.utc).astimezone(
+                        pytz.timezone(TIMEZONE)
+                    ),
+                    "d MMMM yyyy 'в' HH:mm",
+                    locale="ru",
+                )
+
+                message = (
+                    f"<b>📢 Внимание!</b>\n\n"
+                    f"Ваш доступ к <b>MatrixVPN</b> истекает через <b>{numeral.get_plural(hours, 'час, часа, часов')}</b> ⏳\n\n"
+                    f"Точная дата и время окончания доступа: <b>{end_date_formatted}</b>\n\n"
+                    f"Пожалуйста, <b>произведите оплату</b>, чтобы избежать возвращения в <b>«матрицу»</b>.\n\n"
+                )
+                await safe_send_message(bot, user_id, message)
+    except (aiosqlite.Error, types.TelegramAPIError):
+        logger.error("Ошибка при уведомлении пользователей о часах:", exc_info=True)
 
 
 async def make_daily_backup(bot: Bot) -> None:
     """Создает резервную копию базы данных и отправляет ее администратору."""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        backup_path = (
-            f"backup_{datetime.now(timezone.utc).strftime('%Y-%m-%d_%H-%M-%S')}.db"
-        )
-        try:
+    backup_path = (
+        f"backup_{datetime.now(timezone.utc).strftime('%Y-%m-%d_%H-%M-%S')}.db"
+    )
+    try:
+        async with pool.reader() as db:
             async with aiosqlite.connect(backup_path) as backup_db:
                 await db.backup(backup_db)
-            await bot.send_document(
-                ADMIN_ID,
-                FSInputFile(backup_path),
-                caption=f"Резервная копия базы данных от {datetime.now(timezone.utc).isoformat()}",
-            )
-            os.remove(backup_path)
-        except (IOError, OSError, types.TelegramAPIError, aiosqlite.Error):
-            logger.error("Ошибка при создании резервной копии:", exc_info=True)
+        await bot.send_document(
+            ADMIN_ID,
+            FSInputFile(backup_path),
+            caption=f"Резервная копия базы данных от {datetime.now(timezone.utc).isoformat()}",
+        )
+        os.remove(backup_path)
+    except (IOError, OSError, types.TelegramAPIError, aiosqlite.Error):
+        logger.error("Ошибка при создании резервной копии:", exc_info=True)
 
 
 async def check_users_if_expired(bot: Bot) -> None:
     """Проверяет пользователей с истекшим доступом и уведомляет их об этом."""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        try:
-            await db.execute("BEGIN")
-            current_date = datetime.now(timezone.utc).isoformat()
+    global _checked_until
+    try:
+        current_date = to_timestamp(datetime.now(timezone.utc))
 
+        async with pool.reader() as db:
             async with db.execute(
                 """
                     SELECT id, username FROM users
-                    WHERE access_end_date IS NOT NULL AND status = "accepted" AND access_end_date < ?
+                    WHERE status = 'accepted' AND access_end_date < ?
                     """,
                 (current_date,),
             ) as cursor:
                 expired_users = await cursor.fetchall()
+        _checked_until = current_date
 
-            for user in expired_users:
-                user_id, username = user
-
-                await db.execute(
-                    """
-                        UPDATE users SET status = 'expired', access_granted_date = NULL, access_duration = NULL
-                        WHERE id = ?
-                        """,
-                    (user_id,),
-                )
-                await vpn_manager.delete_user(user_id)
-
-                message = (
-                    f"<b>🚫 Внимание, @{username}!</b>\n\n"
-                    f"Ваша подписка на доступ к <b>MatrixVPN</b> истекла ⏳\n\n"
-                    f"Пожалуйста, <b>продлите подписку</b>, чтобы выйти из <b>«матрицы»</b>."
-                )
-                await safe_send_animation(
-                    bot, db, user_id, FSInputFile("assets/expired.gif"), message
-                )
+        if not expired_users:
+            return
 
-                markup = types.InlineKeyboardMarkup(
-                    inline_keyboard=[
-                        [
-                            types.InlineKeyboardButton(
-                                text="Продлить доступ",
-                                callback_data=f"approve_request_{user_id}",
-                            )
-                        ]
-                    ]
-                )
-                await bot.send_message(
-                    ADMIN_ID,
-                    f"Доступ пользователя @{username} (ID: {user_id}) истек.",
-                    reply_markup=markup,
-                )
-            await db.commit()
-        except aiosqlite.Error:
-            await db.rollback()
+        # Профили всех истекших пользователей удаляются за один проход по конфигам WireGuard.
+        # Статус меняется только у тех, чей доступ отозван: остальные останутся
+        # 'accepted' и будут обработаны при следующей проверке.
+        failed = await vpn_manager.delete_users(
+            [user_id for user_id, _ in expired_users]
+        )
+        for user_id, error in failed.items():
             logger.error(
-                "Ошибка при обновлении статусов пользователей (ошибка БД):",
-                exc_info=True,
+                f"Не удалось отозвать доступ пользователя {user_id}, повторим при следующей проверке: {error}"
             )
-        except types.TelegramAPIError:
-            await db.rollback()
-            logger.error(
-                "Ошибка Telegram API при обновлении статусов пользователей:",
-                exc_info=True,
+        expired_users = [
+            (user_id, username)
+            for user_id, username in expired_users
+            if user_id not in failed
+        ]
+        if not expired_users:
+            return
+
+        async with pool.writer() as db:
+            await db.executemany(
+                """
+                    UPDATE users SET status = 'expired', access_granted_date = NULL, access_duration = NULL
+                    WHERE id = ?
+                    """,
+                [(user_id,) for user_id, _ in expired_users],
             )
-        except Exception as e:  # Catch any other unexpected errors
-            await db.rollback()
-            logger.error(
-                f"Неожиданная ошибка при обновлении статусов пользователей: {e}",
-                exc_info=True,
+            await db.executemany(
+                "DELETE FROM config_file_ids WHERE user_id = ?",
+                [(user_id,) for user_id, _ in expired_users],
+            )
+        for user_id, _ in expired_users:
+            user_cache.invalidate(user_id)
+
+        for user_id, username in expired_users:
+            message = (
+                f"<b>🚫 Внимание, @{username}!</b>\n\n"
+                f"Ваша подписка на доступ к <b>MatrixVPN</b> истекла ⏳\n\n"
+                f"Пожалуйста, <b>продлите подписку</b>, чтобы выйти из <b>«матрицы»</b>."
+            )
+            await safe_send_animation(
+                bot, user_id, FSInputFile("assets/expired.gif"), message
             )
 
+            markup = types.InlineKeyboardMarkup(
+                inline_keyboard=[
+                    [
+                        types.InlineKeyboardButton(
+                            text="Продлить доступ",
+                            callback_data=f"approve_request_{user_id}",
+                        )
+                    ]
+                ]
+            )
+            admin_text = f"Доступ пользователя @{username} (ID: {user_id}) истек."
+            # Учитывает флуд-лимит; ошибка не прерывает уведомление остальных пользователей
+            await deliver_with_retry(
+                ADMIN_ID,
+                lambda: bot.send_message(ADMIN_ID, admin_text, reply_markup=markup),
+                telegram_limiter,
+            )
+    except aiosqlite.Error:
+        logger.error(
+            "Ошибка при обновлении статусов пользователей (ошибка БД):",
+            exc_info=True,
+        )
+    except types.TelegramAPIError:
+        logger.error(
+            "Ошибка Telegram API при обновлении статусов пользователей:",
+            exc_info=True,
+        )
+    except Exception as e:  # Catch any other unexpected errors
+        logger.error(
+            f"Неожиданная ошибка при обновлении статусов пользователей: {e}",
+            exc_info=True,
+        )
+
+
+async def load_next_expirations() -> None:
+    """Загружает в таймер ближайшие сроки окончания доступа (по индексу (status, access_end_date)).
+
+    Уже проверенные сроки не загружаются: иначе пользователи, чей доступ не
+    удалось отозвать, снова и снова будили бы таймер.
+    """
+    async with pool.reader() as db:
+        async with db.execute(
+            """
+            SELECT id, access_end_date FROM users
+            WHERE status = 'accepted' AND access_end_date >= ?
+            ORDER BY access_end_date LIMIT ?
+            """,
+            (_checked_until, expiry_timer.limit),
+        ) as cursor:
+            expiry_timer.load(await cursor.fetchall())
+
+
+async def run_expiry_timer(bot: Bot) -> None:
+    """Отключает доступ в момент его окончания вместо опроса раз в 10 минут.
+
+    Спит до ближайшего срока из expiry_timer; update_user_access() и
+    grant_access() будят его, если новый срок раньше.
+    Раз в expiry_timer.max_sleep секунд выполняется страховочная полная
+    проверка с перезагрузкой сроков из БД.
+    """
+    last_full_check = time.monotonic()
+    await check_users_if_expired(bot)  # Доступ, истекший, пока бот был остановлен
+    await load_next_expirations()
+    while True:
+        try:
+            if expiry_timer.is_empty:
+                await load_next_expirations()
+            await expiry_timer.wait()
+            due = expiry_timer.pop_due()
+            if time.monotonic() - last_full_check >= expiry_timer.max_sleep:
+                last_full_check = time.monotonic()
+                await check_users_if_expired(bot)
+                await load_next_expirations()
+            elif due:
+                await check_users_if_expired(bot)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.error("Ошибка в таймере окончания доступа:", exc_info=True)
+            await asyncio.sleep(60)
+
 
 async def start_scheduler(bot: Bot) -> None:
     """Запускает планировщик для периодических задач бота."""
@@ -305,15 +375,6 @@ async def start_scheduler(bot: Bot) -> None:
         replace_existing=True,
     )
 
-    scheduler.add_job(
-        check_users_if_expired,
-        trigger="interval",
-        minutes=10,
-        args=[bot],
-        id="check_users_if_expired_job",
-        replace_existing=True,
-    )
-
     scheduler.add_job(
         make_daily_backup,
         trigger="cron",
@@ -325,3 +386,6 @@ async def start_scheduler(bot: Bot) -> None:
     )
 
     scheduler.start()
+    # Окончание доступа обрабатывается таймером по ближайшему сроку, а не опросом
+    global _expiry_task
+    _expiry_task = asyncio.create_task(run_expiry_timer(bot))
@@ -0,0 +1,67 @@
+import time
+
+from config.settings import USER_CACHE_TTL, USER_CACHE_MAX_SIZE
+
+
+class UserCache:
+    """TTL-кэш строк пользователей по ID со счетчиками попаданий и промахов.
+
+    Любая запись в таблицу users должна вызывать invalidate(), чтобы
+    следующее чтение пошло в БД. Счетчик поколений не дает сохранить в кэш
+    строку, прочитанную до инвалидации, но записанную после нее.
+    """
+
+    def __init__(self, ttl: float = 60, max_size: int = 10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = {}
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def get(self, user_id: int) -> tuple:
+        """Возвращает (True, строка) при попадании и (False, None), если записи нет или она устарела."""
+        entry = self._entries.get(user_id)
+        if entry is not None:
+            expires_at, row = entry
+            if expires_at > time.monotonic():
+                self.hits += 1
+                return True, row
+            del self._entries[user_id]
+        self.misses += 1
+        return False, None
+
+    def set(self, user_id: int, row, generation: int = None) -> None:
+        """Сохраняет строку, если с момента чтения не было инвалидаций."""
+        if self.ttl <= 0:
+            return
+        if generation is not None and generation != self._generation:
+            return
+        if user_id not in self._entries and len(self._entries) >= self.max_size:
+            # dict сохраняет порядок вставки — вытесняем самую старую запись
+            self._entries.pop(next(iter(self._entries)))
+        self._entries[user_id] = (time.monotonic() + self.ttl, row)
+
+    def invalidate(self, user_id: int) -> None:
+        self._generation += 1
+        self._entries.pop(user_id, None)
+
+    def clear(self) -> None:
+        self._generation += 1
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._entries),
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+user_cache = UserCache(ttl=USER_CACHE_TTL, max_size=USER_CACHE_MAX_SIZE)
@@ -1,16 +1,33 @@
 import os
 import pathlib
 import asyncio
-import aiosqlite
 import re
 import shutil
+import ipaddress
 from datetime import datetime
 import json
 import sqlite3
-from xtlsapi import XrayClient, utils
-from contextlib import asynccontextmanager
+import base64
+import secrets
+import uuid as uuid_module
+import time
+import grpc
+from xtlsapi import utils, exceptions as xray_exceptions
+from xtlsapi.api_services import APIService
+from xtlsapi.xray_api.app.proxyman.command import command_pb2
+from xtlsapi.xray_api.proxy.vless import account_pb2 as vless_account_pb2
+from contextlib import asynccontextmanager, AsyncExitStack, nullcontext
 import aiofiles
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+from typing import NamedTuple
+
+from core.pool import ConnectionPool
+
+try:
+    from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey
+    from cryptography.hazmat.primitives import serialization
+except ImportError:  # Listed in requirements.txt; fall back to the wg binary
+    X25519PrivateKey = None
 
 
 # --- Configuration Class ---
@@ -18,6 +35,7 @@ class Config:
     """Handles loading and accessing configuration from the setup file."""
 
     def __init__(self, setup_file_path="/root/antizapret/setup"):
+        self.setup_file_path = setup_file_path
         self.config = {}
         self.load_config(setup_file_path)
 
@@ -39,13 +57,21 @@ class Config:
     def load_config(self, setup_file_path):
         if not os.path.exists(setup_file_path):
             raise FileNotFoundError(f"Setup file not found: {setup_file_path}")
+        values = {}
         with open(setup_file_path, "r") as f:
             for line in f:
                 line = line.strip()
                 if line and not line.startswith("#"):
                     if "=" in line:
                         key, value = line.split("=", 1)
-                        self.config[key.strip()] = value.strip()
+                        values[key.strip()] = value.strip()
+        # Published with one assignment: reload() runs in a worker thread
+        # while coroutines may be reading config.config
+        self.config = values
+
+    def reload(self):
+        """Re-reads the setup values; paths resolved at startup stay unchanged."""
+        self.load_config(self.setup_file_path)
 
     def get(self, key, default=None):
         return self.config.get(key, default)
@@ -54,8 +80,37 @@ class Config:
 # Global config instance and lock management
 config = Config()
 SERVER_IP = None
-openvpn_lock = asyncio.Lock()  # Global lock for all OpenVPN/easyrsa operations
+pki_lock = asyncio.Lock()  # Serializes easyrsa steps touching shared PKI state (index.txt, serial, CRL)
+openvpn_initialized = False
+CRL_BATCH_WINDOW = 2.0  # Seconds to collect revocations before one gen-crl
+_revocation_queue = []  # (client_name, future) waiting for the next CRL
+_revocation_flusher = None
 user_locks = defaultdict(asyncio.Lock)  # Per-user locks for WG and VLESS
+wg_config_locks = defaultdict(asyncio.Lock)  # In-process locks per WireGuard config file
+WG_INTERFACES = ["antizapret", "vpn"]
+WG_KEYGEN_CONCURRENCY = 8  # Peers generating keys via wg subprocesses at once
+_wg_keygen_slots = asyncio.Semaphore(WG_KEYGEN_CONCURRENCY)
+
+# With LAZY_PROFILES=y only key material is created on provisioning and each
+# client profile is rendered the first time it is requested (ensure_profile)
+LAZY_PROFILES = config.get("LAZY_PROFILES", "n").lower() == "y"
+
+# Client profile prefixes and what they are rendered from
+OPENVPN_PROFILES = {
+    "AZ-UDP": "antizapret-udp.conf",
+    "AZ-TCP": "antizapret-tcp.conf",
+    "AZ-U+T": "antizapret.conf",
+    "GL-UDP": "vpn-udp.conf",
+    "GL-TCP": "vpn-tcp.conf",
+    "GL-U+T": "vpn.conf",
+}
+WIREGUARD_PROFILES = {
+    "AZ-WG": ("antizapret", "wg"),
+    "AZ-AM": ("antizapret", "am"),
+    "GL-WG": ("vpn", "wg"),
+    "GL-AM": ("vpn", "am"),
+}
+XRAY_PROFILES = {"AZ-XR": "json", "GL-XR": "txt"}
 
 
 # --- Helper Functions ---
@@ -103,58 +158,223 @@ async def file_lock(lock_file_path):
             await asyncio.to_thread(os.remove, lock_file)
 
 
+def extract_cert_pem(content):
+    start_marker = "-----BEGIN CERTIFICATE-----"
+    end_marker = "-----END CERTIFICATE-----"
+    start_index = content.find(start_marker)
+    end_index = content.find(end_marker)
+    if start_index != -1 and end_index != -1:
+        return content[start_index:end_index + len(end_marker)]
+    return ""
+
+
 async def extract_cert_content(cert_path):
     try:
         async with aiofiles.open(cert_path, "r") as f:
-            content = await f.read()
-        start_marker = "-----BEGIN CERTIFICATE-----"
-        end_marker = "-----END CERTIFICATE-----"
-        start_index = content.find(start_marker)
-        end_index = content.find(end_marker)
-        if start_index != -1 and end_index != -1:
-            return content[start_index:end_index + len(end_marker)]
+            return extract_cert_pem(await f.read())
     except IOError as e:
         print(f"Could not read certificate file {cert_path}: {e}")
     return ""
 
 
-async def modify_wg_config(config_path, client_name, new_peer_block=None):
-    if not await asyncio.to_thread(os.path.exists, config_path):
-        return False
+class WgPeer(NamedTuple):
+    private_key: str
+    public_key: str
+    preshared_key: str
+    ip: str
+
 
-    async with aiofiles.open(config_path, "r") as f:
-        lines = await f.readlines()
+def parse_wg_config(content):
+    """Splits a WireGuard config into interface lines and peer blocks.
 
-    new_lines = []
-    client_found = False
-    in_client_block = False
+    Peer blocks start with a "# Client = <name>" comment and run until the
+    next blank line. Returns (header_lines, peers) where peers maps client
+    name to the block lines in file order.
+    """
+    lines = content.splitlines(keepends=True)
+    header = []
+    peers = {}
 
     i = 0
     while i < len(lines):
-        line = lines[i]
-        if line.strip() == f"# Client = {client_name}":
-            client_found = True
-            i += 1
+        stripped = lines[i].strip()
+        if stripped.startswith("# Client = "):
+            client_name = stripped[len("# Client = "):]
+            block = []
             while i < len(lines) and lines[i].strip() != "":
+                block.append(lines[i])
                 i += 1
-            if i < len(lines) and lines[i].strip() == "":
+            if i < len(lines):
                 i += 1
+            peers[client_name] = block
             continue
-        new_lines.append(line)
+        header.append(lines[i])
         i += 1
 
-    while new_lines and new_lines[-1].strip() == "":
-        new_lines.pop()
+    return header, peers
 
-    if new_peer_block:
-        new_lines.append("\n")
-        new_lines.append(new_peer_block)
-        new_lines.append("\n")
 
-    async with aiofiles.open(config_path, "w") as f:
-        await f.writelines(new_lines)
+def format_wg_config(header, peers):
+    lines = list(header)
+    while lines and lines[-1].strip() == "":
+        lines.pop()
+    content = "".join(lines)
+    for block in peers.values():
+        content += "\n" + "".join(block).rstrip("\n") + "\n"
+    return content
+
 
-    return client_found
+class WgConfig:
+    """In-memory model of a WireGuard server config.
+
+    Peers are indexed by client name, and client addresses are tracked in a
+    bitmap over the interface subnet plus a free-list of released
+    addresses, so peer lookups and IP allocation never rescan the file.
+    Subnets of any size are supported, not only /24.
+    """
+
+    def __init__(self, content):
+        self.header, self.peers = parse_wg_config(content)
+
+        address = re.search(r"Address\s*=\s*(\d{1,3}(?:\.\d{1,3}){3}(?:/\d{1,2})?)",
+                            content)
+        if not address:
+            raise ValueError("WireGuard config has no IPv4 Address")
+        interface = address.group(1)
+        if "/" not in interface:
+            interface += "/24"
+        self.network = ipaddress.ip_interface(interface).network
+
+        self._base = int(self.network.network_address)
+        self._allocated = bytearray(self.network.num_addresses)
+        self._free = []
+        # .0 is the network, .1 the server by convention, the last one is broadcast
+        self._next = 2
+        self._allocated[0] = 1
+        self._allocated[-1] = 1
+        self._peer_offsets = {}
+
+        for ip in re.findall(r"\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}",
+                             "".join(self.header)):
+            self._reserve(self._offset(ip))
+        for client_name, block in self.peers.items():
+            offset = self._offset(self._parse_peer(block).ip)
+            self._reserve(offset)
+            if offset is not None:
+                self._peer_offsets[client_name] = offset
+
+    def _offset(self, ip):
+        try:
+            offset = int(ipaddress.IPv4Address(ip)) - self._base
+        except ValueError:
+            return None
+        return offset if 0 <= offset < len(self._allocated) else None
+
+    def _reserve(self, offset):
+        if offset is not None:
+            self._allocated[offset] = 1
+
+    def _allocate(self):
+        while self._free:
+            offset = self._free.pop()
+            if not self._allocated[offset]:
+                self._allocated[offset] = 1
+                return offset
+        while self._next < len(self._allocated) - 1:
+            offset = self._next
+            self._next += 1
+            if not self._allocated[offset]:
+                self._allocated[offset] = 1
+                return offset
+        return None
+
+    @staticmethod
+    def _parse_peer(block):
+        fields = {}
+        for line in block:
+            key, sep, value = line.lstrip("# ").partition("=")
+            if sep:
+                fields[key.strip()] = value.strip()
+        return WgPeer(
+            fields.get("PrivateKey", ""),
+            fields.get("PublicKey", ""),
+            fields.get("PresharedKey", ""),
+            fields.get("AllowedIPs", "").split("/")[0],
+        )
+
+    def get_peer(self, client_name):
+        block = self.peers.get(client_name)
+        return self._parse_peer(block) if block is not None else None
+
+    def remove_peer(self, client_name):
+        if self.peers.pop(client_name, None) is None:
+            return False
+        offset = self._peer_offsets.pop(client_name, None)
+        if offset is not None:
+            self._allocated[offset] = 0
+            self._free.append(offset)
+        return True
+
+    def add_peer(self, client_name, private_key, public_key, preshared_key):
+        """Adds a peer with the next free address; returns None if the subnet is full."""
+        self.remove_peer(client_name)
+        offset = self._allocate()
+        if offset is None:
+            return None
+        peer = WgPeer(private_key, public_key, preshared_key,
+                      str(ipaddress.IPv4Address(self._base + offset)))
+        self.peers[client_name] = [
+            f"# Client = {client_name}\n",
+            f"# PrivateKey = {private_key}\n",
+            "[Peer]\n",
+            f"PublicKey = {public_key}\n",
+            f"PresharedKey = {preshared_key}\n",
+            f"AllowedIPs = {peer.ip}/32\n",
+        ]
+        self._peer_offsets[client_name] = offset
+        return peer
+
+    def format(self):
+        return format_wg_config(self.header, self.peers)
+
+
+_wg_configs = {}  # conf_path -> ((mtime_ns, size), WgConfig)
+
+
+async def _file_signature(path):
+    stat = await asyncio.to_thread(os.stat, path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+async def load_wg_config(conf_path):
+    """Returns the cached WgConfig for conf_path, re-parsing it only if the file changed on disk."""
+    signature = await _file_signature(conf_path)
+    cached = _wg_configs.get(conf_path)
+    if cached and cached[0] == signature:
+        return cached[1]
+    async with aiofiles.open(conf_path, "r") as f:
+        wg_config = WgConfig(await f.read())
+    _wg_configs[conf_path] = (signature, wg_config)
+    return wg_config
+
+
+async def get_wg_peer(wg_type, client_name):
+    """Looks up a client's peer (keys and IP) in the given interface config."""
+    conf_path = os.path.join(config.WIREGUARD_DIR, f"{wg_type}.conf")
+    if not await asyncio.to_thread(os.path.exists, conf_path):
+        return None
+    async with wg_config_locks[conf_path]:
+        return (await load_wg_config(conf_path)).get_peer(client_name)
+
+
+async def write_file_atomic(path, content):
+    """Writes content to a temp file next to path and renames it over path."""
+    tmp_path = f"{path}.tmp"
+    async with aiofiles.open(tmp_path, "w") as f:
+        await f.write(content)
+    if await asyncio.to_thread(os.path.exists, path):
+        await asyncio.to_thread(shutil.copymode, path, tmp_path)
+    await asyncio.to_thread(os.replace, tmp_path, path)
 
 
 async def sync_wireguard_config(interface_name):
@@ -183,13 +403,83 @@ async def set_server_host_file_name(client_name, server_host_override=""):
     return SERVER_HOST, FILE_NAME
 
 
+_PLACEHOLDER_RE = re.compile(r"\$\{([a-zA-Z_][a-zA-Z_0-9]*)}")
+
+
+def compile_template(content):
+    """Splits a template into segments: literals at even and placeholder names at odd positions."""
+    return tuple(_PLACEHOLDER_RE.split(content))
+
+
+async def load_template(template_file_path):
+    """Returns the compiled template, re-reading the file only when it changed."""
+    return await read_cached(template_file_path, compile_template)
+
+
 async def render(template_file_path, variables):
-    async with aiofiles.open(template_file_path, "r") as f:
+    segments = await load_template(template_file_path)
+    # Unknown placeholders render as empty strings
+    return "".join(
+        segment if i % 2 == 0 else str(variables.get(segment, ""))
+        for i, segment in enumerate(segments))
+
+
+# --- Server Material Cache ---
+_file_cache = {}  # (path, parse) -> ((mtime_ns, size), parsed value)
+
+
+async def read_cached(path, parse=None):
+    """Reads and parses a file once, re-reading it only after its mtime/size changes."""
+    signature = await _file_signature(path)
+    key = (path, parse)
+    cached = _file_cache.get(key)
+    if cached and cached[0] == signature:
+        return cached[1]
+    async with aiofiles.open(path, "r") as f:
         content = await f.read()
-    for var_name, value in variables.items():
-        content = content.replace(f"${{{var_name}}}", str(value))
-    content = re.sub(r"\$\{[a-zA-Z_][a-zA-Z_0-9]*}", "", content)
-    return content
+    value = parse(content) if parse else content
+    _file_cache[key] = (signature, value)
+    return value
+
+
+def _parse_wg_public_key(content):
+    return re.search(r"PUBLIC_KEY=(.*)", content).group(1)
+
+
+async def get_ca_cert():
+    """CA certificate PEM used in every OpenVPN profile."""
+    return await read_cached(
+        os.path.join(config.OPENVPN_DIR, "server/keys/ca.crt"),
+        extract_cert_pem)
+
+
+async def get_server_wg_public_key():
+    return await read_cached(os.path.join(config.WIREGUARD_DIR, "key"),
+                             _parse_wg_public_key)
+
+
+async def get_wg_ips():
+    """Contents of the WireGuard "ips" file (AllowedIPs list), empty if it is missing."""
+    ips_path = os.path.join(config.WIREGUARD_DIR, "ips")
+    if not await asyncio.to_thread(os.path.exists, ips_path):
+        return ""
+    return await read_cached(ips_path)
+
+
+_setup_signature = None
+
+
+async def refresh_setup_config():
+    """Reloads the setup values if the setup file changed since the last load."""
+    global _setup_signature
+    signature = await _file_signature(config.setup_file_path)
+    if _setup_signature is None:
+        _setup_signature = signature
+    elif signature != _setup_signature:
+        await asyncio.to_thread(config.reload)
+        _setup_signature = signature
+        print(f"Reloaded {config.setup_file_path}")
+    return config
 
 
 # --- OpenVPN Functions ---
@@ -261,20 +551,113 @@ async def init_openvpn():
     crl_path = os.path.join(server_keys_dir, "crl.pem")
     if not await asyncio.to_thread(os.path.exists, crl_path):
         print("Generating CRL...")
-        await run_command(["/usr/share/easy-rsa/easyrsa", "gen-crl"],
-                          cwd=config.EASYRSA_DIR,
-                          env={
-                              "EASYRSA_CRL_DAYS": "3650",
-                              **os.environ
-                          })
-        await asyncio.to_thread(shutil.copy, os.path.join(pki_dir, "crl.pem"),
-                                crl_path)
-        await asyncio.to_thread(os.chmod, crl_path, 0o644)
+        await publish_crl()
+
+
+async def publish_crl():
+    """Regenerates crl.pem and copies it to the OpenVPN server keys (caller holds pki_lock)."""
+    stdout, _ = await run_command(["/usr/share/easy-rsa/easyrsa", "gen-crl"],
+                                  cwd=config.EASYRSA_DIR,
+                                  env={
+                                      "EASYRSA_CRL_DAYS": "3650",
+                                      **os.environ
+                                  })
+    if stdout is None:
+        raise RuntimeError("easyrsa gen-crl failed")
+    crl_src = os.path.join(config.EASYRSA_DIR, "pki", "crl.pem")
+    crl_dest = os.path.join(config.OPENVPN_DIR, "server/keys/crl.pem")
+    await asyncio.to_thread(shutil.copy, crl_src, crl_dest)
+    await asyncio.to_thread(os.chmod, crl_dest, 0o644)
+
+
+def _crl_outdated():
+    """True if index.txt changed after the published CRL was copied."""
+    index_path = os.path.join(config.EASYRSA_DIR, "pki", "index.txt")
+    crl_path = os.path.join(config.OPENVPN_DIR, "server/keys/crl.pem")
+    try:
+        return os.path.getmtime(index_path) > os.path.getmtime(crl_path)
+    except OSError:
+        return True
+
+
+async def _flush_revocations():
+    global _revocation_flusher
+    try:
+        await asyncio.sleep(CRL_BATCH_WINDOW)
+        batch = list(_revocation_queue)
+        _revocation_queue.clear()
+        revoked = []  # Futures of clients whose certificate is revoked in index.txt
+        revoked_now = 0
+        try:
+            async with pki_lock:
+                for client_name, future in batch:
+                    issued = os.path.join(config.EASYRSA_DIR, "pki", "issued",
+                                          f"{client_name}.crt")
+                    try:
+                        # Already revoked by an earlier attempt that failed later
+                        if await asyncio.to_thread(os.path.exists, issued):
+                            stdout, _ = await run_command([
+                                "/usr/share/easy-rsa/easyrsa", "--batch",
+                                "revoke", client_name
+                            ],
+                                                          cwd=config.EASYRSA_DIR)
+                            if stdout is None:
+                                raise RuntimeError(
+                                    f"easyrsa revoke {client_name} failed")
+                            revoked_now += 1
+                    except Exception as e:
+                        # One failed revocation must not fail the rest of the batch
+                        future.set_exception(e)
+                        continue
+                    revoked.append(future)
+                # A CRL is still due if an earlier revocation was not published
+                if revoked_now or (revoked and await asyncio.to_thread(
+                        _crl_outdated)):
+                    await publish_crl()
+                    print(
+                        f"CRL updated, {revoked_now} OpenVPN certificate(s) revoked"
+                    )
+        except Exception as e:
+            for future in revoked:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for future in revoked:
+                if not future.done():
+                    future.set_result(None)
+    finally:
+        _revocation_flusher = None
+        if _revocation_queue:
+            _revocation_flusher = asyncio.create_task(_flush_revocations())
+
+
+async def revoke_openvpn(client_name):
+    """Queues a certificate revocation and waits until the new CRL is published.
+
+    Revocations arriving within CRL_BATCH_WINDOW are revoked together and
+    followed by a single gen-crl and CRL copy.
+    """
+    global _revocation_flusher
+    future = asyncio.get_running_loop().create_future()
+    _revocation_queue.append((client_name, future))
+    if _revocation_flusher is None:
+        _revocation_flusher = asyncio.create_task(_flush_revocations())
+    await future
+
+
+async def ensure_openvpn_initialized():
+    """Runs init_openvpn() once per process (normally at startup)."""
+    global openvpn_initialized
+    if openvpn_initialized:
+        return
+    async with pki_lock:
+        if not openvpn_initialized:
+            await init_openvpn()
+            openvpn_initialized = True
 
 
 async def add_openvpn(client_name, client_cert_expire_days=3650):
     print(f"\nAdding/Renewing OpenVPN client: {client_name}")
-    await set_server_host_file_name(client_name, config.get("OPENVPN_HOST"))
     pki_dir = os.path.join(config.EASYRSA_DIR, "pki")
 
     client_crt_path = os.path.join(pki_dir, "issued", f"{client_name}.crt")
@@ -293,18 +676,29 @@ async def add_openvpn(client_name, client_cert_expire_days=3650):
     else:
         print("Client does not exist. Building new client certificate.")
 
+    # Key and request generation only touches the client's own files and
+    # can run concurrently; signing updates index.txt/serial and cannot
     await run_command([
         "/usr/share/easy-rsa/easyrsa",
         "--batch",
-        "build-client-full",
+        "gen-req",
         client_name,
         "nopass",
     ],
-                      cwd=config.EASYRSA_DIR,
-                      env={
-                          "EASYRSA_CERT_EXPIRE": str(client_cert_expire_days),
-                          **os.environ
-                      })
+                      cwd=config.EASYRSA_DIR)
+    async with pki_lock:
+        await run_command([
+            "/usr/share/easy-rsa/easyrsa",
+            "--batch",
+            "sign-req",
+            "client",
+            client_name,
+        ],
+                          cwd=config.EASYRSA_DIR,
+                          env={
+                              "EASYRSA_CERT_EXPIRE": str(client_cert_expire_days),
+                              **os.environ
+                          })
 
     client_keys_dir = os.path.join(config.OPENVPN_DIR, "client/keys")
     await asyncio.to_thread(
@@ -314,8 +708,17 @@ async def add_openvpn(client_name, client_cert_expire_days=3650):
         shutil.copy, client_key_path,
         os.path.join(client_keys_dir, f"{client_name}.key"))
 
-    ca_cert_content = await extract_cert_content(
-        os.path.join(config.OPENVPN_DIR, "server/keys/ca.crt"))
+    if not LAZY_PROFILES:
+        await write_openvpn_profiles(client_name)
+
+
+async def write_openvpn_profiles(client_name, prefixes=None):
+    """Renders OpenVPN profiles from the client's certificate and key in client/keys."""
+    server_host, _ = await set_server_host_file_name(
+        client_name, config.get("OPENVPN_HOST"))
+    client_keys_dir = os.path.join(config.OPENVPN_DIR, "client/keys")
+
+    ca_cert_content = await get_ca_cert()
     client_cert_content = await extract_cert_content(
         os.path.join(client_keys_dir, f"{client_name}.crt"))
     async with aiofiles.open(
@@ -327,10 +730,9 @@ async def add_openvpn(client_name, client_cert_expire_days=3650):
 
     client_dir = os.path.join(config.CLIENT_BASE_DIR, client_name)
     await asyncio.to_thread(os.makedirs, client_dir, exist_ok=True)
-    current_date = datetime.now().strftime("%y-%m-%d")
 
     render_vars = {
-        "SERVER_HOST": SERVER_HOST,
+        "SERVER_HOST": server_host,
         "CA_CERT": ca_cert_content,
         "CLIENT_CERT": client_cert_content,
         "CLIENT_KEY": client_key_content,
@@ -339,19 +741,12 @@ async def add_openvpn(client_name, client_cert_expire_days=3650):
     }
 
     templates_dir = os.path.join(config.OPENVPN_DIR, "client/templates")
-    templates = {
-        "antizapret-udp.conf": f"AZ-UDP-{current_date}.ovpn",
-        "antizapret-tcp.conf": f"AZ-TCP-{current_date}.ovpn",
-        "antizapret.conf": f"AZ-U+T-{current_date}.ovpn",
-        "vpn-udp.conf": f"GL-UDP-{current_date}.ovpn",
-        "vpn-tcp.conf": f"GL-TCP-{current_date}.ovpn",
-        "vpn.conf": f"GL-U+T-{current_date}.ovpn",
-    }
-
-    for template, output_filename in templates.items():
+    for prefix, template in OPENVPN_PROFILES.items():
+        if prefixes is not None and prefix not in prefixes:
+            continue
         template_path = os.path.join(templates_dir, template)
         if await asyncio.to_thread(os.path.exists, template_path):
-            output_path = os.path.join(client_dir, output_filename)
+            output_path = os.path.join(client_dir, profile_file_name(prefix))
             rendered_content = await render(template_path, render_vars)
             async with aiofiles.open(output_path, "w") as f:
                 await f.write(rendered_content)
@@ -363,20 +758,7 @@ async def add_openvpn(client_name, client_cert_expire_days=3650):
 
 async def delete_openvpn(client_name):
     print(f"\nDeleting OpenVPN client: {client_name}")
-    await run_command(
-        ["/usr/share/easy-rsa/easyrsa", "--batch", "revoke", client_name],
-        cwd=config.EASYRSA_DIR)
-    await run_command(["/usr/share/easy-rsa/easyrsa", "gen-crl"],
-                      cwd=config.EASYRSA_DIR,
-                      env={
-                          "EASYRSA_CRL_DAYS": "3650",
-                          **os.environ
-                      })
-    pki_dir = os.path.join(config.EASYRSA_DIR, "pki")
-    crl_src = os.path.join(pki_dir, "crl.pem")
-    crl_dest = os.path.join(config.OPENVPN_DIR, "server/keys/crl.pem")
-    await asyncio.to_thread(shutil.copy, crl_src, crl_dest)
-    await asyncio.to_thread(os.chmod, crl_dest, 0o644)
+    await revoke_openvpn(client_name)
 
     if await asyncio.to_thread(
             os.path.exists, os.path.join(config.CLIENT_BASE_DIR, client_name)):
@@ -397,18 +779,16 @@ async def init_wireguard():
     key_path = os.path.join(config.WIREGUARD_DIR, "key")
 
     if not await asyncio.to_thread(os.path.exists, key_path):
-        private_key, _ = await run_command(["wg", "genkey"])
-        public_key, _ = await run_command(["wg", "pubkey"],
-                                          input_data=private_key)
+        private_key, public_key = await generate_wg_keypair()
 
         async with aiofiles.open(key_path, "w") as f:
             await f.write(
-                f"PRIVATE_KEY={private_key.strip()}\nPUBLIC_KEY={public_key.strip()}\n"
+                f"PRIVATE_KEY={private_key}\nPUBLIC_KEY={public_key}\n"
             )
 
         render_vars = {
-            "PRIVATE_KEY": private_key.strip(),
-            "PUBLIC_KEY": public_key.strip(),
+            "PRIVATE_KEY": private_key,
+            "PUBLIC_KEY": public_key,
             "SERVER_IP": SERVER_IP,
             **config.config,
         }
@@ -427,9 +807,125 @@ async def init_wireguard():
         print("WireGuard/AmneziaWG server keys already exist.")
 
 
-async def add_wireguard(client_name):
-    print(f"\nAdding WireGuard/AmneziaWG client: {client_name}")
-    await set_server_host_file_name(client_name, config.get("WIREGUARD_HOST"))
+def _wg_keypair_native():
+    """Generates a WireGuard keypair in-process (same clamping as wg genkey)."""
+    private_bytes = bytearray(secrets.token_bytes(32))
+    private_bytes[0] &= 248
+    private_bytes[31] &= 127
+    private_bytes[31] |= 64
+    public_bytes = X25519PrivateKey.from_private_bytes(
+        bytes(private_bytes)).public_key().public_bytes(
+            serialization.Encoding.Raw, serialization.PublicFormat.Raw)
+    return (base64.b64encode(private_bytes).decode(),
+            base64.b64encode(public_bytes).decode())
+
+
+async def _wg_keypair_subprocess():
+    private_key, _ = await run_command(["wg", "genkey"])
+    public_key, _ = await run_command(["wg", "pubkey"], input_data=private_key)
+    return private_key.strip(), public_key.strip()
+
+
+async def generate_wg_keypair(native=None):
+    """Returns (private_key, public_key) in WireGuard base64 format.
+
+    Uses the cryptography package and falls back to the wg binary when it
+    cannot be imported (or when native=False).
+    """
+    if native is None:
+        native = X25519PrivateKey is not None
+    if native:
+        return _wg_keypair_native()
+    return await _wg_keypair_subprocess()
+
+
+async def generate_wg_psk(native=None):
+    if native is None:
+        native = X25519PrivateKey is not None
+    if native:
+        # wg genpsk is just 32 random bytes in base64
+        return base64.b64encode(secrets.token_bytes(32)).decode()
+    preshared_key, _ = await run_command(["wg", "genpsk"])
+    return preshared_key.strip()
+
+
+async def generate_wg_keys(native=None):
+    if native is None:
+        native = X25519PrivateKey is not None
+    # Batches generate keys for all peers at once; bound the wg processes
+    async with nullcontext() if native else _wg_keygen_slots:
+        private_key, public_key = await generate_wg_keypair(native)
+        return private_key, public_key, await generate_wg_psk(native)
+
+
+async def apply_peer_changes(changes, sync=True):
+    """Applies a batch of peer additions and removals to all WireGuard configs.
+
+    changes is a list of (client_name, action) pairs, action being "add"
+    (create or recreate the peer with fresh keys) or "remove". Changes are
+    applied to the cached WgConfig model of every interface, which is then
+    written once atomically and, with sync=True, synced to the running
+    interface once.
+
+    Returns (added, removed): added maps client name to {wg_type: WgPeer},
+    removed is the set of removed client names found in any config.
+    """
+    adds = list(dict.fromkeys(name for name, action in changes if action == "add"))
+    removes = {name for name, action in changes if action == "remove"}
+    added = defaultdict(dict)
+    removed = set()
+
+    for wg_type in WG_INTERFACES:
+        conf_path = os.path.join(config.WIREGUARD_DIR, f"{wg_type}.conf")
+        if not await asyncio.to_thread(os.path.exists, conf_path):
+            continue
+        keys = await asyncio.gather(*(generate_wg_keys() for _ in adds))
+        lock_path = f"{conf_path}.lock"
+
+        async with wg_config_locks[conf_path], file_lock(lock_path):
+            wg_config = await load_wg_config(conf_path)
+            try:
+                changed = False
+                for client_name in removes:
+                    if wg_config.remove_peer(client_name):
+                        print(f"Removed client '{client_name}' from {wg_type}.conf")
+                        removed.add(client_name)
+                        changed = True
+
+                for client_name, client_keys in zip(adds, keys):
+                    if client_name in wg_config.peers:
+                        print(
+                            f"Client '{client_name}' exists in {wg_type}.conf. Recreating..."
+                        )
+                        changed = True
+                    peer = wg_config.add_peer(client_name, *client_keys)
+                    if peer is None:
+                        await handle_error(
+                            "N/A", "IP assignment",
+                            f"No available IPs in the {wg_type} subnet for '{client_name}'!")
+                        continue
+                    added[client_name][wg_type] = peer
+                    changed = True
+
+                if changed:
+                    await write_file_atomic(conf_path, wg_config.format())
+                    _wg_configs[conf_path] = (await _file_signature(conf_path),
+                                              wg_config)
+            except BaseException:
+                # The model may be ahead of the file now — re-read it next time
+                _wg_configs.pop(conf_path, None)
+                raise
+
+        if changed and sync:
+            await sync_wireguard_config(wg_type)
+
+    return dict(added), removed
+
+
+async def write_wireguard_profiles(client_name, peers, prefixes=None):
+    """Renders WG/AmneziaWG client profiles for peers given as {wg_type: WgPeer}."""
+    server_host, _ = await set_server_host_file_name(
+        client_name, config.get("WIREGUARD_HOST"))
 
     key_path = os.path.join(config.WIREGUARD_DIR, "key")
     if not await asyncio.to_thread(os.path.exists, key_path):
@@ -439,166 +935,451 @@ async def add_wireguard(client_name):
             "WireGuard server keys not found. Run init_wireguard first.",
         )
 
-    async with aiofiles.open(key_path, "r") as f:
-        content = await f.read()
-        server_public_key = re.search(r"PUBLIC_KEY=(.*)", content).group(1)
-
-    ips_path = os.path.join(config.WIREGUARD_DIR, "ips")
-    ips_content = ""
-    if await asyncio.to_thread(os.path.exists, ips_path):
-        async with aiofiles.open(ips_path, "r") as f:
-            ips_content = await f.read()
+    server_public_key = await get_server_wg_public_key()
+    ips_content = await get_wg_ips()
 
     client_dir = os.path.join(config.CLIENT_BASE_DIR, client_name)
     await asyncio.to_thread(os.makedirs, client_dir, exist_ok=True)
-    current_date = datetime.now().strftime("%y-%m-%d")
-
-    for wg_type in ["antizapret", "vpn"]:
-        print(f"Processing {wg_type.capitalize()} WireGuard configuration...")
-        conf_path = os.path.join(config.WIREGUARD_DIR, f"{wg_type}.conf")
-        lock_path = f"{conf_path}.lock"
-
-        async with file_lock(lock_path):
-            if await modify_wg_config(conf_path, client_name):
-                print(
-                    f"Client '{client_name}' exists in {wg_type}.conf. Recreating..."
-                )
-
-            client_private_key, _ = await run_command(["wg", "genkey"])
-            client_public_key, _ = await run_command(
-                ["wg", "pubkey"], input_data=client_private_key)
-            client_preshared_key, _ = await run_command(["wg", "genpsk"])
-
-            async with aiofiles.open(conf_path, "r") as f:
-                conf_content = await f.read()
-                base_ip_match = re.search(
-                    r"Address = (\d{1,3}\.\d{1,3}\.\d{1,3})", conf_content)
-                base_client_ip = base_ip_match.group(1)
-
-                existing_ips = set(
-                    re.findall(r"(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})",
-                               conf_content))
-
-            client_ip = ""
-            for i in range(2, 255):
-                potential_ip = f"{base_client_ip}.{i}"
-                if potential_ip not in existing_ips:
-                    client_ip = potential_ip
-                    break
-
-            if not client_ip:
-                await handle_error(
-                    "N/A", "IP assignment",
-                    f"No available IPs in the {wg_type} subnet!")
-
-            new_peer_block = (
-                f"# Client = {client_name}\n# PrivateKey = {client_private_key.strip()}\n[Peer]\n"
-                f"PublicKey = {client_public_key.strip()}\nPresharedKey = {client_preshared_key.strip()}\n"
-                f"AllowedIPs = {client_ip}/32")
-            await modify_wg_config(conf_path, client_name, new_peer_block)
-
-        await sync_wireguard_config(wg_type)
+    templates_dir = os.path.join(config.WIREGUARD_DIR, "templates")
 
+    for prefix, (wg_type, suffix) in WIREGUARD_PROFILES.items():
+        if wg_type not in peers or (prefixes is not None
+                                    and prefix not in prefixes):
+            continue
+        peer = peers[wg_type]
         render_vars = {
-            "SERVER_HOST": SERVER_HOST,
+            "SERVER_HOST": server_host,
             "PUBLIC_KEY": server_public_key,
-            "CLIENT_PRIVATE_KEY": client_private_key.strip(),
-            "CLIENT_PUBLIC_KEY": client_public_key.strip(),
-            "CLIENT_PRESHARED_KEY": client_preshared_key.strip(),
-            "CLIENT_IP": client_ip,
+            "CLIENT_PRIVATE_KEY": peer.private_key,
+            "CLIENT_PUBLIC_KEY": peer.public_key,
+            "CLIENT_PRESHARED_KEY": peer.preshared_key,
+            "CLIENT_IP": peer.ip,
             "IPS": ips_content,
             **config.config,
         }
-
-        templates_dir = os.path.join(config.WIREGUARD_DIR, "templates")
-        prefix = "AZ" if wg_type == "antizapret" else "GL"
-
-        for suffix in ["wg", "am"]:
-            template_name = f"{wg_type}-client-{suffix}.conf"
-            output_name = f"{prefix}-{suffix.upper()}-{current_date}.conf"
-            template_path = os.path.join(templates_dir, template_name)
-            if await asyncio.to_thread(os.path.exists, template_path):
-                rendered_conf = await render(template_path, render_vars)
-                async with aiofiles.open(os.path.join(client_dir, output_name),
-                                         "w") as f:
-                    await f.write(rendered_conf)
+        template_path = os.path.join(templates_dir,
+                                     f"{wg_type}-client-{suffix}.conf")
+        if await asyncio.to_thread(os.path.exists, template_path):
+            rendered_conf = await render(template_path, render_vars)
+            async with aiofiles.open(
+                    os.path.join(client_dir, profile_file_name(prefix)),
+                    "w") as f:
+                await f.write(rendered_conf)
 
     print(
         f"WireGuard/AmneziaWG profile files (re)created for client '{client_name}' at {client_dir}"
     )
 
 
-async def delete_wireguard(client_name):
-    print(f"\nDeleting WireGuard/AmneziaWG client: {client_name}")
+async def add_wireguard(client_name, sync=True):
+    print(f"\nAdding WireGuard/AmneziaWG client: {client_name}")
+    await add_wireguard_batch([client_name], sync=sync)
 
-    client_found = False
-    for wg_type in ["antizapret", "vpn"]:
-        conf_path = os.path.join(config.WIREGUARD_DIR, f"{wg_type}.conf")
-        if await modify_wg_config(conf_path, client_name, new_peer_block=None):
-            print(f"Removed client '{client_name}' from {wg_type}.conf")
-            client_found = True
-            await sync_wireguard_config(wg_type)
 
-    if not client_found:
-        print(
-            f"Failed to delete client '{client_name}'! Client not found in any config."
-        )
+async def add_wireguard_batch(client_names, sync=True):
+    """Adds or recreates several WireGuard peers with one write and sync per interface."""
+    added, _ = await apply_peer_changes([(name, "add") for name in client_names],
+                                        sync=sync)
+    if LAZY_PROFILES:
         return
+    for client_name in client_names:
+        await write_wireguard_profiles(client_name, added.get(client_name, {}))
 
-    if await asyncio.to_thread(
-            os.path.exists, os.path.join(config.CLIENT_BASE_DIR, client_name)):
-        await asyncio.to_thread(
-            shutil.rmtree, os.path.join(config.CLIENT_BASE_DIR, client_name))
-    print(f"WireGuard/AmneziaWG client '{client_name}' successfully deleted")
+
+async def delete_wireguard(client_name, sync=True):
+    print(f"\nDeleting WireGuard/AmneziaWG client: {client_name}")
+    await delete_wireguard_batch([client_name], sync=sync)
+
+
+async def delete_wireguard_batch(client_names, sync=True):
+    """Removes several WireGuard peers with one write and sync per interface."""
+    _, removed = await apply_peer_changes(
+        [(name, "remove") for name in client_names], sync=sync)
+
+    for client_name in client_names:
+        if client_name not in removed:
+            print(
+                f"Failed to delete client '{client_name}'! Client not found in any config."
+            )
+            continue
+        client_dir = os.path.join(config.CLIENT_BASE_DIR, client_name)
+        if await asyncio.to_thread(os.path.exists, client_dir):
+            await asyncio.to_thread(shutil.rmtree, client_dir)
+        print(f"WireGuard/AmneziaWG client '{client_name}' successfully deleted")
 
 
 # --- Xray Functions ---
-def get_xray_client(host, port):
-    try:
-        return XrayClient(host, port)
-    except Exception as e:
-        raise ConnectionError(
-            f"Error connecting to Xray API on {host}:{port}: {e}")
-
-
-async def create_table():
-    if not await asyncio.to_thread(os.path.exists,
-                                   os.path.dirname(config.XRAY_DB_PATH)):
-        await asyncio.to_thread(os.makedirs,
-                                os.path.dirname(config.XRAY_DB_PATH))
-    async with aiosqlite.connect(config.XRAY_DB_PATH) as conn:
-        await conn.execute(
-            "CREATE TABLE IF NOT EXISTS users (uuid TEXT PRIMARY KEY, email TEXT NOT NULL UNIQUE)"
-        )
-        await conn.execute(
-            "CREATE INDEX IF NOT EXISTS idx_email ON users (email)")
-        await conn.commit()
+XRAY_INBOUND_TAG = "in-vless"
+XRAY_FLOW = "xtls-rprx-vision"
+XRAY_CONNECT_TIMEOUT = 3  # seconds to wait for the gRPC channel to become ready
+XRAY_HEALTH_INTERVAL = 30  # seconds a successful readiness check is trusted
+XRAY_RETRY_DELAYS = (1, 2, 4)  # backoff between reconnection attempts
+XRAY_FAILURE_COOLDOWN = 30  # seconds to fail fast after all attempts failed
+XRAY_RESYNC_BATCH = 200  # xray.db rows per page and per add_clients call
+XRAY_RESYNC_CONCURRENCY = 4  # add_clients batches in flight during a resync
+
+
+class XrayApiClient(APIService):
+    """xtlsapi client on a gRPC channel created and closed by XrayConnection."""
+
+    def __init__(self, channel):
+        self._channel = channel  # BaseService builds its stubs from it
+        super().__init__()
+
+
+class XrayConnection:
+    """A single long-lived Xray API client shared by all operations.
+
+    The gRPC channel is opened once and its readiness is re-checked at most
+    every XRAY_HEALTH_INTERVAL seconds or after a failed call. A dead channel
+    is closed and reopened with backoff; when Xray stays unreachable, calls
+    fail fast with ConnectionError for XRAY_FAILURE_COOLDOWN seconds instead
+    of each waiting through the whole backoff again.
+    """
+
+    def __init__(self):
+        self._channel = None
+        self._client = None
+        self._address = None
+        self._checked_at = 0.0
+        self._failed_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _close(self):
+        if self._channel is not None:
+            self._channel.close()
+            self._channel = None
+            self._client = None
+
+    @staticmethod
+    def _wait_ready(channel):
+        future = grpc.channel_ready_future(channel)
+        try:
+            future.result(timeout=XRAY_CONNECT_TIMEOUT)
+            return True
+        except grpc.FutureTimeoutError:
+            # Stops the future from watching the channel state
+            future.cancel()
+            return False
+
+    async def get(self):
+        """Returns a ready XrayApiClient, reconnecting if the channel is dead."""
+        async with self._lock:
+            address = (config.XRAY_API_HOST, config.XRAY_API_PORT)
+            if address != self._address:
+                self._close()
+                self._address = address
+                self._failed_until = 0.0
+
+            now = time.monotonic()
+            if self._channel is not None:
+                if now - self._checked_at < XRAY_HEALTH_INTERVAL:
+                    return self._client
+                if await asyncio.to_thread(self._wait_ready, self._channel):
+                    self._checked_at = time.monotonic()
+                    return self._client
+                print("Xray API connection lost, reconnecting...")
+                self._close()
+
+            if now < self._failed_until:
+                raise ConnectionError(
+                    f"Xray API on {address[0]}:{address[1]} is unavailable")
+
+            for delay in (0, *XRAY_RETRY_DELAYS):
+                await asyncio.sleep(delay)
+                channel = grpc.insecure_channel(f"{address[0]}:{address[1]}")
+                if await asyncio.to_thread(self._wait_ready, channel):
+                    self._channel = channel
+                    self._client = XrayApiClient(channel)
+                    self._checked_at = time.monotonic()
+                    return self._client
+                channel.close()
+
+            self._failed_until = time.monotonic() + XRAY_FAILURE_COOLDOWN
+            raise ConnectionError(
+                f"Error connecting to Xray API on {address[0]}:{address[1]}")
+
+    def mark_failed(self):
+        """Forces a readiness check before the next call."""
+        self._checked_at = 0.0
+
+    async def add_clients(self, clients):
+        """Adds (uuid, email) pairs to the VLESS inbound over one channel.
+
+        Returns the emails that are present in Xray afterwards.
+        """
+        client = await self.get()
+
+        def add_all():
+            added = []
+            for uuid, email in clients:
+                try:
+                    client.add_client(XRAY_INBOUND_TAG, uuid, email,
+                                      flow=XRAY_FLOW)
+                except xray_exceptions.EmailAlreadyExists:
+                    pass
+                except xray_exceptions.XRayException as e:
+                    print(f"Failed to add user '{email}' to Xray: {e.details}")
+                    self.mark_failed()
+                    continue
+                added.append(email)
+            return added
+
+        return await asyncio.to_thread(add_all)
+
+    async def remove_clients(self, emails):
+        """Removes users from the VLESS inbound over one channel.
+
+        Returns the emails that are absent from Xray afterwards.
+        """
+        client = await self.get()
+
+        def remove_all():
+            removed = []
+            for email in emails:
+                try:
+                    client.remove_client(XRAY_INBOUND_TAG, email)
+                except xray_exceptions.EmailNotFound:
+                    pass
+                except xray_exceptions.XRayException as e:
+                    print(f"Failed to remove user '{email}' from Xray: {e.details}")
+                    self.mark_failed()
+                    continue
+                removed.append(email)
+            return removed
+
+        return await asyncio.to_thread(remove_all)
+
+    async def list_clients(self):
+        """Returns {email: uuid} of all users in the VLESS inbound in one call."""
+        client = await self.get()
+
+        def list_all():
+            response = client.handler_stub.GetInboundUsers(
+                command_pb2.GetInboundUserRequest(tag=XRAY_INBOUND_TAG),
+                timeout=XRAY_CONNECT_TIMEOUT)
+            users = {}
+            for user in response.users:
+                account = vless_account_pb2.Account.FromString(
+                    user.account.value)
+                users[user.email] = account.id
+            return users
+
+        try:
+            return await asyncio.to_thread(list_all)
+        except grpc.RpcError as e:
+            self.mark_failed()
+            raise ConnectionError(f"Error listing Xray inbound users: {e}")
+
+
+xray = XrayConnection()
+
+
+XRAY_DB_READERS = 2
+BOT_CLIENT_NAME = re.compile(r"n\d+")  # Xray emails of clients created by create_user
+xray_db = None  # ConnectionPool to xray.db, opened on first use
+_xray_db_lock = asyncio.Lock()
+# Serializes changes of the Xray user set (xray.db and the inbound) so that
+# reconciliation never sees a half-added or half-removed user
+xray_users_lock = asyncio.Lock()
+
+
+async def open_xray_db():
+    """Returns the xray.db connection pool, creating the schema on first use."""
+    global xray_db
+    if xray_db is not None:
+        return xray_db
+    async with _xray_db_lock:
+        if xray_db is None:
+            await asyncio.to_thread(os.makedirs,
+                                    os.path.dirname(config.XRAY_DB_PATH),
+                                    exist_ok=True)
+            # xray.db belongs to antizapret: keep its journal mode
+            store = ConnectionPool(config.XRAY_DB_PATH,
+                                   readers=XRAY_DB_READERS,
+                                   journal_mode=None)
+            await store.open()
+            async with store.writer() as conn:
+                await conn.execute(
+                    "CREATE TABLE IF NOT EXISTS users (uuid TEXT PRIMARY KEY, email TEXT NOT NULL UNIQUE)"
+                )
+                await conn.execute(
+                    "CREATE INDEX IF NOT EXISTS idx_email ON users (email)")
+            xray_db = store
+    return xray_db
+
+
+async def close_xray_db():
+    global xray_db
+    if xray_db is not None:
+        await xray_db.close()
+        xray_db = None
 
 
 async def add_user_to_db(uuid, identifier):
+    store = await open_xray_db()
     try:
-        async with aiosqlite.connect(config.XRAY_DB_PATH) as conn:
+        async with store.writer() as conn:
             await conn.execute("INSERT INTO users (uuid, email) VALUES (?, ?)",
                                (uuid, identifier))
-            await conn.commit()
-            return True
+        return True
     except sqlite3.IntegrityError:
         print(f"Error: User with identifier '{identifier}' already exists.")
         return False
 
 
 async def get_user_by_identifier_from_db(identifier):
-    async with aiosqlite.connect(config.XRAY_DB_PATH) as conn:
+    store = await open_xray_db()
+    async with store.reader() as conn:
         async with conn.execute("SELECT * FROM users WHERE email = ?",
                                 (identifier, )) as cursor:
             return await cursor.fetchone()
 
 
+async def get_all_users_from_db():
+    """Returns (uuid, email) of every Xray user in xray.db."""
+    store = await open_xray_db()
+    async with store.reader() as conn:
+        async with conn.execute("SELECT uuid, email FROM users") as cursor:
+            return await cursor.fetchall()
+
+
+async def iter_users_from_db(batch_size):
+    """Yields lists of (uuid, email) from xray.db, batch_size rows at a time.
+
+    Rows are paged by rowid, so each page is a short read and the whole
+    table is never held in memory.
+    """
+    store = await open_xray_db()
+    last_rowid = 0
+    while True:
+        async with store.reader() as conn:
+            async with conn.execute(
+                    "SELECT rowid, uuid, email FROM users WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                (last_rowid, batch_size)) as cursor:
+                rows = await cursor.fetchall()
+        if not rows:
+            return
+        last_rowid = rows[-1][0]
+        yield [(uuid, email) for _, uuid, email in rows]
+
+
 async def remove_user_from_db(email):
-    async with aiosqlite.connect(config.XRAY_DB_PATH) as conn:
-        conn.row_factory = aiosqlite.Row
+    store = await open_xray_db()
+    async with store.writer() as conn:
         await conn.execute("DELETE FROM users WHERE email = ?", (email, ))
-        await conn.commit()
+
+
+async def resync_xray(concurrency=XRAY_RESYNC_CONCURRENCY,
+                      batch_size=XRAY_RESYNC_BATCH):
+    """Re-adds every user from xray.db to the VLESS inbound.
+
+    Xray keeps API-added clients only in memory, so after an Xray restart
+    all VLESS users lose access. Batches streamed from xray.db are added by
+    `concurrency` workers sharing the Xray channel; users that are already
+    present are left as they are. Returns a dict with the counts and the
+    elapsed time in seconds.
+    """
+    concurrency = max(1, concurrency)
+    started = time.monotonic()
+    total = 0
+    registered = 0
+    failed = 0
+    queue = asyncio.Queue(maxsize=concurrency)
+
+    async def worker():
+        nonlocal registered, failed
+        while True:
+            batch = await queue.get()
+            if batch is None:
+                return
+            try:
+                present = len(await xray.add_clients(batch))
+            except Exception as e:
+                # A dead worker would leave the reader blocked on a full queue
+                print(f"Xray resync: batch of {len(batch)} users failed: {e}")
+                present = 0
+            registered += present
+            failed += len(batch) - present
+
+    async with xray_users_lock:
+        # Fail at once instead of once per batch if Xray is down
+        await xray.get()
+        workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+        try:
+            async for batch in iter_users_from_db(batch_size):
+                total += len(batch)
+                await queue.put(batch)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+
+    elapsed = time.monotonic() - started
+    result = {
+        "total": total,
+        "registered": registered,
+        "failed": failed,
+        "elapsed": elapsed,
+    }
+    print(
+        f"Xray resync: {registered}/{total} users registered, {failed} failed "
+        f"in {elapsed:.2f}s ({total / elapsed if elapsed else 0:.0f} users/s)")
+    return result
+
+
+def same_uuid(a, b):
+    """Compares UUIDs regardless of form: Xray reports them with dashes."""
+    try:
+        return uuid_module.UUID(a) == uuid_module.UUID(b)
+    except ValueError:
+        return a == b
+
+
+async def reconcile_xray():
+    """Brings the VLESS inbound in line with xray.db in one pass.
+
+    Xray keeps API-added clients only in memory, so after a restart (or a
+    failed call) the inbound drifts from xray.db. The inbound user list is
+    fetched with a single call and compared with xray.db: missing users are
+    added, users with a different UUID are re-added, and bot clients
+    (n<user_id>) unknown to xray.db are removed, each group in one batch
+    over the shared channel. Other inbound users are left untouched.
+    Returns a dict with the counts.
+    """
+    async with xray_users_lock:
+        users = await get_all_users_from_db()
+        live = await xray.list_clients()
+
+        known = {email for _, email in users}
+        missing = [(uuid, email) for uuid, email in users if email not in live]
+        changed = [(uuid, email) for uuid, email in users
+                   if email in live and not same_uuid(live[email], uuid)]
+        # Clients defined statically in the Xray config are not ours to remove
+        extra = [
+            email for email in live
+            if email not in known and BOT_CLIENT_NAME.fullmatch(email)
+        ]
+
+        stale = [email for _, email in changed] + extra
+        removed = set(await xray.remove_clients(stale)) if stale else set()
+        to_add = missing + [(uuid, email) for uuid, email in changed
+                            if email in removed]
+        added = await xray.add_clients(to_add) if to_add else []
+
+    result = {
+        "db": len(users),
+        "xray": len(live),
+        "missing": len(missing),
+        "changed": len(changed),
+        "extra": len(extra),
+        "added": len(added),
+        "removed": len(removed & set(extra)),
+    }
+    print(f"Xray reconciliation: {result}")
+    return result
 
 
 def generate_vless_link(user_id, server_host, public_key, server_names,
@@ -719,162 +1500,431 @@ def generate_client_config(user_id, server_host, public_key, server_names,
     }
 
 
-async def handle_add_user(identifier, xray_client):
-    user = await get_user_by_identifier_from_db(identifier)
-    if user:
-        user_id = user[0]
-        print(
-            f"User '{identifier}' exists. Recreating Xray client and configs..."
-        )
-        await asyncio.to_thread(xray_client.remove_client, "in-vless",
-                                identifier)
-    else:
-        user_id = utils.generate_random_user_id()
-        if not await add_user_to_db(user_id, identifier):
-            return
-        print(
-            f"User '{identifier}' not found. Created new user with ID {user_id}."
-        )
+async def handle_add_user(identifier):
+    await handle_add_users([identifier])
 
-    try:
-        add_client_result = await asyncio.to_thread(xray_client.add_client,
-                                                    "in-vless",
-                                                    user_id,
-                                                    identifier,
-                                                    flow="xtls-rprx-vision")
-        if not add_client_result:
-            print(
-                f"Failed to add user '{identifier}' to Xray. The user may already exist."
-            )
-            return
+
+async def handle_add_users(identifiers):
+    """Registers users in xray.db and re-adds them to Xray in one batch.
+
+    Users already in xray.db keep their UUID; they are removed from the
+    inbound first so that the client is recreated.
+    """
+    clients = []
+    existing = []
+    async with xray_users_lock:
+        for identifier in identifiers:
+            user = await get_user_by_identifier_from_db(identifier)
+            if user:
+                user_id = user[0]
+                existing.append(identifier)
+                print(
+                    f"User '{identifier}' exists. Recreating Xray client and configs..."
+                )
+            else:
+                user_id = utils.generate_random_user_id()
+                if not await add_user_to_db(user_id, identifier):
+                    continue
+                print(
+                    f"User '{identifier}' not found. Created new user with ID {user_id}."
+                )
+            clients.append((user_id, identifier))
+
+        if existing:
+            await xray.remove_clients(existing)
+        added = set(await xray.add_clients(clients))
+    for user_id, identifier in clients:
+        if identifier not in added:
+            continue
         print(f"User '{identifier}' successfully added to Xray.")
-    except Exception as e:
-        print(f"An exception occurred while adding user to Xray: {e}")
+        if not LAZY_PROFILES:
+            await write_xray_profiles(identifier, user_id)
+
+
+async def write_xray_profiles(identifier, user_id, prefixes=None):
+    """Writes the AZ-XR JSON config and the GL-XR VLESS link for an Xray user UUID."""
+    server_host = config.get("SERVER_HOST")
+    public_key = config.get("VLESS_PUBLIC_KEY")
+    server_names = config.get("VLESS_SERVER_NAMES")
+    short_id = config.get("VLESS_SHORT_ID")
+    if not all([server_host, public_key, server_names, short_id]):
+        print(
+            f"Warning: Missing VLESS config in {config.SERVER_CONFIG_PATH}. Skipping AZ-XR/GL-XR generation."
+        )
         return
 
+    client_name = re.sub(r"[^a-zA-Z0-9_.-]", "_", identifier)
+    dir_path = os.path.join(config.CLIENT_BASE_DIR, client_name)
+    await asyncio.to_thread(os.makedirs, dir_path, exist_ok=True)
+
     # Generate AZ-XR JSON config
-    az_server_host = config.get("SERVER_HOST")
-    az_public_key = config.get("VLESS_PUBLIC_KEY")
-    az_server_names = config.get("VLESS_SERVER_NAMES")
-    az_short_id = config.get("VLESS_SHORT_ID")
-
-    if all([az_server_host, az_public_key, az_server_names, az_short_id]):
-        az_client_config = generate_client_config(user_id, az_server_host,
-                                                  az_public_key,
-                                                  az_server_names, 443,
-                                                  az_short_id)
-        client_name = re.sub(r"[^a-zA-Z0-9_.-]", "_", identifier)
-        dir_path = os.path.join(config.CLIENT_BASE_DIR, client_name)
-        await asyncio.to_thread(os.makedirs, dir_path, exist_ok=True)
-        file_path = os.path.join(
-            dir_path, f"AZ-XR-{datetime.now().strftime('%y-%m-%d')}.json")
+    if prefixes is None or "AZ-XR" in prefixes:
+        az_client_config = generate_client_config(user_id, server_host,
+                                                  public_key, server_names,
+                                                  443, short_id)
+        file_path = os.path.join(dir_path, profile_file_name("AZ-XR"))
         async with aiofiles.open(file_path, "w") as f:
             await f.write(json.dumps(az_client_config, indent=4))
         print(f"AZ-XR JSON config saved to: {file_path}")
-    else:
-        print(
-            f"Warning: Missing AZ VLESS config in {config.SERVER_CONFIG_PATH}. Skipping AZ-XR JSON generation."
-        )
 
     # Generate GL-XR VLESS link
-    gb_server_host = config.get("SERVER_HOST")
-    gb_public_key = config.get("VLESS_PUBLIC_KEY")
-    gb_server_names = config.get("VLESS_SERVER_NAMES")
-    gb_short_id = config.get("VLESS_SHORT_ID")
-
-    if all([gb_server_host, gb_public_key, gb_server_names, gb_short_id]):
-        gb_vless_link = generate_vless_link(user_id, gb_server_host,
-                                            gb_public_key, gb_server_names,
-                                            443, gb_short_id,
+    if prefixes is None or "GL-XR" in prefixes:
+        gb_vless_link = generate_vless_link(user_id, server_host, public_key,
+                                            server_names, 443, short_id,
                                             identifier + "-GL")
-        client_name = re.sub(r"[^a-zA-Z0-9_.-]", "_", identifier)
-        dir_path = os.path.join(config.CLIENT_BASE_DIR, client_name)
-        await asyncio.to_thread(os.makedirs, dir_path, exist_ok=True)
-        file_path = os.path.join(
-            dir_path, f"GL-XR-{datetime.now().strftime('%y-%m-%d')}.txt")
+        file_path = os.path.join(dir_path, profile_file_name("GL-XR"))
         async with aiofiles.open(file_path, "w") as f:
             await f.write(gb_vless_link)
         print(f"GL-XR VLESS link saved to: {file_path}")
-    else:
-        print(
-            f"Warning: Missing GL VLESS config in {config.SERVER_CONFIG_PATH}. Skipping GL-XR link generation."
-        )
 
 
-async def handle_remove_user(identifier, xray_client):
-    user = await get_user_by_identifier_from_db(identifier)
-    if not user:
-        print(f"Error: User with identifier '{identifier}' not found.")
-        return
-    try:
-        await asyncio.to_thread(xray_client.remove_client, "in-vless",
-                                identifier)
-        print(f"User '{identifier}' removed from Xray.")
-    except Exception as e:
-        print(
-            f"Warning: Could not remove user from Xray (user might not exist there): {e}"
-        )
+async def handle_remove_user(identifier):
+    await handle_remove_users([identifier])
 
-    await remove_user_from_db(identifier)
-    print(f"User '{identifier}' removed from database.")
-    if await asyncio.to_thread(
-            os.path.exists,
-            os.path.join(config.CLIENT_BASE_DIR,
-                         re.sub(r"[^a-zA-Z0-9_.-]", "_", identifier))):
-        await asyncio.to_thread(
-            shutil.rmtree,
-            os.path.join(config.CLIENT_BASE_DIR,
-                         re.sub(r"[^a-zA-Z0-9_.-]", "_", identifier)))
+
+async def handle_remove_users(identifiers):
+    """Removes users from Xray in one batch, then from xray.db and disk."""
+    found = []
+    async with xray_users_lock:
+        for identifier in identifiers:
+            if await get_user_by_identifier_from_db(identifier):
+                found.append(identifier)
+            else:
+                print(f"Error: User with identifier '{identifier}' not found.")
+        if not found:
+            return
+
+        removed = set(await xray.remove_clients(found))
+        for identifier in found:
+            if identifier in removed:
+                print(f"User '{identifier}' removed from Xray.")
+            else:
+                print(
+                    f"Warning: Could not remove user '{identifier}' from Xray."
+                )
+            await remove_user_from_db(identifier)
+            print(f"User '{identifier}' removed from database.")
+    for identifier in found:
+        client_dir = os.path.join(config.CLIENT_BASE_DIR,
+                                  re.sub(r"[^a-zA-Z0-9_.-]", "_", identifier))
+        if await asyncio.to_thread(os.path.exists, client_dir):
+            await asyncio.to_thread(shutil.rmtree, client_dir)
+
+
+# --- Client Profiles ---
+def profile_extension(prefix):
+    if prefix in OPENVPN_PROFILES:
+        return "ovpn"
+    if prefix in WIREGUARD_PROFILES:
+        return "conf"
+    return XRAY_PROFILES[prefix]
+
+
+def profile_file_name(prefix):
+    return f"{prefix}-{datetime.now().strftime('%y-%m-%d')}.{profile_extension(prefix)}"
+
+
+async def find_profile(client_name, prefix):
+    """Returns the newest rendered profile file for the prefix, or None."""
+    client_dir = os.path.join(config.CLIENT_BASE_DIR, client_name)
+    try:
+        file_names = await asyncio.to_thread(os.listdir, client_dir)
+    except FileNotFoundError:
+        return None
+    extension = f".{profile_extension(prefix)}"
+    matches = [
+        name for name in file_names
+        if name.startswith(f"{prefix}-") and name.endswith(extension)
+    ]
+    # File names end with the yy-mm-dd render date
+    return os.path.join(client_dir, max(matches)) if matches else None
+
+
+async def ensure_profile(user_id, prefix):
+    """Returns the path of a client profile, rendering it on first request.
+
+    The profile is rendered from the key material kept for the user: the
+    certificate and key in client/keys for OpenVPN, the "# PrivateKey"
+    comment of the peer in the WireGuard config, and the UUID in xray.db.
+    Returns None if the user has no key material for this protocol.
+    """
+    client_name = f"n{user_id}"
+    async with user_locks[user_id]:
+        profile_path = await find_profile(client_name, prefix)
+        if profile_path:
+            return profile_path
+
+        await refresh_setup_config()
+        if prefix in OPENVPN_PROFILES:
+            client_cert = os.path.join(config.OPENVPN_DIR, "client/keys",
+                                       f"{client_name}.crt")
+            if not await asyncio.to_thread(os.path.exists, client_cert):
+                return None
+            await write_openvpn_profiles(client_name, [prefix])
+        elif prefix in WIREGUARD_PROFILES:
+            wg_type, _ = WIREGUARD_PROFILES[prefix]
+            peer = await get_wg_peer(wg_type, client_name)
+            if peer is None or not peer.private_key:
+                return None
+            await write_wireguard_profiles(client_name, {wg_type: peer},
+                                           [prefix])
+        elif prefix in XRAY_PROFILES:
+            xray_user = await get_user_by_identifier_from_db(client_name)
+            if not xray_user:
+                return None
+            await write_xray_profiles(client_name, xray_user[0], [prefix])
+        else:
+            raise ValueError(f"Unknown profile prefix: {prefix}")
+
+        return await find_profile(client_name, prefix)
+
+
+PROFILE_CACHE_SIZE = 1024
+_profile_cache = OrderedDict()  # (client_name, prefix) -> (file_name, content)
+_profile_generation = 0
+
+
+async def get_profile(user_id, prefix):
+    """Returns (file_name, content bytes) of a client profile.
+
+    Profiles are served from an in-memory LRU cache; on a miss the profile is
+    located (or rendered) with ensure_profile() and read once.
+    """
+    key = (f"n{user_id}", prefix)
+    cached = _profile_cache.get(key)
+    if cached is not None:
+        _profile_cache.move_to_end(key)
+        return cached
+
+    generation = _profile_generation
+    profile_path = await ensure_profile(user_id, prefix)
+    if profile_path is None:
+        return None
+    async with aiofiles.open(profile_path, "rb") as f:
+        profile = (os.path.basename(profile_path), await f.read())
+
+    # Do not cache a profile read while the user's keys were being replaced
+    if generation == _profile_generation:
+        _profile_cache[key] = profile
+        if len(_profile_cache) > PROFILE_CACHE_SIZE:
+            _profile_cache.popitem(last=False)
+    return profile
+
+
+def invalidate_profiles(client_names):
+    global _profile_generation
+    _profile_generation += 1
+    client_names = set(client_names)
+    for key in [key for key in _profile_cache if key[0] in client_names]:
+        del _profile_cache[key]
+
+
+async def remove_client_profiles(client_name):
+    client_dir = os.path.join(config.CLIENT_BASE_DIR, client_name)
+    if await asyncio.to_thread(os.path.exists, client_dir):
+        await asyncio.to_thread(shutil.rmtree, client_dir)
 
 
 # --- Main Integration Functions ---
-async def create_user(user_id):
+@asynccontextmanager
+async def hold_user_locks(user_ids):
+    """Acquires the per-user locks of several users in a fixed order."""
+    async with AsyncExitStack() as stack:
+        for user_id in sorted(set(user_ids)):
+            await stack.enter_async_context(user_locks[user_id])
+        yield
+
+
+# Operations in progress by (operation, user_id, ...) key
+_inflight = {}
+
+
+def _start_inflight(keys, coro):
+    """Starts coro as a task registered under each of the keys until it finishes."""
+    task = asyncio.ensure_future(coro)
+    for key in keys:
+        _inflight[key] = task
+
+    def forget(_):
+        for key in keys:
+            if _inflight.get(key) is task:
+                del _inflight[key]
+
+    task.add_done_callback(forget)
+    return task
+
+
+async def _join_inflight(key, coro_factory):
+    """Runs coro_factory() unless an operation with the same key is already running.
+
+    Concurrent callers await the same task; shield() keeps a cancelled caller
+    from cancelling the operation for everyone else.
+    """
+    task = _inflight.get(key)
+    if task is None:
+        task = _start_inflight([key], coro_factory())
+    return await asyncio.shield(task)
+
+
+async def has_openvpn_material(client_name):
+    """Checks that the client has an issued certificate and its key in client/keys."""
+    paths = [
+        os.path.join(config.EASYRSA_DIR, "pki", "issued", f"{client_name}.crt"),
+        os.path.join(config.OPENVPN_DIR, "client/keys", f"{client_name}.crt"),
+        os.path.join(config.OPENVPN_DIR, "client/keys", f"{client_name}.key"),
+    ]
+    for path in paths:
+        if not await asyncio.to_thread(os.path.exists, path):
+            return False
+    return True
+
+
+async def has_wireguard_material(client_name):
+    """Checks that the client has a peer with a private key on every interface."""
+    for wg_type in WG_INTERFACES:
+        peer = await get_wg_peer(wg_type, client_name)
+        if peer is None or not peer.private_key:
+            return False
+    return True
+
+
+async def create_user(user_id, wireguard=True, force=False):
+    """Creates the VPN profiles of a user.
+
+    Key material that already exists (the OpenVPN certificate, the WireGuard
+    peers) is kept, so repeated calls are cheap; force=True reissues it.
+    Concurrent calls with the same arguments join one in-flight operation.
+    With wireguard=False the WireGuard peers are left untouched so that a
+    caller can add them for many users at once via create_wireguard_users().
+    Returns True if key material was (re)issued, i.e. the profiles changed.
+    """
+    return await _join_inflight(("create", user_id, wireguard, force),
+                                lambda: _create_user(user_id, wireguard, force))
+
+
+async def _create_user(user_id, wireguard, force):
     client_name = f"n{user_id}"
     print(f"--- Creating user {client_name} ---")
 
-    async with openvpn_lock:
-        await init_openvpn()
-        await add_openvpn(client_name)
+    await refresh_setup_config()
+    await ensure_openvpn_initialized()
 
     async with user_locks[user_id]:
-        await init_wireguard()
-        await add_wireguard(client_name)
+        renew_openvpn = force or not await has_openvpn_material(client_name)
+        renew_wireguard = wireguard and (
+            force or not await has_wireguard_material(client_name))
+
+        if LAZY_PROFILES and (renew_openvpn or renew_wireguard):
+            # Profiles rendered from the old keys must not be served again
+            await remove_client_profiles(client_name)
+
+        if renew_openvpn:
+            await add_openvpn(client_name)
+        else:
+            print(f"OpenVPN client '{client_name}' already exists, keeping it.")
+
+        if renew_wireguard:
+            await init_wireguard()
+            await add_wireguard(client_name)
+        elif wireguard:
+            print(f"WireGuard client '{client_name}' already exists, keeping it.")
 
-        await create_table()
         try:
-            xray_client = await asyncio.to_thread(get_xray_client,
-                                                  config.XRAY_API_HOST,
-                                                  config.XRAY_API_PORT)
-            await handle_add_user(
-                client_name,
-                xray_client,
-            )
+            await handle_add_user(client_name)
         except ConnectionError as e:
             print(
                 f"Could not connect to Xray, skipping VLESS user creation: {e}"
             )
+        invalidate_profiles([client_name])
 
     print(f"--- User {client_name} created ---")
+    return renew_openvpn or renew_wireguard
 
 
-async def delete_user(user_id):
-    client_name = f"n{user_id}"
-    print(f"--- Deleting user {client_name} ---")
+async def create_wireguard_users(user_ids):
+    """(Re)creates WireGuard peers for many users with one write and sync per interface."""
+    await refresh_setup_config()
+    async with hold_user_locks(user_ids):
+        await init_wireguard()
+        client_names = [f"n{user_id}" for user_id in user_ids]
+        await add_wireguard_batch(client_names)
+        invalidate_profiles(client_names)
 
-    async with openvpn_lock:
-        await delete_openvpn(client_name)
 
-    async with user_locks[user_id]:
-        await delete_wireguard(client_name)
+async def delete_user(user_id):
+    failed = await delete_users([user_id])
+    if failed:
+        raise failed[user_id]
+
+
+async def delete_users(user_ids):
+    """Deletes all VPN profiles of the given users.
+
+    WireGuard peers of all users are removed in a single pass over each
+    interface config. Users whose deletion is already in progress are not
+    deleted again; the call waits for that deletion instead.
+
+    Returns {user_id: exception} for users whose access could not be fully
+    revoked; the other users are deleted.
+    """
+    user_ids = set(user_ids)
+    tasks = {}  # id(task) -> (task, user IDs of this call served by the task)
+    new_ids = []
+    for user_id in user_ids:
+        task = _inflight.get(("delete", user_id))
+        if task is None:
+            new_ids.append(user_id)
+        else:
+            tasks.setdefault(id(task), (task, []))[1].append(user_id)
+    if new_ids:
+        task = _start_inflight([("delete", user_id) for user_id in new_ids],
+                               _delete_users(new_ids))
+        tasks[id(task)] = (task, new_ids)
+
+    results = await asyncio.gather(
+        *(asyncio.shield(task) for task, _ in tasks.values()),
+        return_exceptions=True)
+    failed = {}
+    for (_, ids), result in zip(tasks.values(), results):
+        for user_id in ids:
+            error = result if isinstance(result,
+                                         BaseException) else result.get(user_id)
+            if error is not None:
+                failed[user_id] = error
+    return failed
+
+
+async def _delete_users(user_ids):
+    client_names = [f"n{user_id}" for user_id in user_ids]
+    print(f"--- Deleting users {', '.join(client_names)} ---")
+    failed = {}
+
+    async with hold_user_locks(user_ids):
+        # Revocations are queued together and share one CRL regeneration
+        results = await asyncio.gather(
+            *(delete_openvpn(client_name) for client_name in client_names),
+            return_exceptions=True)
+        for user_id, result in zip(user_ids, results):
+            if isinstance(result, Exception):
+                print(f"Failed to delete OpenVPN client 'n{user_id}': {result}")
+                failed[user_id] = result
+
         try:
-            xray_client = await asyncio.to_thread(get_xray_client,
-                                                  config.XRAY_API_HOST,
-                                                  config.XRAY_API_PORT)
-            await handle_remove_user(client_name, xray_client)
+            await delete_wireguard_batch(client_names)
+        except Exception as e:
+            print(f"Failed to delete WireGuard clients: {e}")
+            for user_id in user_ids:
+                failed.setdefault(user_id, e)
+        try:
+            await handle_remove_users(client_names)
         except ConnectionError as e:
-            print(
-                f"Could not connect to Xray, skipping VLESS user deletion: {e}"
-            )
+            # The VLESS clients stay in xray.db and would be restored by a
+            # resync, so the deletion has to be retried
+            print(f"Could not connect to Xray, VLESS users not deleted: {e}")
+            for user_id in user_ids:
+                failed.setdefault(user_id, e)
+        invalidate_profiles(client_names)
+    return failed
 
 
 async def set_server_ip_async():